@@ -0,0 +1,352 @@
+"""
+Measures the throughput and latency of the agents and of chunking.
+
+By default a stub Ollama server (see stub_ollama.py) is started in a child
+process, so results reflect the agents' own overhead plus the simulated
+model latency, and the stub's memory isn't counted in peak RSS. Point
+--ollama-host at a real server to size hosts instead.
+
+Every combination of agent, prompting mode, corpus size, document size,
+chunk size and concurrency is run once, and a JSON report is written to stdout or --output:
+
+    python benchmarks/run_benchmark.py --docs 20 100 --doc-words 200 2000 \\
+        --chunk-sizes 500 1000 --concurrency 1 4 --token-latency 0.005
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from content_guard import PROMPTING_MODES, ContentGuard, task as guard_task
+from tag_generator import TagGenerator, career_list as default_careers, task as tag_task
+from utils.backend import OllamaBackend
+from utils.chunk_data import DEFAULT_CHUNK_SIZE, chunk_prompt
+from utils.dispatch import DEFAULT_CONCURRENCY, DEFAULT_MODEL
+from utils.metrics import InMemoryMetrics
+
+AGENTS = ('guard', 'tags')
+STUB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_ollama.py")
+
+# Words the synthetic corpora are drawn from, so chunking sees realistic
+# word lengths
+VOCABULARY = (
+    "the of and to in a is that for it as was with be by on not he this are "
+    "or his from at which but have an they you were her she there been one "
+    "all we their has would when if so no will more about up out who get "
+    "backend developer database server api security network content policy "
+    "community moderation analysis platform feed engineering infrastructure "
+    "responsibility accountability transparency organisation deployment"
+).split()
+
+
+def make_corpus(docs, doc_words, seed=0):
+    """
+    Builds a reproducible corpus of synthetic documents.
+
+    Args:
+        docs (int): The number of documents.
+        doc_words (int): The number of words per document.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        list: The documents.
+    """
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(VOCABULARY, k=doc_words)) for _ in range(docs)]
+
+
+def percentile(values, q):
+    """
+    Returns the q-th percentile of the values, interpolating linearly
+    between the closest ranks.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of this process, in MiB.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def latency_summary(latencies):
+    """
+    Summarises per-document latencies, in milliseconds.
+    """
+    return {
+        name: round(percentile(latencies, q) * 1000, 3)
+        for name, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))
+    }
+
+
+def stage_summary(agent):
+    """
+    Returns the mean time per chunk spent queueing, in prompt evaluation,
+    in generation and in total, in milliseconds, from an agent's entry in
+    InMemoryMetrics.summary().
+    """
+    stages = {}
+    for stage, name in (("queue_wait", "chunk_queue_wait_seconds"),
+                        ("prompt_eval", "chunk_prompt_eval_seconds"),
+                        ("eval", "chunk_eval_seconds"),
+                        ("total", "chunk_seconds")):
+        mean = agent["timings"].get(name, {}).get("mean")
+        stages[stage] = None if mean is None else round(mean * 1000, 3)
+    return stages
+
+
+def make_agent(kind, doc, chunk_size, concurrency, model, metrics=None,
+               prompting='inline'):
+    """
+    Builds the agent for one document.
+    """
+    if kind == 'guard':
+        return ContentGuard(guard_task, doc, concurrency=concurrency, chunk_size=chunk_size,
+                            model=model, metrics=metrics, prompting=prompting)
+    return TagGenerator(tag_task, doc, default_careers, concurrency=concurrency,
+                        chunk_size=chunk_size, model=model, metrics=metrics,
+                        prompting=prompting)
+
+
+async def run_agent_scenario(backend, kind, corpus, chunk_size, concurrency,
+                             parallel_docs, model, prompting='inline'):
+    """
+    Runs every document of the corpus through one agent.
+
+    Args:
+        backend (OllamaBackend): The client the agents share.
+        kind (str): 'guard' or 'tags'.
+        corpus (list): The documents.
+        chunk_size (int): The agents' chunk size.
+        concurrency (int): The agents' chunk concurrency.
+        parallel_docs (int): The number of documents analysed at once.
+        model (str): The model to run.
+        prompting (str, optional): The agents' prompting mode.
+
+    Returns:
+        dict: The scenario's throughput and latency figures, the mean
+        time each chunk spent per stage and the prompt evaluation time the
+        server's prompt cache saved.
+    """
+    metrics = InMemoryMetrics()
+    latencies = []
+    chunks = 0
+    slots = asyncio.Semaphore(parallel_docs)
+
+    async def analyse(doc):
+        nonlocal chunks
+        async with slots:
+            agent = make_agent(kind, doc, chunk_size, concurrency, model, metrics, prompting)
+            started = time.perf_counter()
+            replies = await agent.agent_async(client=backend)
+            latencies.append(time.perf_counter() - started)
+            chunks += len(replies)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(analyse(doc) for doc in corpus))
+    elapsed = time.perf_counter() - started
+    [summary] = metrics.summary().values()
+
+    return {
+        "seconds": round(elapsed, 4),
+        "chunks": chunks,
+        "docs_per_sec": round(len(corpus) / elapsed, 3),
+        "chunks_per_sec": round(chunks / elapsed, 3),
+        "latency_ms": latency_summary(latencies),
+        "chunk_stages_ms": stage_summary(summary),
+        "prompt_eval_saved_ms": round(summary["prompt_eval_seconds_saved"] * 1000, 3),
+    }
+
+
+def run_chunking_scenario(corpus, chunk_size):
+    """
+    Times chunk_prompt over the corpus.
+
+    Returns:
+        dict: The chunking throughput figures.
+    """
+    size = sum(len(doc) for doc in corpus)
+    started = time.perf_counter()
+    chunks = sum(len(chunk_prompt(doc, chunk_size)) for doc in corpus)
+    elapsed = time.perf_counter() - started
+    return {
+        "seconds": round(elapsed, 4),
+        "chunks": chunks,
+        "docs_per_sec": round(len(corpus) / elapsed, 3) if elapsed else None,
+        "mb_per_sec": round(size / elapsed / 1e6, 3) if elapsed else None,
+    }
+
+
+def start_stub(args):
+    """
+    Starts the stub server in a child process.
+
+    Returns:
+        tuple: The process and the server URL.
+    """
+    command = [
+        sys.executable, STUB_PATH,
+        "--token-latency", str(args.token_latency),
+        "--prompt-token-latency", str(args.prompt_token_latency),
+        "--jitter", str(args.jitter),
+        "--load-latency", str(args.load_latency),
+        "--parallel", str(args.stub_parallel),
+        "--seed", str(args.seed),
+    ]
+    if not args.no_prompt_cache:
+        command.append("--prompt-cache")
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    url = process.stdout.readline().strip()
+    if not url:
+        process.kill()
+        raise RuntimeError("The stub Ollama server failed to start.")
+    return process, url
+
+
+async def run_benchmarks(args, host):
+    """
+    Runs every scenario against the server at host.
+
+    Returns:
+        list: One result per scenario.
+    """
+    backend = OllamaBackend(host, keep_alive=args.keep_alive)
+    # Load the model before timing anything
+    await backend.chat(model=args.model, messages=[])
+
+    results = []
+    try:
+        for kind, prompting, docs, doc_words, chunk_size, concurrency in itertools.product(
+                args.agents, args.prompting, args.docs, args.doc_words, args.chunk_sizes,
+                args.concurrency):
+            corpus = make_corpus(docs, doc_words, args.seed)
+            result = {
+                "agent": kind,
+                "prompting": prompting,
+                "docs": docs,
+                "doc_words": doc_words,
+                "chunk_size": chunk_size,
+                "concurrency": concurrency,
+                "parallel_docs": args.parallel_docs,
+            }
+            result.update(await run_agent_scenario(
+                backend, kind, corpus, chunk_size, concurrency, args.parallel_docs,
+                args.model, prompting))
+            result["peak_rss_mb"] = peak_rss_mb()
+            results.append(result)
+            print(f"{kind} prompting={prompting} docs={docs} words={doc_words} chunk={chunk_size} "
+                  f"concurrency={concurrency}: {result['docs_per_sec']} docs/s",
+                  file=sys.stderr)
+    finally:
+        await backend.aclose()
+    return results
+
+
+def main(argv=None):
+    """
+    Runs the benchmarks from the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--agents", nargs="+", choices=AGENTS, default=list(AGENTS))
+    parser.add_argument("--prompting", nargs="+", choices=PROMPTING_MODES,
+                        default=list(PROMPTING_MODES))
+    parser.add_argument("--docs", nargs="+", type=int, default=[20],
+                        help="Corpus sizes, in documents.")
+    parser.add_argument("--doc-words", nargs="+", type=int, default=[200, 2000],
+                        help="Document sizes, in words.")
+    parser.add_argument("--chunk-sizes", nargs="+", type=int, default=[DEFAULT_CHUNK_SIZE])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, DEFAULT_CONCURRENCY])
+    parser.add_argument("--parallel-docs", type=int, default=1,
+                        help="Documents analysed at once.")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--keep-alive", default="30m")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ollama-host",
+                        help="Benchmark a real Ollama server instead of the stub.")
+    parser.add_argument("--token-latency", type=float, default=0.005,
+                        help="Stub seconds per generated token.")
+    parser.add_argument("--prompt-token-latency", type=float, default=0.0002,
+                        help="Stub seconds per prompt token.")
+    parser.add_argument("--jitter", type=float, default=0.2,
+                        help="Stub relative latency variation.")
+    parser.add_argument("--load-latency", type=float, default=0.0,
+                        help="Stub seconds to load the model.")
+    parser.add_argument("--stub-parallel", type=int, default=4,
+                        help="Requests the stub serves at once.")
+    parser.add_argument("--no-prompt-cache", action="store_true",
+                        help="Disable the stub's simulated prompt cache.")
+    parser.add_argument("--no-chunking", action="store_true",
+                        help="Skip the chunk_prompt benchmark.")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout.")
+    args = parser.parse_args(argv)
+
+    stub, host = None, args.ollama_host
+    if host is None:
+        stub, host = start_stub(args)
+    try:
+        agent_results = asyncio.run(run_benchmarks(args, host))
+    finally:
+        if stub is not None:
+            stub.terminate()
+            stub.wait()
+
+    chunking_results = []
+    if not args.no_chunking:
+        for doc_words, chunk_size in itertools.product(args.doc_words, args.chunk_sizes):
+            result = {"doc_words": doc_words, "chunk_size": chunk_size}
+            result.update(run_chunking_scenario(
+                make_corpus(max(args.docs), doc_words, args.seed), chunk_size))
+            chunking_results.append(result)
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "server": "ollama" if args.ollama_host else "stub",
+        "settings": {
+            name: getattr(args, name)
+            for name in ("model", "keep_alive", "seed", "token_latency",
+                         "prompt_token_latency", "jitter", "load_latency", "stub_parallel")
+        },
+        "agents": agent_results,
+        "chunking": chunking_results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+    return report
+
+
+if __name__ == "__main__":
+    main()
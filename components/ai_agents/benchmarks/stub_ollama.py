@@ -0,0 +1,378 @@
+"""
+A fake Ollama server for benchmarks.
+
+The stub speaks enough of the Ollama HTTP API for the agents to run against
+it unchanged (POST /api/chat, POST /api/embed, GET /api/ps and
+GET /api/version). Instead
+of running a model it sleeps for a simulated generation time:
+
+    load_latency                    once the model has to be (re)loaded
+    + prompt tokens * prompt_token_latency
+    + reply tokens  * token_latency
+
+scaled by a random factor in [1 - jitter, 1 + jitter]. Only `parallel`
+requests are served at once, like OLLAMA_NUM_PARALLEL, and the model is
+unloaded once it has been idle for longer than the request's keep_alive.
+With prompt_cache, the leading messages of a prompt (everything but the
+last message) are not evaluated again if one of the last `parallel`
+prompts started with the same messages, which mimics Ollama reusing the
+KV cache of a slot.
+
+Run it on its own with:
+
+    python benchmarks/stub_ollama.py --port 11435 --token-latency 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.chunk_data import estimate_tokens
+
+CLEAN_REPLY = "No, no forbidden content found."
+DEFAULT_PARALLEL = 4
+DEFAULT_KEEP_ALIVE = 300.0  # Ollama unloads idle models after five minutes
+EMBEDDING_SIZE = 64
+
+_DURATION = re.compile(r"^(-?\d+(?:\.\d+)?)(ms|s|m|h)?$")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}
+
+
+def parse_keep_alive(value):
+    """
+    Converts an Ollama keep_alive value to seconds; negative means forever.
+    """
+    if value is None:
+        return DEFAULT_KEEP_ALIVE
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _DURATION.match(str(value).strip())
+    if match is None:
+        raise ValueError(f"Invalid keep_alive: {value!r}")
+    return float(match.group(1)) * _UNITS[match.group(2)]
+
+
+class StubOllama:
+    """
+    In-process fake Ollama server with simulated generation latency.
+
+    Attributes:
+        reply (str or Callable): The reply to every chat request, or a
+        function building it from the request's messages.
+        token_latency (float): Seconds per generated token.
+        prompt_token_latency (float): Seconds per prompt token.
+        jitter (float): Relative latency variation, from 0 to 1.
+        load_latency (float): Seconds to load an unloaded model.
+        parallel (int): The number of requests served at once.
+        requests (int): The number of chat and embed requests served.
+        peak_in_flight (int): The most requests being served at once.
+        loads (int): The number of times a model was loaded.
+        prompt_cache (bool): Whether repeated leading messages are reused.
+        cached_tokens (int): The prompt tokens served from the cache.
+        failing (bool): Whether requests are answered with a server error,
+        to simulate an unhealthy backend.
+
+    Methods:
+        start(host, port): Starts listening and returns the server URL.
+        stop(): Stops the server.
+    """
+
+    def __init__(self, reply=CLEAN_REPLY, token_latency=0.0,
+                 prompt_token_latency=0.0, jitter=0.0, load_latency=0.0,
+                 parallel=DEFAULT_PARALLEL, seed=None, prompt_cache=False):
+        """
+        Initializes the stub.
+
+        Args:
+            reply (str or Callable, optional): The reply to every chat
+            request, or a function of the messages. Defaults to CLEAN_REPLY.
+            token_latency (float, optional): Seconds per generated token.
+            prompt_token_latency (float, optional): Seconds per prompt token.
+            jitter (float, optional): Relative latency variation, from 0 to 1.
+            load_latency (float, optional): Seconds to load a model.
+            parallel (int, optional): The number of requests served at once.
+            seed (int, optional): Seeds the jitter for repeatable runs.
+            prompt_cache (bool, optional): Skip evaluating leading messages
+            seen in one of the last `parallel` prompts. Defaults to False.
+
+        Raises:
+            ValueError: If a latency is negative, jitter is outside [0, 1]
+            or parallel is not a positive integer.
+        """
+        if min(token_latency, prompt_token_latency, load_latency) < 0:
+            raise ValueError("Latencies cannot be negative.")
+        if not 0 <= jitter <= 1:
+            raise ValueError("Jitter must be between 0 and 1.")
+        if not isinstance(parallel, int) or parallel <= 0:
+            raise ValueError("Parallel must be a positive integer.")
+
+        self.reply = reply
+        self.token_latency = token_latency
+        self.prompt_token_latency = prompt_token_latency
+        self.jitter = jitter
+        self.load_latency = load_latency
+        self.parallel = parallel
+        self.requests = 0
+        self.peak_in_flight = 0
+        self.loads = 0
+        self.prompt_cache = prompt_cache
+        self.cached_tokens = 0
+        self.failing = False
+        self._prefixes = OrderedDict()
+        self._random = random.Random(seed)
+        self._in_flight = 0
+        self._slots = None
+        self._server = None
+        self._loaded_until = {}  # model -> monotonic time it unloads at
+
+    async def start(self, host="127.0.0.1", port=0):
+        """
+        Starts listening.
+
+        Args:
+            host (str, optional): The interface to bind. Defaults to localhost.
+            port (int, optional): The TCP port, or 0 for a free one.
+
+        Returns:
+            str: The server URL, for OllamaBackend(host=...).
+        """
+        self._slots = asyncio.Semaphore(self.parallel)
+        self._server = await asyncio.start_server(self.handle_connection, host, port)
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        """
+        Stops accepting connections and closes the server.
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serves requests on one keep-alive connection until the client
+        closes it.
+        """
+        try:
+            while True:
+                request_line = (await reader.readline()).decode("latin-1").split()
+                if len(request_line) < 2:
+                    break
+                method, path = request_line[0], request_line[1]
+
+                length = 0
+                while True:
+                    line = (await reader.readline()).decode("latin-1").strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value.strip())
+                raw = await reader.readexactly(length) if length else b""
+
+                status, body = await self._route(method, path, raw)
+                payload = json.dumps(body).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, raw):
+        """
+        Dispatches a request to its handler.
+
+        Returns:
+            tuple: The HTTP status code and the JSON response body.
+        """
+        if self.failing:
+            return 500, {"error": "simulated server failure"}
+        if method == "GET" and path == "/api/version":
+            return 200, {"version": "0.0.0-stub"}
+        if method == "GET" and path == "/api/ps":
+            now = time.monotonic()
+            return 200, {"models": [{"name": model, "model": model}
+                                    for model, until in self._loaded_until.items()
+                                    if until >= now]}
+        if method != "POST" or path not in ("/api/chat", "/api/embed"):
+            return 404, {"error": f"{method} {path} is not supported by the stub"}
+        try:
+            request = json.loads(raw or b"{}")
+        except ValueError:
+            return 400, {"error": "invalid JSON body"}
+
+        async with self._slots:
+            self._in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+            try:
+                if path == "/api/chat":
+                    return 200, await self._chat(request)
+                return 200, await self._embed(request)
+            finally:
+                self._in_flight -= 1
+
+    async def _load(self, request):
+        """
+        Simulates loading the model if it has been unloaded, and keeps it
+        loaded for the request's keep_alive.
+
+        Returns:
+            float: The seconds spent loading.
+        """
+        model = request.get("model")
+        now = time.monotonic()
+        spent = 0.0
+        if self._loaded_until.get(model, 0) < now:
+            self.loads += 1
+            spent = self.load_latency
+            await asyncio.sleep(spent)
+        keep_alive = parse_keep_alive(request.get("keep_alive"))
+        self._loaded_until[model] = float("inf") if keep_alive < 0 else time.monotonic() + keep_alive
+        return spent
+
+    def _cached(self, model, messages):
+        """
+        Returns the prompt tokens served from the simulated prompt cache,
+        and remembers the prompt's leading messages.
+        """
+        if not self.prompt_cache or len(messages) < 2:
+            return 0
+        prefix = (model,) + tuple((m.get("role"), m.get("content", "")) for m in messages[:-1])
+        if prefix in self._prefixes:
+            self._prefixes.move_to_end(prefix)
+            cached = sum(estimate_tokens(content) for _, content in prefix[1:])
+            self.cached_tokens += cached
+            return cached
+        self._prefixes[prefix] = True
+        if len(self._prefixes) > self.parallel:
+            self._prefixes.popitem(last=False)
+        return 0
+
+    def _scaled(self, seconds):
+        if self.jitter:
+            seconds *= 1 + self._random.uniform(-self.jitter, self.jitter)
+        return seconds
+
+    async def _chat(self, request):
+        """
+        Answers a non-streaming chat request.
+        """
+        self.requests += 1
+        messages = request.get("messages") or []
+        load = await self._load(request)
+        if not messages:
+            # An empty chat request only loads the model
+            return self._response(request, "", load, 0, 0, 0.0, 0.0, "load")
+
+        reply = self.reply(messages) if callable(self.reply) else self.reply
+        prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+        prompt_tokens -= self._cached(request.get("model"), messages)
+        reply_tokens = estimate_tokens(reply)
+        prompt_time = self._scaled(prompt_tokens * self.prompt_token_latency)
+        eval_time = self._scaled(reply_tokens * self.token_latency)
+        await asyncio.sleep(prompt_time + eval_time)
+        return self._response(request, reply, load, prompt_tokens, reply_tokens,
+                              prompt_time, eval_time, "stop")
+
+    def _response(self, request, reply, load, prompt_tokens, reply_tokens,
+                  prompt_time, eval_time, reason):
+        nanos = 1_000_000_000
+        return {
+            "model": request.get("model"),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": reply},
+            "done": True,
+            "done_reason": reason,
+            "total_duration": int((load + prompt_time + eval_time) * nanos),
+            "load_duration": int(load * nanos),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prompt_time * nanos),
+            "eval_count": reply_tokens,
+            "eval_duration": int(eval_time * nanos),
+        }
+
+    async def _embed(self, request):
+        """
+        Answers an embed request with deterministic pseudo-embeddings.
+        """
+        self.requests += 1
+        await self._load(request)
+        inputs = request.get("input")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        await asyncio.sleep(self._scaled(
+            sum(estimate_tokens(text) for text in inputs) * self.prompt_token_latency))
+        return {
+            "model": request.get("model"),
+            "embeddings": [_embedding(text) for text in inputs],
+        }
+
+
+def _embedding(text):
+    """
+    Hashes the words of the text into a fixed-size vector, so texts that
+    share words get similar embeddings.
+    """
+    vector = [0.0] * EMBEDDING_SIZE
+    for word in text.lower().split():
+        vector[zlib.crc32(word.encode('utf-8')) % EMBEDDING_SIZE] += 1.0
+    return vector
+
+
+def main(argv=None):
+    """
+    Runs the stub from the command line until interrupted, printing its
+    URL on the first line of stdout.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--reply", default=CLEAN_REPLY)
+    parser.add_argument("--token-latency", type=float, default=0.0,
+                        help="Seconds per generated token.")
+    parser.add_argument("--prompt-token-latency", type=float, default=0.0,
+                        help="Seconds per prompt token.")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="Relative latency variation, from 0 to 1.")
+    parser.add_argument("--load-latency", type=float, default=0.0,
+                        help="Seconds to load an unloaded model.")
+    parser.add_argument("--parallel", type=int, default=DEFAULT_PARALLEL)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--prompt-cache", action="store_true",
+                        help="Reuse repeated leading messages, like Ollama's KV cache.")
+    args = parser.parse_args(argv)
+
+    stub = StubOllama(args.reply, args.token_latency, args.prompt_token_latency,
+                      args.jitter, args.load_latency, args.parallel, args.seed,
+                      args.prompt_cache)
+
+    async def serve():
+        url = await stub.start(args.host, args.port)
+        print(url, flush=True)
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,654 @@
+"""
+A long-running service that hosts the AI agents behind a bounded job queue.
+
+The daemon keeps one Ollama client warm for its whole lifetime and serves a
+small JSON-over-HTTP API on localhost or on a Unix socket:
+
+    POST /jobs/guard   {"content": "...", "task_prompt": "...", "fail_fast": true,
+                        "structured": true, "partial": true, "deadline": 30,
+                        "wait": true}
+    POST /jobs/tags    {"content": "...", "career_list": [...], "structured": true,
+                        "wait": true}
+    GET  /jobs/<id>    Status and result of a submitted job.
+    GET  /health       Queue depth, worker count, cache, coalescing and
+                       circuit breaker counters and, with several Ollama
+                       hosts, the state of each.
+    GET  /metrics      Per-chunk and per-document metrics, Prometheus format.
+
+Jobs are accepted into a bounded queue; when it is full the daemon answers
+429 so that callers back off instead of piling up work. Request bodies
+larger than --max-body are refused with 413.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import uuid
+from collections import OrderedDict
+
+from content_guard import PROMPTING_MODES, ContentGuard, task as guard_task
+from tag_generator import TagGenerator, task as tag_task
+from utils.backend import DEFAULT_KEEP_ALIVE, DEFAULT_TIMEOUT, OllamaBackend, shared_backend
+from utils.backend_pool import DEFAULT_MAX_IN_FLIGHT, BackendPool
+from utils.cache import DEFAULT_MAX_ENTRIES, VerdictCache
+from utils.cascade import DEFAULT_MIN_CONFIDENCE, Cascade
+from utils.dispatch import DEFAULT_CONCURRENCY, DEFAULT_MODEL
+from utils.log import DEFAULT_LEVEL, DEFAULT_LOG_PATH, configure_logging, correlation
+from utils.metrics import InMemoryMetrics
+from utils.prefilter import LexicalPrefilter
+from utils.resilience import DEFAULT_FAILURE_THRESHOLD, CircuitBreaker, RetryPolicy
+from utils.shortlist import DEFAULT_EMBED_MODEL, CareerShortlist
+from utils.near_duplicate import NearDuplicateIndex
+from utils.singleflight import Singleflight
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_WORKERS = 4
+MAX_FINISHED_JOBS = 1024
+DEFAULT_MAX_BODY = 16 * 1024 * 1024
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REASONS = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+}
+
+
+class Job:
+    """
+    A unit of work submitted to the daemon.
+
+    Attributes:
+        id (str): The identifier returned to the caller.
+        kind (str): Either 'guard' or 'tags'.
+        agent: The ContentGuard or TagGenerator that runs the job, or None
+        once the job has finished.
+        options (dict): Keyword arguments for the agent's agent_async.
+        status (str): One of 'queued', 'running', 'done' or 'failed'.
+        result (list): The agent's responses once the job is done.
+        error (str): The error message if the job failed.
+    """
+
+    __slots__ = ("id", "kind", "agent", "options", "status", "result",
+                 "error", "done")
+
+    def __init__(self, kind, agent, options=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.agent = agent
+        self.options = options or {}
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.done = asyncio.Event()
+
+    def to_dict(self):
+        """
+        Returns the JSON-serialisable view of the job.
+        """
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class AgentDaemon:
+    """
+    Resident service that runs ContentGuard and TagGenerator jobs
+    through a single shared Ollama client.
+
+    Attributes:
+        queue_size (int): The maximum number of jobs waiting to run.
+        workers (int): The number of jobs processed at once.
+        concurrency (int): The per-job chunk concurrency.
+        model (str): The Ollama model every job runs on.
+        options (dict): Model options sent with every request.
+        career_list (list): The default career list for tag jobs.
+        cache (VerdictCache): The verdict cache shared by every job.
+        prefilter (LexicalPrefilter): The keyword screen for guard jobs.
+        shortlist (CareerShortlist): The embedding shortlist over the
+        default career list.
+        metrics (InMemoryMetrics): The metrics of every job.
+        prompting (str): How the agents lay out their prompts.
+        singleflight (Singleflight): The requests in flight, shared by
+        every job so identical chunks make one model call.
+        cascade (Cascade): The fast tier every job tries first, or None.
+        near_duplicates (NearDuplicateIndex): Verdicts shared by every job
+        for chunks nearly identical to earlier ones, or None.
+        retry (RetryPolicy): How every job retries failed requests, or None.
+        breaker (CircuitBreaker): The breaker shared by every job, or None.
+        deadline (float): The default seconds a job may take, or None.
+        max_body (int): The largest request body accepted, in bytes.
+
+    Methods:
+        start(): Creates the client, warms the model up and starts workers.
+        stop(): Cancels the workers and closes the client.
+        submit(kind, payload): Queues a job and returns it.
+        serve(host, port, socket_path): Serves the HTTP API until cancelled.
+    """
+
+    def __init__(self, client=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 workers=DEFAULT_WORKERS, concurrency=DEFAULT_CONCURRENCY,
+                 career_list=None, warm_up=True, cache=None, prefilter=None,
+                 shortlist=None, model=DEFAULT_MODEL, options=None, metrics=None,
+                 prompting='inline', singleflight=None, coalesce=True, cascade=None,
+                 near_duplicates=None, retry=None, breaker=None, deadline=None,
+                 max_body=DEFAULT_MAX_BODY):
+        """
+        Initializes the daemon.
+
+        Args:
+            client (OllamaBackend or BackendPool, optional): The shared client.
+            Defaults to the process-wide backend.
+            queue_size (int, optional): The maximum number of queued jobs.
+            workers (int, optional): The number of concurrent jobs.
+            concurrency (int, optional): The per-job chunk concurrency.
+            career_list (list, optional): The default career list for
+            tag jobs that don't send their own.
+            warm_up (bool, optional): Whether to load the model into
+            memory on start. Defaults to True.
+            cache (VerdictCache, optional): A verdict cache shared by
+            every job. Defaults to None.
+            prefilter (LexicalPrefilter, optional): A keyword screen run
+            in front of the model for guard jobs. Defaults to None.
+            shortlist (CareerShortlist, optional): An embedding shortlist
+            used by tag jobs that rely on the default career list.
+            Defaults to None.
+            model (str, optional): The Ollama model every job runs on.
+            Defaults to DEFAULT_MODEL.
+            options (dict, optional): Model options, such as num_ctx or
+            num_thread, sent with every request. Defaults to None.
+            metrics (InMemoryMetrics, optional): Collects the metrics of
+            every job. Defaults to a new InMemoryMetrics.
+            prompting (str, optional): 'inline' or 'system'; see
+            ContentGuard. Defaults to 'inline'.
+            singleflight (Singleflight, optional): The table of requests in
+            flight shared by every job. Defaults to a new Singleflight.
+            coalesce (bool, optional): Whether identical chunks of
+            concurrent jobs share one model call. Defaults to True.
+            cascade (Cascade, optional): A small model every job tries
+            before model. Defaults to None.
+            near_duplicates (NearDuplicateIndex, optional): An index of
+            verdicts shared by every job, reused for chunks nearly
+            identical to earlier ones. Defaults to None.
+            retry (RetryPolicy, optional): Retries the failed and slow
+            requests of every job. Defaults to None.
+            breaker (CircuitBreaker, optional): Fails every job's requests
+            fast while the backend keeps failing. Defaults to None.
+            deadline (float, optional): Seconds a job may take unless it
+            sends its own "deadline". Defaults to None.
+            max_body (int, optional): The largest request body accepted, in
+            bytes; larger requests get 413. Defaults to DEFAULT_MAX_BODY.
+        """
+        if not isinstance(queue_size, int) or queue_size <= 0:
+            raise ValueError("Queue size must be a positive integer.")
+        if not isinstance(workers, int) or workers <= 0:
+            raise ValueError("Workers must be a positive integer.")
+        if not isinstance(max_body, int) or max_body <= 0:
+            raise ValueError("Max body must be a positive integer.")
+        if prompting not in PROMPTING_MODES:
+            raise ValueError(f"Prompting must be one of {PROMPTING_MODES}.")
+        self.client = client
+        self.queue_size = queue_size
+        self.workers = workers
+        self.concurrency = concurrency
+        self.career_list = career_list
+        self.warm_up = warm_up
+        self.cache = cache
+        self.prefilter = prefilter
+        self.shortlist = shortlist
+        self.model = model
+        self.options = options
+        self.metrics = metrics if metrics is not None else InMemoryMetrics()
+        self.prompting = prompting
+        if coalesce and singleflight is None:
+            singleflight = Singleflight()
+        self.singleflight = singleflight if coalesce else None
+        self.cascade = cascade
+        self.near_duplicates = near_duplicates
+        self.retry = retry
+        self.breaker = breaker
+        self.deadline = deadline
+        self.max_body = max_body
+        self.jobs = OrderedDict()
+        self._queue = None
+        self._tasks = []
+
+    async def start(self):
+        """
+        Creates the shared client, warms the models up and starts workers.
+        With a BackendPool, the model is loaded on every backend and the
+        backends are health-checked in the background.
+        """
+        if self.client is None:
+            self.client = shared_backend()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+
+        if self.warm_up:
+            models = [self.model] + ([self.cascade.model] if self.cascade else [])
+            for backend in getattr(self.client, "backends", [self.client]):
+                for model in models:
+                    try:
+                        # An empty chat request loads the model without generating
+                        await backend.chat(model=model, messages=[])
+                        logger.info(f"Model {model} warmed up.")
+                    except Exception as e:
+                        logger.warning(f"Model warm-up failed: {e}")
+        if isinstance(self.client, BackendPool):
+            self.client.start_health_checks()
+
+        self._tasks = [
+            asyncio.ensure_future(self._worker()) for _ in range(self.workers)
+        ]
+        logger.info("Daemon started.")
+
+    async def stop(self):
+        """
+        Cancels the workers, waits for them to exit and closes the client,
+        whether it is a single backend or a BackendPool.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # OllamaBackend and BackendPool have aclose, ollama.AsyncClient close
+        close = getattr(self.client, "aclose", None) or getattr(self.client, "close", None)
+        if close is not None:
+            await close()
+        if self.cache is not None:
+            self.cache.flush()
+        if self.near_duplicates is not None:
+            self.near_duplicates.flush()
+        logger.info("Daemon stopped.")
+
+    def submit(self, kind, payload):
+        """
+        Validates a job request and puts it on the queue.
+
+        Args:
+            kind (str): Either 'guard' or 'tags'.
+            payload (dict): The decoded request body.
+
+        Returns:
+            Job: The queued job.
+
+        Raises:
+            ValueError: If the request is invalid.
+            asyncio.QueueFull: If the queue is full.
+        """
+        if not isinstance(payload, dict):
+            raise ValueError("Request body must be a JSON object.")
+        content = payload.get("content")
+        if not isinstance(content, str):
+            raise ValueError("Content must be a string.")
+        for name in ("task", "task_prompt"):
+            if payload.get(name) is not None and not isinstance(payload[name], str):
+                raise ValueError(f"{name.capitalize().replace('_', ' ')} must be a string.")
+        deadline = payload.get("deadline", self.deadline)
+        if deadline is not None and (isinstance(deadline, bool)
+                                     or not isinstance(deadline, (int, float))
+                                     or deadline <= 0):
+            raise ValueError("Deadline must be a positive number of seconds.")
+        resilience = dict(retry=self.retry, breaker=self.breaker, deadline=deadline)
+
+        if kind == "guard":
+            agent = ContentGuard(payload.get("task", guard_task), content,
+                                 concurrency=self.concurrency, model=self.model,
+                                 options=self.options, cache=self.cache,
+                                 prefilter=self.prefilter, metrics=self.metrics,
+                                 prompting=self.prompting,
+                                 structured=bool(payload.get("structured")),
+                                 singleflight=self.singleflight,
+                                 cascade=self.cascade,
+                                 near_duplicates=self.near_duplicates,
+                                 **resilience)
+        elif kind == "tags":
+            career_list = payload.get("career_list")
+            if career_list is not None and (
+                    not isinstance(career_list, list)
+                    or not all(isinstance(career, str) for career in career_list)):
+                raise ValueError("Career list must be a list of strings.")
+            agent = TagGenerator(payload.get("task", tag_task), content,
+                                 career_list or self.career_list,
+                                 concurrency=self.concurrency, model=self.model,
+                                 options=self.options, cache=self.cache,
+                                 shortlist=None if career_list else self.shortlist,
+                                 metrics=self.metrics, prompting=self.prompting,
+                                 structured=bool(payload.get("structured")),
+                                 singleflight=self.singleflight,
+                                 cascade=self.cascade,
+                                 near_duplicates=self.near_duplicates,
+                                 **resilience)
+        else:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        options = {"task_prompt": payload.get("task_prompt")}
+        if kind == "guard" and payload.get("fail_fast"):
+            options["fail_fast"] = True
+        if payload.get("partial"):
+            options["partial"] = True
+
+        job = Job(kind, agent, options)
+        self._queue.put_nowait(job)
+        self._remember(job)
+        return job
+
+    def _remember(self, job):
+        """
+        Keeps the job for lookups, forgetting the oldest finished jobs.
+        """
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.queue_size + self.workers + MAX_FINISHED_JOBS:
+            oldest = next(iter(self.jobs.values()))
+            if not oldest.done.is_set():
+                break
+            self.jobs.popitem(last=False)
+
+    async def _worker(self):
+        """
+        Takes jobs off the queue and runs them one at a time.
+        """
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            try:
+                with correlation(job.id):
+                    result = await job.agent.agent_async(
+                        client=self.client, **job.options)
+                if hasattr(result, "to_dict"):
+                    result = result.to_dict()
+                elif isinstance(result, list):
+                    # Partial results mark the chunks that got no reply
+                    result = [reply.to_dict() if hasattr(reply, "to_dict") else reply
+                              for reply in result]
+                job.result = result
+                job.status = "done"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {e}")
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                # Finished jobs are kept for lookups; drop the agent so
+                # they don't also keep the content
+                job.agent = None
+                job.options = {}
+                job.done.set()
+                self._queue.task_done()
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serves a single HTTP request.
+        """
+        try:
+            status, body = await self._handle_request(reader)
+        except Exception as e:
+            logger.error(f"Unexpected error occurred: {e}")
+            status, body = 500, {"error": str(e)}
+
+        if isinstance(body, str):
+            payload, content_type = body.encode("utf-8"), PROMETHEUS_CONTENT_TYPE
+        else:
+            payload, content_type = json.dumps(body).encode("utf-8"), "application/json"
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "Connection: close\r\n\r\n".encode("latin-1") + payload
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader):
+        """
+        Parses the request and routes it.
+
+        Returns:
+            tuple: The HTTP status code and the JSON response body, or
+            the exposition text for /metrics.
+        """
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) < 2:
+            return 400, {"error": "Malformed request line."}
+        method, path = request_line[0], request_line[1]
+
+        length = 0
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "content-length":
+                value = value.strip()
+                if not (value.isascii() and value.isdigit()):
+                    return 400, {"error": "Invalid Content-Length."}
+                length = int(value)
+                if length > self.max_body:
+                    return 413, {"error": f"Request body exceeds {self.max_body} bytes."}
+        raw = await reader.readexactly(length) if length else b""
+
+        if path == "/health":
+            return 200, {
+                "status": "ok",
+                "queued": self._queue.qsize(),
+                "workers": len(self._tasks),
+                "cache": self.cache.stats() if self.cache else None,
+                "singleflight": self.singleflight.stats() if self.singleflight else None,
+                "near_duplicates": self.near_duplicates.stats() if self.near_duplicates else None,
+                "breaker": self.breaker.stats() if self.breaker else None,
+                "backends": self.client.stats() if isinstance(self.client, BackendPool) else None,
+            }
+
+        if path == "/metrics":
+            return 200, self.metrics.prometheus({
+                "queue_depth": self._queue.qsize(),
+                "jobs_running": sum(job.status == "running" for job in self.jobs.values()),
+            })
+
+        if path.startswith("/jobs/") and method == "GET":
+            job = self.jobs.get(path[len("/jobs/"):])
+            if job is None:
+                return 404, {"error": "Unknown job."}
+            return 200, job.to_dict()
+
+        if path in ("/jobs/guard", "/jobs/tags"):
+            if method != "POST":
+                return 405, {"error": "Use POST to submit jobs."}
+            try:
+                payload = json.loads(raw or b"{}")
+                job = self.submit(path[len("/jobs/"):], payload)
+            except (ValueError, TypeError) as e:
+                return 400, {"error": str(e)}
+            except asyncio.QueueFull:
+                return 429, {"error": "Job queue is full, retry later."}
+
+            if payload.get("wait"):
+                await job.done.wait()
+                return 200, job.to_dict()
+            return 202, job.to_dict()
+
+        return 404, {"error": "Unknown path."}
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                    socket_path=None):
+        """
+        Starts the daemon and serves the HTTP API until cancelled.
+
+        Args:
+            host (str, optional): The interface to bind. Defaults to localhost.
+            port (int, optional): The TCP port to bind.
+            socket_path (str, optional): A Unix socket path to bind
+            instead of a TCP port.
+        """
+        await self.start()
+        if socket_path:
+            server = await asyncio.start_unix_server(
+                self.handle_connection, path=socket_path)
+            logger.info(f"Listening on {socket_path}")
+        else:
+            server = await asyncio.start_server(
+                self.handle_connection, host=host, port=port)
+            logger.info(f"Listening on {host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.stop()
+
+
+def _keep_alive(value):
+    """
+    Parses --keep-alive, passing plain numbers to Ollama as seconds.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def main(argv=None):
+    """
+    Runs the daemon from the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--socket", dest="socket_path",
+                        help="Serve on a Unix socket instead of TCP.")
+    parser.add_argument("--log-level", default=DEFAULT_LEVEL)
+    parser.add_argument("--log-file", default=DEFAULT_LOG_PATH,
+                        help="JSON-lines log file, or - for stderr.")
+    parser.add_argument("--ollama-host", nargs="+",
+                        help="Ollama server URL (defaults to OLLAMA_HOST or localhost). "
+                             "Give several to spread requests over them.")
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help="Requests sent to each Ollama server at once, with several hosts.")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--keep-alive", type=_keep_alive, default=DEFAULT_KEEP_ALIVE,
+                        help="How long Ollama keeps the model loaded, e.g. 30m or -1.")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="Ollama request timeout, in seconds.")
+    parser.add_argument("--num-ctx", type=int, help="Model context window, in tokens.")
+    parser.add_argument("--num-predict", type=int, help="Maximum tokens generated per reply.")
+    parser.add_argument("--num-thread", type=int, help="CPU threads Ollama uses per request.")
+    parser.add_argument("--prompting", choices=PROMPTING_MODES, default="system",
+                        help="Send the task as a system message the server can cache, "
+                             "or inline with each chunk.")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--max-body", type=int, default=DEFAULT_MAX_BODY,
+                        help="Largest request body accepted, in bytes.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_ENTRIES,
+                        help="In-memory verdict cache entries (0 disables caching).")
+    parser.add_argument("--cache-path", help="SQLite file for a persistent cache tier.")
+    parser.add_argument("--cache-ttl", type=float, help="Seconds a cached verdict stays valid.")
+    parser.add_argument("--cascade-model",
+                        help="Small model that sees every chunk first; only the verdicts "
+                             "it is unsure of go to --model.")
+    parser.add_argument("--min-confidence", type=float, default=DEFAULT_MIN_CONFIDENCE,
+                        help="Confidence a fast verdict needs, with --cascade-model.")
+    parser.add_argument("--near-duplicate-threshold", type=float, default=0,
+                        help="Reuse the verdict of a chunk at least this similar to "
+                             "one analysed before (0 disables the index).")
+    parser.add_argument("--near-duplicate-path",
+                        help="SQLite file for a persistent near-duplicate index.")
+    parser.add_argument("--retries", type=int, default=0,
+                        help="Retries per chunk after a timeout or server error, "
+                             "with jittered backoff (0 disables retrying).")
+    parser.add_argument("--chunk-timeout", type=float,
+                        help="Seconds each chunk request may take, with --retries.")
+    parser.add_argument("--deadline", type=float,
+                        help="Default seconds a job may take; jobs can send their own.")
+    parser.add_argument("--breaker-threshold", type=int, default=DEFAULT_FAILURE_THRESHOLD,
+                        help="Failures in a row that stop requests to Ollama for a "
+                             "while (0 disables the circuit breaker).")
+    parser.add_argument("--no-coalesce", action="store_true",
+                        help="Send identical chunks of concurrent jobs separately.")
+    parser.add_argument("--prefilter", action="store_true",
+                        help="Screen guard jobs with the keyword prefilter.")
+    parser.add_argument("--prefilter-clean", action="store_true",
+                        help="Let the prefilter pass chunks without matches as clean.")
+    parser.add_argument("--careers-file",
+                        help="Default career list for tag jobs, one title per line.")
+    parser.add_argument("--shortlist-top-k", type=int, default=0,
+                        help="Shortlist the default career list to this many "
+                             "titles per chunk (0 disables the shortlist).")
+    parser.add_argument("--embed-model", default=DEFAULT_EMBED_MODEL)
+    parser.add_argument("--embed-cache-dir",
+                        help="Directory to cache career title embeddings in.")
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level, None if args.log_file == "-" else args.log_file)
+
+    options = {name: getattr(args, name)
+               for name in ("num_ctx", "num_predict", "num_thread")
+               if getattr(args, name) is not None}
+    hosts = args.ollama_host or [None]
+    if len(hosts) > 1:
+        backend = BackendPool(hosts, max_in_flight=args.max_in_flight,
+                              backend_options={"timeout": args.timeout,
+                                               "keep_alive": args.keep_alive})
+    else:
+        backend = OllamaBackend(hosts[0], timeout=args.timeout, keep_alive=args.keep_alive)
+
+    cache = None
+    if args.cache_size > 0:
+        cache = VerdictCache(args.cache_size, ttl=args.cache_ttl, path=args.cache_path)
+
+    near_duplicates = None
+    if args.near_duplicate_threshold > 0:
+        near_duplicates = NearDuplicateIndex(args.near_duplicate_threshold,
+                                             path=args.near_duplicate_path)
+
+    retry = None
+    if args.retries > 0 or args.chunk_timeout:
+        retry = RetryPolicy(args.retries + 1, timeout=args.chunk_timeout)
+
+    prefilter = None
+    if args.prefilter:
+        prefilter = LexicalPrefilter(clean_on_no_match=args.prefilter_clean)
+
+    career_list = None
+    shortlist = None
+    if args.careers_file:
+        with open(args.careers_file, encoding="utf-8") as file:
+            career_list = [line.strip() for line in file if line.strip()]
+        if args.shortlist_top_k > 0:
+            shortlist = CareerShortlist(career_list, args.embed_model,
+                                        args.shortlist_top_k, args.embed_cache_dir)
+
+    daemon = AgentDaemon(backend, queue_size=args.queue_size, workers=args.workers,
+                         concurrency=args.concurrency, career_list=career_list,
+                         cache=cache, prefilter=prefilter, shortlist=shortlist,
+                         model=args.model, options=options,
+                         prompting=args.prompting, coalesce=not args.no_coalesce,
+                         cascade=Cascade(args.cascade_model, args.min_confidence)
+                         if args.cascade_model else None,
+                         near_duplicates=near_duplicates, retry=retry,
+                         breaker=CircuitBreaker(args.breaker_threshold)
+                         if args.breaker_threshold > 0 else None,
+                         deadline=args.deadline, max_body=args.max_body)
+    try:
+        asyncio.run(daemon.serve(args.host, args.port, args.socket_path))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
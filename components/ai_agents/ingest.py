@@ -0,0 +1,432 @@
+"""
+A batch runner that moderates and tags JSONL feed files.
+
+Each input line is a JSON object with the item's "content" and, optionally,
+an "id" and its own "career_list". Every item goes through FeedPipeline and
+one JSON line per item is appended to the output as it finishes:
+
+    {"id": "...", "flagged": false, "moderation": [...], "tags": [...],
+     "chunks": 2, "llm_calls": 4}
+
+Items that cannot be analysed, such as malformed lines or empty content,
+get {"id": "...", "error": "..."} instead. Lines are read only as work
+slots free up, so memory stays flat however large the inputs are. A
+checkpoint file records how far the run got; running the same command
+again resumes from it, and no item is written twice:
+
+    python ingest.py feed-2023.jsonl feed-2024.jsonl --output results.jsonl \\
+        --careers-file careers.txt --max-in-flight 16
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+
+from content_guard import CHUNKING_MODES, PROMPTING_MODES
+from pipeline import FeedPipeline
+from tag_generator import career_list as default_careers
+from utils.backend import DEFAULT_TIMEOUT, OllamaBackend
+from utils.backend_pool import BackendPool
+from utils.cache import DEFAULT_MAX_ENTRIES, VerdictCache
+from utils.cascade import DEFAULT_MIN_CONFIDENCE, Cascade
+from utils.chunk_data import DEFAULT_CHUNK_SIZE
+from utils.dispatch import DEFAULT_CONCURRENCY, DEFAULT_MODEL
+from utils.log import DEFAULT_LEVEL, configure_logging
+from utils.near_duplicate import NearDuplicateIndex
+from utils.resilience import RetryPolicy
+from utils.singleflight import Singleflight
+
+logger = logging.getLogger(__name__)
+
+# Items analysed at once
+DEFAULT_MAX_IN_FLIGHT = 8
+
+# Items finished between checkpoint writes
+DEFAULT_CHECKPOINT_EVERY = 100
+
+# How far, in multiples of max_in_flight, reading may run ahead of the
+# oldest unfinished item
+WINDOW_FACTOR = 16
+
+
+def iter_feed(paths, start=(0, 0)):
+    """
+    Reads JSONL files line by line from a position onwards.
+
+    Parameters:
+    paths (list): The files, read in order.
+    start (tuple): The file index and byte offset to start at.
+
+    Returns:
+    Iterator[tuple]: The position and end position, as (file index, byte
+        offset) pairs, and the raw bytes of every non-blank line.
+    """
+    first, offset = start
+    for index in range(first, len(paths)):
+        with open(paths[index], 'rb') as file:
+            if index == first:
+                file.seek(offset)
+            else:
+                offset = 0
+            for line in file:
+                end = offset + len(line)
+                if line.strip():
+                    yield (index, offset), (index, end), line
+                offset = end
+
+
+class _Progress:
+    """
+    Tracks the items finished out of order, so the checkpoint can name a
+    position before which everything is written.
+    """
+
+    __slots__ = ("position", "issued", "done")
+
+    def __init__(self, position):
+        self.position = position  # Everything before it has been written
+        self.issued = deque()  # (position, end) of unsettled items, in input order
+        self.done = set()  # Finished items still behind an unfinished one
+
+    def issue(self, position, end):
+        self.issued.append((position, end))
+
+    def finish(self, position):
+        """
+        Marks an item finished and returns how many items settled.
+        """
+        self.done.add(position)
+        settled = 0
+        while self.issued and self.issued[0][0] in self.done:
+            position, self.position = self.issued.popleft()
+            self.done.discard(position)
+            settled += 1
+        return settled
+
+
+class FeedIngest:
+    """
+    Streams JSONL feed files through FeedPipeline into a JSONL output.
+
+    At most max_in_flight items are analysed at once, and input is only
+    read as they finish. Results are appended in the order items finish.
+    Every checkpoint_every items, the output is flushed and the checkpoint
+    rewritten with the input position before which every item is written,
+    the items already written beyond it and the output size. On resume,
+    the output is cut back to that size, so items finished after the last
+    checkpoint are analysed again but written once.
+
+    Attributes:
+        inputs (list): The JSONL files to read, in order.
+        output (str): The JSONL file results are written to.
+        checkpoint (str): The checkpoint file.
+        career_list (list): The career list for items without their own.
+        max_in_flight (int): The number of items analysed at once.
+        checkpoint_every (int): Items finished between checkpoint writes.
+        settings (dict): The FeedPipeline arguments for every item.
+
+    Methods:
+        run(): Processes every item not yet in the output.
+        run_async(client=None): Asynchronous variant of run.
+    """
+
+    def __init__(self, inputs, output, checkpoint=None, career_list=default_careers,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 checkpoint_every=DEFAULT_CHECKPOINT_EVERY, **settings):
+        """
+        Initializes the runner. Nothing is read until it runs.
+
+        Args:
+            inputs (list): The JSONL files to read, in order.
+            output (str): The JSONL file to write results to.
+            checkpoint (str, optional): The checkpoint file. Defaults to the
+            output path with '.checkpoint' appended.
+            career_list (list, optional): The career list for items that
+            don't send their own. Defaults to TagGenerator's sample list.
+            max_in_flight (int, optional): The number of items analysed at
+            once. Defaults to DEFAULT_MAX_IN_FLIGHT.
+            checkpoint_every (int, optional): Items finished between
+            checkpoint writes. Defaults to DEFAULT_CHECKPOINT_EVERY.
+            The remaining arguments are passed to FeedPipeline for every
+            item.
+
+        Raises:
+            ValueError: If there are no inputs or a setting is invalid.
+        """
+        if not inputs:
+            raise ValueError("Give at least one input file.")
+        if not isinstance(max_in_flight, int) or max_in_flight <= 0:
+            raise ValueError("Max in flight must be a positive integer.")
+        if not isinstance(checkpoint_every, int) or checkpoint_every <= 0:
+            raise ValueError("Checkpoint interval must be a positive integer.")
+        self.inputs = [os.fspath(path) for path in inputs]
+        self.output = os.fspath(output)
+        self.checkpoint = checkpoint or self.output + ".checkpoint"
+        self.career_list = career_list
+        self.max_in_flight = max_in_flight
+        self.checkpoint_every = checkpoint_every
+        self.settings = settings
+
+    def _load_checkpoint(self):
+        """
+        Returns the saved checkpoint, or None to start afresh.
+        """
+        if not os.path.exists(self.checkpoint):
+            return None
+        with open(self.checkpoint, encoding="utf-8") as file:
+            state = json.load(file)
+        if [os.path.abspath(path) for path in state["inputs"]] != \
+                [os.path.abspath(path) for path in self.inputs]:
+            raise ValueError(f"Checkpoint {self.checkpoint} was written for other inputs.")
+        return state
+
+    def _save_checkpoint(self, progress, output, counts):
+        """
+        Makes the output durable, then atomically replaces the checkpoint.
+        """
+        output.flush()
+        os.fsync(output.fileno())
+        state = {
+            "inputs": self.inputs,
+            "position": list(progress.position),
+            "done": sorted(list(position) for position in progress.done),
+            "output_size": output.tell(),
+            **counts,
+        }
+        partial = self.checkpoint + ".tmp"
+        with open(partial, "w", encoding="utf-8") as file:
+            json.dump(state, file)
+        os.replace(partial, self.checkpoint)
+
+    async def _analyse(self, client, position, line):
+        """
+        Returns the output record of one input line.
+        """
+        item_id = f"{self.inputs[position[0]]}:{position[1]}"
+        try:
+            item = json.loads(line)
+            if not isinstance(item, dict):
+                raise ValueError("Item must be a JSON object.")
+            item_id = item.get("id", item_id)
+            content = item.get("content")
+            if not isinstance(content, str):
+                raise ValueError("Content must be a string.")
+            pipeline = FeedPipeline(content, item.get("career_list") or self.career_list,
+                                    **self.settings)
+        except ValueError as e:
+            logger.warning("Skipping item %s: %s", item_id, e)
+            return {"id": item_id, "error": str(e)}
+
+        result = await pipeline.run_async(client)
+        return {"id": item_id, **result.to_dict()}
+
+    async def run_async(self, client=None):
+        """
+        Processes every item not yet in the output, resuming from the
+        checkpoint if there is one.
+
+        Args:
+            client (ollama.AsyncClient, optional): The client used to
+            reach the Ollama API. Defaults to the pipeline's backend.
+
+        Returns:
+            dict: The number of items written and of error records, for
+            this run and in total.
+
+        Raises:
+            ValueError: If the checkpoint belongs to other inputs.
+            ollama.ResponseError: If an error occurs during the Ollama API
+            call. Everything finished before it stays checkpointed.
+        """
+        state = self._load_checkpoint()
+        progress = _Progress(tuple(state["position"]) if state else (0, 0))
+        resumed = {tuple(position) for position in state["done"]} if state else set()
+        totals = {"written": state["written"] if state else 0,
+                  "errors": state["errors"] if state else 0}
+        counts = {"written": 0, "errors": 0}
+        if state:
+            logger.info("Resuming after %d items.", totals["written"])
+
+        output = open(self.output, "r+b" if state else "wb")
+        if state:
+            output.truncate(state["output_size"])
+            output.seek(0, os.SEEK_END)
+
+        window = asyncio.Semaphore(self.max_in_flight * WINDOW_FACTOR)
+        slots = asyncio.Semaphore(self.max_in_flight)
+        active = set()
+        error = None
+        unsaved = 0
+
+        def settle(position):
+            for _ in range(progress.finish(position)):
+                window.release()
+
+        def totalled():
+            return {name: totals[name] + counts[name] for name in counts}
+
+        async def process(position, line):
+            nonlocal unsaved
+            record = await self._analyse(client, position, line)
+            output.write(json.dumps(record).encode("utf-8") + b"\n")
+            counts["written"] += 1
+            counts["errors"] += "error" in record
+            settle(position)
+            unsaved += 1
+            if unsaved >= self.checkpoint_every:
+                unsaved = 0
+                self._save_checkpoint(progress, output, totalled())
+                logger.info("Checkpointed after %d items.", totals["written"] + counts["written"])
+
+        def finished(task):
+            nonlocal error
+            active.discard(task)
+            slots.release()
+            if not task.cancelled() and task.exception() is not None and error is None:
+                error = task.exception()
+
+        try:
+            for position, end, line in iter_feed(self.inputs, progress.position):
+                await window.acquire()
+                progress.issue(position, end)
+                if position in resumed:
+                    settle(position)
+                    continue
+                await slots.acquire()
+                if error is not None:
+                    slots.release()
+                    break
+                task = asyncio.ensure_future(process(position, line))
+                active.add(task)
+                task.add_done_callback(finished)
+
+            await asyncio.gather(*active, return_exceptions=True)
+            if error is not None:
+                raise error
+        finally:
+            for task in list(active):
+                task.cancel()
+            await asyncio.gather(*active, return_exceptions=True)
+            self._save_checkpoint(progress, output, totalled())
+            output.close()
+
+        logger.info("Wrote %d items, %d of them errors.", counts["written"], counts["errors"])
+        return {**counts, "total": totalled()}
+
+    def run(self):
+        """
+        Processes every item not yet in the output.
+
+        Returns:
+            dict: See run_async.
+        """
+        return asyncio.run(self.run_async())
+
+
+def main(argv=None):
+    """
+    Runs the ingestion from the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("inputs", nargs="+", help="JSONL feed files, read in order.")
+    parser.add_argument("--output", required=True, help="JSONL file to append results to.")
+    parser.add_argument("--checkpoint",
+                        help="Checkpoint file (defaults to the output path + .checkpoint).")
+    parser.add_argument("--checkpoint-every", type=int, default=DEFAULT_CHECKPOINT_EVERY)
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help="Items analysed at once.")
+    parser.add_argument("--log-level", default=DEFAULT_LEVEL)
+    parser.add_argument("--log-file", default="-",
+                        help="JSON-lines log file, or - for stderr.")
+    parser.add_argument("--ollama-host", nargs="+",
+                        help="Ollama server URL (defaults to OLLAMA_HOST or localhost). "
+                             "Give several to spread requests over them.")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="Ollama request timeout, in seconds.")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="Chunks of one item sent at once.")
+    parser.add_argument("--chunking", choices=CHUNKING_MODES, default="chars")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--prompting", choices=PROMPTING_MODES, default="system")
+    parser.add_argument("--combined", action="store_true",
+                        help="Ask for both verdicts in one JSON reply per chunk.")
+    parser.add_argument("--tag-flagged", action="store_true",
+                        help="Tag items even when moderation flags them.")
+    parser.add_argument("--cascade-model",
+                        help="Small model that sees every chunk first; only the verdicts "
+                             "it is unsure of go to --model.")
+    parser.add_argument("--min-confidence", type=float, default=DEFAULT_MIN_CONFIDENCE,
+                        help="Confidence a fast verdict needs, with --cascade-model.")
+    parser.add_argument("--near-duplicate-threshold", type=float, default=0,
+                        help="Reuse the verdict of a chunk at least this similar to "
+                             "one analysed before (0 disables the index).")
+    parser.add_argument("--near-duplicate-path",
+                        help="SQLite file for a persistent near-duplicate index.")
+    parser.add_argument("--retries", type=int, default=0,
+                        help="Retries per chunk after a timeout or server error, "
+                             "with jittered backoff (0 disables retrying).")
+    parser.add_argument("--chunk-timeout", type=float,
+                        help="Seconds each chunk request may take, with --retries.")
+    parser.add_argument("--deadline", type=float,
+                        help="Seconds each item may take; chunks not analysed by then "
+                             "are recorded as failed instead of stopping the run.")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_ENTRIES,
+                        help="In-memory verdict cache entries (0 disables caching).")
+    parser.add_argument("--cache-path", help="SQLite file for a persistent cache tier.")
+    parser.add_argument("--careers-file",
+                        help="Career list for items without one, one title per line.")
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level, None if args.log_file == "-" else args.log_file)
+
+    hosts = args.ollama_host or [None]
+    if len(hosts) > 1:
+        backend = BackendPool(hosts, backend_options={"timeout": args.timeout})
+    else:
+        backend = OllamaBackend(hosts[0], timeout=args.timeout)
+
+    career_list = default_careers
+    if args.careers_file:
+        with open(args.careers_file, encoding="utf-8") as file:
+            career_list = [line.strip() for line in file if line.strip()]
+
+    cache = None
+    if args.cache_size > 0:
+        cache = VerdictCache(args.cache_size, path=args.cache_path)
+
+    near_duplicates = None
+    if args.near_duplicate_threshold > 0:
+        near_duplicates = NearDuplicateIndex(args.near_duplicate_threshold,
+                                             path=args.near_duplicate_path)
+
+    ingest = FeedIngest(
+        args.inputs, args.output, checkpoint=args.checkpoint, career_list=career_list,
+        max_in_flight=args.max_in_flight, checkpoint_every=args.checkpoint_every,
+        concurrency=args.concurrency, chunking=args.chunking, chunk_size=args.chunk_size,
+        model=args.model, backend=backend, prompting=args.prompting,
+        combined=args.combined, skip_flagged=not args.tag_flagged,
+        cache=cache,
+        singleflight=Singleflight(),
+        cascade=Cascade(args.cascade_model, args.min_confidence) if args.cascade_model else None,
+        near_duplicates=near_duplicates,
+        retry=RetryPolicy(args.retries + 1, timeout=args.chunk_timeout)
+        if args.retries > 0 or args.chunk_timeout else None,
+        deadline=args.deadline,
+        partial=args.deadline is not None,
+    )
+    try:
+        print(json.dumps(ingest.run()))
+    except KeyboardInterrupt:
+        logger.info("Interrupted; run the same command again to resume.")
+    finally:
+        if cache is not None:
+            cache.close()
+        if near_duplicates is not None:
+            near_duplicates.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+"""
+A module that moderates and tags feed items over a single chunking of
+each document.
+"""
+
+import asyncio
+import itertools
+import logging
+import time
+from content_guard import ContentGuard, AGENT_NAME as GUARD_NAME, task as guard_task
+from tag_generator import TagGenerator, AGENT_NAME as TAGS_NAME, task as tag_task
+from utils.backend import run, shared_backend
+from utils.chunk_data import DEFAULT_CHUNK_SIZE, Span, estimate_tokens, iter_cdc_chunks, iter_chunks, iter_token_chunks, token_budget
+from utils.dispatch import DEFAULT_CONCURRENCY, DEFAULT_MODEL, dispatch_chunks, failure
+from utils.log import DEFAULT_LOG_PATH, configure_logging, correlation
+from utils.verdicts import CLEAN_REPLY, NO_CAREERS_REPLY, ChunkFailure, is_flagged, parse_combined_reply
+
+# Label of the combined calls' metrics
+AGENT_NAME = 'pipeline'
+
+logger = logging.getLogger(__name__)
+
+task = """
+You are AI Feed Reviewer, an AI system that moderates content and matches
+it with career titles in a single pass.
+
+First, identify whether any of the following types of forbidden content
+are present:
+
+- Abusive content
+- Pornographic material
+- Discriminatory or exclusive content
+- Violent content
+- Hate speech
+- Promotion of self-harm or suicide
+- Drug-related content
+- Cyberbullying or harassment
+- Terrorism or extremist propaganda
+- Graphic violence or gore
+- Promotion of illegal activities
+- Child exploitation
+
+Then identify the key skills, topics or themes of the content and which
+career titles from the career list are relevant to it.
+
+Respond only with a JSON object of the form
+{"forbidden": ["Hate speech"], "careers": ["Data Scientist"]}
+using empty lists when no forbidden content or relevant career is found.
+"""
+
+content = ("This content talks about backend development,"
+           "APIs, databases, and server-side programming.")
+
+career_list = ["Backend Developer", "Frontend Developer",
+               "Database Administrator", "Data Scientist"]
+
+
+class PipelineResult:
+    """
+    The moderation and tagging outcome of one document.
+
+    Attributes:
+        moderation (list): The ContentGuard reply for each chunk, in chunk
+        order. It stops at the first flagged chunk when tagging of flagged
+        items is skipped. In partial runs, a ChunkFailure stands in for
+        each chunk that got no reply.
+        tags (list): The TagGenerator reply for each chunk, or None if
+        tagging was skipped because the document was flagged.
+        flagged (bool): Whether any chunk contained forbidden content.
+        chunks (int): The number of chunks the document was split into.
+        llm_calls (int): The number of requests sent to the model.
+        spans (list): The (start, end) offsets of each chunk in the
+        content, or None for file content.
+        failed (list): The indexes of the chunks that got no reply from
+        either stage, in partial runs.
+    """
+
+    __slots__ = ("moderation", "tags", "flagged", "chunks", "llm_calls", "spans", "failed")
+
+    def __init__(self, moderation, tags, flagged, chunks, llm_calls, spans=None):
+        self.moderation = moderation
+        self.tags = tags
+        self.flagged = flagged
+        self.chunks = chunks
+        self.llm_calls = llm_calls
+        self.spans = spans
+        self.failed = sorted({reply.index for replies in (moderation, tags or [])
+                              for reply in replies if isinstance(reply, ChunkFailure)})
+
+    def to_dict(self):
+        """
+        Returns the JSON-serialisable view of the result.
+        """
+        view = {name: getattr(self, name) for name in self.__slots__}
+        for name in ("moderation", "tags"):
+            if view[name] is not None:
+                view[name] = [reply.to_dict() if isinstance(reply, ChunkFailure) else reply
+                              for reply in view[name]]
+        return view
+
+    def __repr__(self):
+        return (f"PipelineResult(flagged={self.flagged!r}, chunks={self.chunks!r}, "
+                f"llm_calls={self.llm_calls!r})")
+
+
+class FeedPipeline:
+    """
+    Runs ContentGuard and TagGenerator as stages over one shared chunking
+    of a document.
+
+    The content is chunked lazily, as the stages take chunks. In separate
+    mode, moderation runs first and, unless skip_flagged is off, tagging
+    only runs on items it passed. With skip_flagged off both stages run at
+    once over one pass of the chunks, and share one limit of concurrency
+    requests. In combined mode each chunk is sent once, asking the model for
+    both verdicts as a JSON object; chunks whose reply cannot be read fall
+    back to separate calls.
+
+    Attributes:
+        guard (ContentGuard): The moderation stage.
+        tagger (TagGenerator): The tagging stage.
+        task (str): The instruction for combined calls.
+        skip_flagged (bool): Whether flagged items are left untagged.
+        combined (bool): Whether both questions are asked in one call.
+        The remaining settings are shared with both agents.
+
+    Methods:
+        run(): Moderates and tags the content.
+        run_async(client=None): Asynchronous variant of run.
+    """
+
+    def __init__(self, content, career_list, guard_task=guard_task, tag_task=tag_task,
+                 task=task, concurrency=DEFAULT_CONCURRENCY, chunking='chars',
+                 overlap=0, chunk_size=DEFAULT_CHUNK_SIZE, model=DEFAULT_MODEL,
+                 options=None, backend=None, cache=None, prefilter=None,
+                 metrics=None, prompting='inline', skip_flagged=True,
+                 combined=False, singleflight=None, cascade=None,
+                 near_duplicates=None, retry=None, breaker=None, deadline=None,
+                 partial=False):
+        """
+        Initializes both stages with the same settings.
+
+        Args:
+            content (str, file object or os.PathLike): The text content to
+            analyse, or an open file or path to stream it from.
+            career_list (list): A list of career titles to compare
+            against the content.
+            guard_task (str, optional): The ContentGuard instruction.
+            tag_task (str, optional): The TagGenerator instruction.
+            task (str, optional): The instruction for combined calls.
+            skip_flagged (bool, optional): Leave items untagged when
+            moderation flags them, and stop moderating at the first flagged
+            chunk. Defaults to True.
+            combined (bool, optional): Ask for both verdicts in one JSON
+            reply per chunk. Only use it with models that follow the
+            format reliably. Defaults to False.
+            deadline (float, optional): Seconds a whole run may take, across
+            both stages. Defaults to None.
+            partial (bool, optional): Keep the replies of the chunks that
+            were analysed when others fail or run out of time, marking
+            those with a ChunkFailure instead of raising. Defaults to False.
+            The remaining arguments are passed to both agents; see
+            ContentGuard. The prefilter, the cascade and the near-duplicate
+            index only apply to chunks analysed in separate calls. The
+            retry policy and circuit breaker apply to every request.
+
+        Raises:
+            ValueError: If the task, content, career list or any setting
+            is invalid.
+        """
+        if not task.strip():
+            raise ValueError("Task cannot be empty.")
+        settings = dict(concurrency=concurrency, chunking=chunking, overlap=overlap,
+                        chunk_size=chunk_size, model=model, options=options,
+                        backend=backend, cache=cache, metrics=metrics,
+                        prompting=prompting, singleflight=singleflight,
+                        cascade=cascade, near_duplicates=near_duplicates,
+                        retry=retry, breaker=breaker)
+        self.guard = ContentGuard(guard_task, content, prefilter=prefilter, **settings)
+        self.tagger = TagGenerator(tag_task, content, career_list, **settings)
+        self.task = task
+        self.skip_flagged = skip_flagged
+        self.combined = combined
+        self.deadline = deadline
+        self.partial = partial
+        self.llm_calls = 0
+        self._expires = None
+
+    def _chunks(self):
+        """
+        Lazily chunks the content once for every stage, as Spans when it
+        is text.
+        """
+        guard = self.guard
+        spans = isinstance(guard.content, str)
+        if guard.chunking == 'tokens':
+            # Size the chunks for the largest prompt they may be sent in
+            builders = [guard._messages, self.tagger._messages]
+            if self.combined:
+                builders.append(self._messages)
+            overhead = max(("\n".join(m['content'] for m in build(""))
+                            for build in builders), key=estimate_tokens)
+            return iter_token_chunks(
+                guard.content,
+                token_budget(guard.model, overhead),
+                overlap=guard.overlap,
+                spans=spans,
+            )
+
+        if guard.chunking == 'cdc':
+            return iter_cdc_chunks(guard.content, chunk_size=guard.chunk_size, spans=spans)
+
+        return iter_chunks(guard.content, chunk_size=guard.chunk_size, spans=spans)
+
+    def _passes(self):
+        """
+        Starts a pass over the chunks, and returns it with a function that
+        starts another one for a later stage.
+
+        Text, paths and buffers are chunked again, and seekable files read
+        again from where they started, so no chunks are held between
+        passes. Other streams are read once, and their chunks are kept for
+        the later pass.
+        """
+        content = self.guard.content
+        if not hasattr(content, "read"):
+            return self._chunks(), self._chunks
+        if content.seekable():
+            start = content.tell()
+
+            def again():
+                content.seek(start)
+                return self._chunks()
+
+            return self._chunks(), again
+        first, replay = itertools.tee(self._chunks())
+        return first, lambda: replay
+
+    @staticmethod
+    def _recorded(chunks, spans):
+        """
+        Notes the span of each chunk as a stage takes it, None for text.
+        """
+        for chunk in chunks:
+            spans.append((chunk.start, chunk.end) if isinstance(chunk, Span) else None)
+            yield chunk
+
+    def _messages(self, chunk):
+        """
+        Builds the chat messages of a combined call for one chunk.
+        """
+        preamble = f"{self.task}\nCareer list: {', '.join(self.tagger.career_list)}"
+        if self.guard.prompting == 'system':
+            return [
+                {'role': 'system', 'content': preamble},
+                {'role': 'user', 'content': chunk},
+            ]
+        return [{'role': 'user', 'content': f"{preamble}\n{chunk}"}]
+
+    async def _dispatch(self, client, name, chunks, build_messages, **settings):
+        """
+        Sends chunks through one stage and records its metrics.
+        """
+        guard = self.guard
+        deadline = None
+        if self._expires is not None:
+            deadline = self._expires - asyncio.get_running_loop().time()
+            if deadline <= 0:
+                # An earlier stage used up the whole deadline
+                return self._expired(chunks)
+        started = time.perf_counter()
+        results = await dispatch_chunks(
+            client,
+            chunks,
+            build_messages,
+            model=guard.model,
+            concurrency=guard.concurrency,
+            cache=guard.cache,
+            options=guard.options,
+            count_tokens=estimate_tokens if guard.metrics is not None else None,
+            singleflight=guard.singleflight,
+            retry=guard.retry,
+            breaker=guard.breaker,
+            deadline=deadline,
+            partial=self.partial,
+            **settings,
+        )
+        self.llm_calls += sum(result.tier == 'llm' for result in results)
+        if guard.metrics is not None:
+            guard.metrics.record_run(name, results, time.perf_counter() - started)
+        return results
+
+    def _expired(self, chunks):
+        """
+        Marks every chunk of a stage that had no time left to run.
+        """
+        timeout = asyncio.TimeoutError(f"Deadline of {self.deadline}s passed.")
+        if not self.partial:
+            raise timeout
+        results = []
+        for index, chunk in enumerate(chunks):
+            result = failure(index, timeout)
+            if isinstance(chunk, Span):
+                result.span = (chunk.start, chunk.end)
+            results.append(result)
+        return results
+
+    @staticmethod
+    def _reply(result):
+        """
+        Returns the reply of a ChunkResult, or a ChunkFailure if it got none.
+        """
+        if result.response is None:
+            return ChunkFailure(result.index, result.tier, result.error, result.span)
+        return result.response
+
+    async def _run_stages(self, client, chunks, again=None):
+        """
+        Moderates and tags the chunks with separate calls.
+
+        When flagged items are tagged too, both stages read one pass over
+        the chunks at the same time and share one request limit. Otherwise
+        tagging waits for moderation and takes its chunks from again().
+        """
+        prefilter = self.guard.prefilter
+        moderate = lambda chunks, **limit: self._dispatch(
+            client, GUARD_NAME, chunks, self.guard._messages,
+            screen=prefilter.screen if prefilter else None,
+            cascade=self.guard._cascade_stage(),
+            near_duplicates=self.guard._near_duplicate_scope(),
+            stop_when=(lambda result: is_flagged(result.response)) if self.skip_flagged else None,
+            **limit,
+        )
+        tag = lambda chunks, **limit: self._dispatch(
+            client, TAGS_NAME, chunks, self.tagger._messages,
+            cascade=self.tagger._cascade_stage(),
+            near_duplicates=self.tagger._near_duplicate_scope(),
+            **limit,
+        )
+        if not self.skip_flagged:
+            # The stages take slots in turn, so the tee only holds the few
+            # chunks one of them has read ahead of the other
+            first, second = itertools.tee(chunks)
+            semaphore = asyncio.Semaphore(self.guard.concurrency)
+            return await asyncio.gather(moderate(first, semaphore=semaphore),
+                                        tag(second, semaphore=semaphore))
+
+        moderation = await moderate(chunks)
+        if any(result.response is not None and is_flagged(result.response)
+               for result in moderation):
+            return moderation, []
+        return moderation, await tag(again())
+
+    async def _run_combined(self, client, chunks, again):
+        """
+        Moderates and tags each chunk with one JSON call, falling back to
+        separate calls for replies that cannot be read. The chunks to ask
+        again are taken from again().
+        """
+        def flagged(result):
+            parsed = parse_combined_reply(result.response)
+            return parsed is not None and bool(parsed[0])
+
+        results = await self._dispatch(
+            client, AGENT_NAME, chunks, self._messages, format='json',
+            stop_when=flagged if self.skip_flagged else None,
+        )
+
+        moderation, tags, retry = {}, {}, []
+        for result in results:
+            if result.response is None:
+                # Failed or out of time; asking again separately won't help
+                moderation[result.index] = tags[result.index] = self._reply(result)
+                continue
+            parsed = parse_combined_reply(result.response)
+            if parsed is None:
+                retry.append(result.index)
+                continue
+            forbidden, careers = parsed
+            moderation[result.index] = f"Yes: {', '.join(forbidden)}" if forbidden else CLEAN_REPLY
+            tags[result.index] = ", ".join(careers) if careers else NO_CAREERS_REPLY
+
+        if retry:
+            logger.warning("Combined reply unreadable for %d chunks; asking separately.",
+                           len(retry))
+            wanted = set(retry)
+            unread = [chunk for index, chunk in zip(range(retry[-1] + 1), again())
+                      if index in wanted]
+            retried = await self._run_stages(client, unread, lambda: unread)
+            for replies, results in zip((moderation, tags), retried):
+                for result in results:
+                    # Number the chunk as in the document
+                    result.index = retry[result.index]
+                    replies[result.index] = self._reply(result)
+
+        return ([moderation[index] for index in sorted(moderation)],
+                [tags[index] for index in sorted(tags)])
+
+    async def run_async(self, client=None):
+        """
+        Moderates and tags the content.
+
+        Args:
+            client (ollama.AsyncClient, optional): The client used to
+            reach the Ollama API. Defaults to the agents' backend.
+
+        Returns:
+            PipelineResult: The replies of both stages.
+
+        Raises:
+            ollama.ResponseError: If an error occurs during the Ollama API call.
+            asyncio.TimeoutError: If the deadline passed, unless partial.
+        """
+        if client is None:
+            client = self.guard.backend or shared_backend()
+        self.llm_calls = 0
+        self._expires = None
+        if self.deadline is not None:
+            self._expires = asyncio.get_running_loop().time() + self.deadline
+
+        with correlation():
+            logger.info(f"Moderating and tagging content with {self.guard.model}.")
+            spans = []
+            if self.combined or self.skip_flagged:
+                first, again = self._passes()
+            else:
+                first, again = self._chunks(), None
+            chunks = self._recorded(first, spans)
+            if self.combined:
+                moderation, tags = await self._run_combined(client, chunks, again)
+            else:
+                moderation, tags = await self._run_stages(client, chunks, again)
+                moderation = [self._reply(result) for result in moderation]
+                tags = [self._reply(result) for result in tags]
+            # Count the chunks after a flagged one, which no stage took.
+            # Dropping again first lets a tee free what it kept for it
+            again = None
+            for _ in chunks:
+                pass
+
+        flagged = any(isinstance(reply, str) and is_flagged(reply) for reply in moderation)
+        if flagged and self.skip_flagged:
+            tags = None
+        return PipelineResult(moderation, tags, flagged, len(spans), self.llm_calls,
+                              spans if spans and spans[0] is not None else None)
+
+    def run(self):
+        """
+        Moderates and tags the content.
+
+        Returns:
+            PipelineResult: The replies of both stages.
+
+        Raises:
+            ollama.ResponseError: If an error occurs during the Ollama API call.
+            asyncio.TimeoutError: If the deadline passed, unless partial.
+        """
+        return run(self.run_async(), self.guard.backend or shared_backend())
+
+
+if __name__ == "__main__":
+    configure_logging(path=DEFAULT_LOG_PATH)
+    pipeline = FeedPipeline(content, career_list)
+    print(pipeline.run().to_dict())
@@ -2,27 +2,32 @@
 An AI agent module that creates career tags based on provided content or feeds.
 """
 
+import asyncio
+import heapq
+import json
+import os
+import time
 import ollama
 import logging
-from utils.chunk_data import chunk_prompt  # Import the chunking utility
+from utils.batching import BATCH_INSTRUCTIONS, DEFAULT_BATCH_CHARS, dispatch_batches
+from utils.backend import run, shared_backend
+from utils.cache import make_key
+from utils.cascade import TAGS_CASCADE_FORMAT
+from utils.chunk_data import DEFAULT_CHUNK_SIZE, chunk_hash, context_tokens, estimate_tokens, iter_cdc_chunks, iter_chunks, iter_hashed, iter_token_chunks, token_budget  # Import the chunking utility
+from utils.dispatch import DEFAULT_CONCURRENCY, DEFAULT_MODEL, dispatch_chunks
+from utils.log import DEFAULT_LOG_PATH, configure_logging, correlation
+from utils.verdicts import NO_CAREERS_REPLY, ChunkFailure, STRUCTURED_STOP, TAGS_FORMAT, DocumentTags, TagVerdict
 
-# Define the log directory and file
-log_dir = "/var/log/NRL-product-1/Daemon_Server"
-log_file = "ai_agents.log"
-log_path = os.path.join(log_dir, log_file)
+CHUNKING_MODES = ('chars', 'tokens', 'cdc')
+PROMPTING_MODES = ('inline', 'system')
 
-# Ensure the log directory exists, create it if necessary
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir, exist_ok=True)
+# Label of this agent's metrics
+AGENT_NAME = 'tag_generator'
 
-# Configure logging to output to the specified log file
-logging.basicConfig(
-    filename=log_path,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Ceiling on the reply length in structured mode, whatever the list size
+MAX_STRUCTURED_NUM_PREDICT = 256
 
-logging.info("Logging TagGenerator...")
+logger = logging.getLogger(__name__)
 
 task = """
 You are AI Career Tag generator, an AI system designed to analyze content
@@ -58,31 +63,172 @@ class TagGenerator:
 
     Attributes:
         task (str): The primary instruction for the AI model.
-        content (str): The text content to be analyzed for
-        career relevance.
+        content (str, file object or os.PathLike): The text content
+        to be analyzed for career relevance, or an open file or path to
+        stream it from.
         career_list (list): A list of career titles to compare
         against the content.
+        concurrency (int): The maximum number of chunks sent to
+        the model at once.
+        chunking (str): 'chars' for fixed-size character chunks,
+        'tokens' for chunks sized to the model's context window or 'cdc'
+        for content-defined chunks that stay the same across edits.
+        chunk_size (int): The maximum size of each chunk in 'chars' and
+        'cdc' modes.
+        overlap (int): Tokens repeated between adjacent chunks in
+        'tokens' mode.
+        model (str): The Ollama model the chunks are sent to.
+        options (dict): Model options, such as num_ctx, num_predict or
+        num_thread, sent with every request.
+        backend (OllamaBackend): The shared client used when no client
+        is passed to agent_async.
+        cache (VerdictCache): Replies of earlier runs, consulted before
+        each chunk is sent.
+        metrics (MetricsSink): Receives the timings and token counts of
+        every chunk and document.
+        shortlist (CareerShortlist): Narrows the career list down to the
+        titles closest to each chunk before it is put in the prompt.
+        singleflight (Singleflight): Lets chunks share the reply of an
+        identical request already in flight.
+        cascade (Cascade): Sends chunks to a small model first and only
+        escalates the tags it is unsure of to model.
+        near_duplicates (NearDuplicateIndex): Tags of earlier chunks, reused
+        for chunks nearly identical to them.
+        retry (RetryPolicy): How failed or slow requests are retried.
+        breaker (CircuitBreaker): Fails requests fast while the backend
+        keeps failing.
+        deadline (float): Seconds one run may take, or None.
+        prompting (str): 'inline' for a single user message per chunk or
+        'system' to keep the fixed preamble in a reusable system message.
+        structured (bool): Whether replies are requested as bounded JSON
+        and returned as DocumentTags.
+        chunk_results (list): The ChunkResult of every chunk of the
+        last run, recording which tier decided it.
+        chunk_verdicts (dict): The reply of every chunk of the last
+        incremental run, by chunk hash.
 
     Methods:
         agent(task_prompt=None, content_prompt=None): Generates career
         tags based on the given prompts.
+        agent_async(task_prompt=None, content_prompt=None, client=None):
+        Asynchronous variant of agent that fans the chunks out concurrently.
+        agent_incremental(previous=None, task_prompt=None): Re-analyses
+        edited content, only sending the chunks an earlier run has no
+        verdict for.
+        agent_batch(task, docs, career_list): Generates career tags for many
+        short documents, packing them into shared prompts.
     """
 
-    def __init__(self, task, content, career_list):
+    def __init__(self, task, content, career_list,
+                 concurrency=DEFAULT_CONCURRENCY, chunking='chars', overlap=0,
+                 chunk_size=DEFAULT_CHUNK_SIZE,
+                 model=DEFAULT_MODEL, options=None, backend=None, cache=None,
+                 shortlist=None, metrics=None, prompting='inline', structured=False,
+                 singleflight=None, cascade=None, near_duplicates=None,
+                 retry=None, breaker=None, deadline=None):
         """
-        Initializes the ContentGuard object with external values.
+        Initializes the TagGenerator object with external values.
 
         Args:
             task (str): The primary instruction for the AI model.
-            content (str): The text content to be analyzed for
-            career relevance.
+            content (str, file object or os.PathLike): The text content
+            to be analyzed for career relevance, or an open file or path
+            to stream it from chunk by chunk.
             career_list (list): A list of career titles to compare
             against the content.
+            concurrency (int, optional): The maximum number of chunks
+            sent to the model at once. Defaults to DEFAULT_CONCURRENCY.
+            chunking (str, optional): 'chars' for chunk_size-character chunks,
+            'tokens' to fill the model's context window, less the prompt
+            overhead, or 'cdc' for content-defined chunks of at most
+            chunk_size characters whose boundaries survive edits elsewhere
+            in the content. Defaults to 'chars'.
+            overlap (int, optional): Tokens repeated between adjacent chunks
+            in 'tokens' mode. Defaults to 0.
+            chunk_size (int, optional): The maximum size of each chunk in
+            'chars' and 'cdc' modes. Defaults to DEFAULT_CHUNK_SIZE.
+            model (str, optional): The Ollama model to use. Defaults to
+            DEFAULT_MODEL.
+            options (dict, optional): Model options sent with every
+            request. In 'tokens' mode num_ctx defaults to the model's
+            context window. Defaults to None.
+            backend (OllamaBackend, optional): The client used when none is
+            passed to agent_async. Defaults to the process-wide backend.
+            cache (VerdictCache, optional): A cache, possibly shared with
+            other agents, consulted before each chunk is sent. Defaults to None.
+            shortlist (CareerShortlist, optional): An embedding shortlist
+            over career_list, so only the closest titles go into each
+            prompt. Defaults to None, sending the whole list.
+            metrics (MetricsSink, optional): Receives per-chunk and
+            per-document metrics. Defaults to None.
+            prompting (str, optional): 'inline' to send the task, chunk
+            and career list as one user message, or 'system' to send the
+            task and career list as a system message that stays the same
+            for every chunk, so the server can reuse its prompt cache.
+            With a shortlist, the shortlisted titles follow the chunk
+            instead. Defaults to 'inline'.
+            structured (bool, optional): Ask for JSON replies, capped by
+            num_predict (enough for every title a prompt can carry, at most
+            MAX_STRUCTURED_NUM_PREDICT, unless set in options) and a stop
+            sequence, and return DocumentTags instead
+            of reply strings. Defaults to False.
+            singleflight (Singleflight, optional): A table of requests in
+            flight, possibly shared with other agents, so identical chunks
+            sent at the same time make one model call. Defaults to None.
+            cascade (Cascade, optional): Ask cascade.model first and only
+            send model the chunks whose fast tags are unreadable, not
+            confident enough or not on the career list. Each ChunkResult
+            records the models it went through. Defaults to None.
+            near_duplicates (NearDuplicateIndex, optional): An index,
+            possibly shared with other agents, whose tags are reused for
+            chunks nearly identical to one analysed before with the same
+            task, career list and model. Defaults to None.
+            retry (RetryPolicy, optional): Retries transient failures with
+            jittered backoff, and cuts off attempts that take longer than
+            its timeout. Defaults to None.
+            breaker (CircuitBreaker, optional): A breaker, shared by the
+            agents using the same backend, that refuses requests while it
+            keeps failing. Defaults to None.
+            deadline (float, optional): Seconds one run may take; the
+            chunks still running then are cancelled. Defaults to None.
         """
         self.validate_input(task, content, career_list)
+        if chunking not in CHUNKING_MODES:
+            raise ValueError(f"Chunking must be one of {CHUNKING_MODES}.")
+        if prompting not in PROMPTING_MODES:
+            raise ValueError(f"Prompting must be one of {PROMPTING_MODES}.")
         self.task = task
         self.content = content
         self.career_list = career_list
+        self.concurrency = concurrency
+        self.chunking = chunking
+        self.overlap = overlap
+        self.chunk_size = chunk_size
+        self.model = model
+        self.options = dict(options or {})
+        if chunking == 'tokens':
+            # Make the server allocate the window the chunks are sized for
+            self.options.setdefault('num_ctx', context_tokens(model))
+        self.backend = backend
+        self.cache = cache
+        self.metrics = metrics
+        self.shortlist = shortlist
+        if structured:
+            # Room for every title a prompt can carry, quoted and
+            # comma-separated, up to a fixed ceiling
+            self.options.setdefault('num_predict', min(MAX_STRUCTURED_NUM_PREDICT, 8 + sum(
+                estimate_tokens(f'"{career}", ') for career in self._prompt_careers())))
+            self.options.setdefault('stop', list(STRUCTURED_STOP))
+        self.singleflight = singleflight
+        self.cascade = cascade
+        self.near_duplicates = near_duplicates
+        self.retry = retry
+        self.breaker = breaker
+        self.deadline = deadline
+        self.prompting = prompting
+        self.structured = structured
+        self.chunk_results = []
+        self.chunk_verdicts = {}
 
     def validate_input(self, task, content, career_list):
         """
@@ -93,65 +239,366 @@ class TagGenerator:
         """
         if not task.strip():
             raise ValueError("Task cannot be empty.")
-        if not content.strip():
-            raise ValueError("Content cannot be empty.")
+        if isinstance(content, str):
+            if not content.strip():
+                raise ValueError("Content cannot be empty.")
+        elif not (isinstance(content, os.PathLike) or hasattr(content, "read")):
+            raise ValueError("Content must be text, a file object or a path.")
         if not career_list or not all(
                 isinstance(career, str) for career in career_list):
             raise ValueError("Career list must contain valid career titles.")
 
-    def agent(self, task_prompt=None, content_prompt=None):
+    def _chunks(self):
         """
-        Generates career tags based on the given prompts.
+        Lazily chunks the content according to the chunking mode. Text
+        content is chunked into Spans, so each chunk's text is only built
+        when it is sent and its results keep its offsets.
+        """
+        spans = isinstance(self.content, str)
+        if self.chunking == 'tokens':
+            # Measure the fixed part of the prompt once, with an empty chunk
+            # and the longest titles a prompt can carry
+            careers = None if self.shortlist is None else self._prompt_careers()
+            overhead = "\n".join(m['content'] for m in self._messages("", careers))
+            return iter_token_chunks(
+                self.content,
+                token_budget(self.model, overhead),
+                overlap=self.overlap,
+                spans=spans,
+            )
+
+        if self.chunking == 'cdc':
+            return iter_cdc_chunks(self.content, chunk_size=self.chunk_size, spans=spans)
+
+        # Chunk the content
+        return iter_chunks(self.content, chunk_size=self.chunk_size, spans=spans)
+
+    def _prompt_careers(self):
+        """
+        The longest career titles one prompt can carry: the whole list, or
+        the shortlist's top_k longest titles.
+        """
+        if self.shortlist is None:
+            return self.career_list
+        return heapq.nlargest(self.shortlist.top_k, self.shortlist.career_list, key=len)
+
+    def _messages(self, chunk, careers=None, fast=False):
+        """
+        Builds the chat messages sent to the model, or to the cascade's
+        fast model, for one chunk.
+        """
+        if fast:
+            task = self.task + TAGS_CASCADE_FORMAT
+        else:
+            task = self.task + TAGS_FORMAT if self.structured else self.task
+        if self.prompting == 'system':
+            if careers is None:
+                # The whole list is the same for every chunk, so it belongs
+                # in the cacheable preamble
+                preamble = f"{task}\nCareer list: {', '.join(self.career_list)}"
+                return [
+                    {'role': 'system', 'content': preamble},
+                    {'role': 'user', 'content': chunk},
+                ]
+            return [
+                {'role': 'system', 'content': task},
+                {'role': 'user', 'content': f"{chunk}\nCareer list: {', '.join(careers)}"},
+            ]
+
+        careers = self.career_list if careers is None else careers
+        return [
+            {
+                'role': 'user',
+                'content': f"{task}\n{chunk}\n{', '.join(careers)}"
+            }
+        ]
+
+    def _fast_messages(self, chunk):
+        """
+        Builds the chat messages of the cascade's fast tier.
+        """
+        return self._messages(chunk, fast=True)
+
+    def _accept_fast(self, response):
+        """
+        Turns a confident fast tier reply into this agent's reply, or
+        returns None to escalate the chunk.
+        """
+        careers = self.cascade.read(response, "careers", allowed=self.career_list)
+        if careers is None:
+            return None
+        if self.structured:
+            return json.dumps({"careers": careers})
+        return ", ".join(careers) if careers else NO_CAREERS_REPLY
+
+    def _cascade_stage(self, fast_messages=None):
+        """
+        Binds the cascade, if any, to this agent.
+        """
+        if self.cascade is None:
+            return None
+        return self.cascade.stage(fast_messages or self._fast_messages, self._accept_fast)
+
+    def _near_duplicate_scope(self):
+        """
+        Binds the near-duplicate index, if any, to this agent's prompt.
+        """
+        if self.near_duplicates is None:
+            return None
+        return self.near_duplicates.scope(make_key(self.model, self._messages("")))
+
+    async def agent_async(self, task_prompt=None, content_prompt=None,
+                          client=None, previous=None, partial=False):
+        """
+        Generates career tags, sending all chunks to the model concurrently.
 
         Args:
             task_prompt (str, optional): Additional instructions
             to append to the main task. Defaults to None.
             content_prompt (str, optional): Additional content
             to analyze. Defaults to None.
+            client (ollama.AsyncClient, optional): The client used to
+            reach the Ollama API. Defaults to the agent's backend.
+            previous (dict, optional): The chunk_verdicts of an earlier run
+            with the same task, career list and model. Chunks found in it
+            are not sent again, and this run's chunk_verdicts are recorded.
+            Defaults to None.
+            partial (bool, optional): Keep the tags of the chunks that were
+            analysed when others fail or time out, marking those with a
+            ChunkFailure instead of raising. Defaults to False.
 
         Returns:
             list: A list of strings indicating relevant career titles
-            for each chunk or 'No relevant careers found.'
+            for each chunk or 'No relevant careers found.', in chunk order,
+            with a ChunkFailure for each chunk that got no reply.
+            DocumentTags: The per-chunk and document tags, in structured mode.
 
         Raises:
+            ValueError: If content_prompt is given for streamed content.
             ollama.ResponseError: If an error occurs during the Ollama API call.
         """
         if task_prompt:
             self.task += "\n" + task_prompt
 
         if content_prompt:
+            if not isinstance(self.content, str):
+                raise ValueError("content_prompt requires string content.")
             self.content += "\n" + content_prompt
 
-        # Chunk the content
-        content_chunks = chunk_prompt(self.content, chunk_size=1000)  # Example chunk size of 1000 characters
-        responses = []
-
-        for chunk in content_chunks:
-            full_prompt = f"{self.task}\n{chunk}\n{', '.join(self.career_list)}"
-
-            try:
-                logging.info("Sending prompt to Ollama API...")
-                response = ollama.chat(
-                    model='phi3',
-                    messages=[
-                        {
-                            'role': 'user',
-                            'content': full_prompt
-                        }
-                    ],
-                )
-                responses.append(response['message']['content'])
-            except ollama.ResponseError as e:
-                logging.error(f"Ollama API error: {e}")
-                raise e
-            except Exception as e:
-                logging.error(f"Unexpected error occurred: {e}")
-                raise  e
-
-        return responses  # Return responses for each chunk
-
-
-guard = TagGenerator(task, content, career_list)
-results = guard.agent()
-for result in results:
-    print(result)
\ No newline at end of file
+        started = time.perf_counter()
+        content_chunks = self._chunks()
+        hashes, reuse = [], None
+        if previous is not None:
+            content_chunks = iter_hashed(content_chunks, hashes)
+            reuse = lambda chunk: previous.get(chunk_hash(chunk))
+
+        if client is None:
+            client = self.backend or shared_backend()
+
+        build_messages, fast_messages = self._messages, None
+        if self.shortlist is not None:
+            await self.shortlist.load(client)
+
+            async def build_messages(chunk):
+                return self._messages(chunk, await self.shortlist.select(client, chunk))
+
+            async def fast_messages(chunk):
+                return self._messages(chunk, await self.shortlist.select(client, chunk),
+                                      fast=True)
+
+        with correlation():
+            logger.info(f"Analysing content with {self.model}.")
+            self.chunk_results = await dispatch_chunks(
+                client,
+                content_chunks,
+                build_messages,
+                model=self.model,
+                concurrency=self.concurrency,
+                cache=self.cache,
+                options=self.options,
+                count_tokens=estimate_tokens if self.metrics is not None else None,
+                format='json' if self.structured else None,
+                reuse=reuse,
+                singleflight=self.singleflight,
+                near_duplicates=self._near_duplicate_scope(),
+                cascade=self._cascade_stage(fast_messages),
+                retry=self.retry,
+                breaker=self.breaker,
+                deadline=self.deadline,
+                partial=partial,
+            )
+        self.chunk_verdicts = {hashes[result.index]: result.response
+                               for result in self.chunk_results
+                               if result.response is not None} if reuse else {}
+        if self.metrics is not None:
+            self.metrics.record_run(AGENT_NAME, self.chunk_results,
+                                    time.perf_counter() - started)
+        if self.structured:
+            return DocumentTags([self._failure(result) if result.response is None else
+                                 TagVerdict.from_reply(result.index, result.response,
+                                                       self.career_list, result.span)
+                                 for result in self.chunk_results])
+        return [self._failure(result) if result.response is None else result.response
+                for result in self.chunk_results]
+
+    @staticmethod
+    def _failure(result):
+        """
+        Marks a ChunkResult that got no reply.
+        """
+        return ChunkFailure(result.index, result.tier, result.error, result.span)
+
+    def agent(self, task_prompt=None, content_prompt=None, partial=False):
+        """
+        Generates career tags based on the given prompts.
+
+        Args:
+            task_prompt (str, optional): Additional instructions
+            to append to the main task. Defaults to None.
+            content_prompt (str, optional): Additional content
+            to analyze. Defaults to None.
+            partial (bool, optional): Return what was analysed when chunks
+            fail or time out; see agent_async. Defaults to False.
+
+        Returns:
+            list: A list of strings indicating relevant career titles
+            for each chunk or 'No relevant careers found.'
+            DocumentTags: The tags, in structured mode.
+
+        Raises:
+            ollama.ResponseError: If an error occurs during the Ollama API call.
+        """
+        return run(self.agent_async(task_prompt, content_prompt, partial=partial),
+                   self.backend or shared_backend())
+
+    async def agent_incremental_async(self, previous=None, task_prompt=None,
+                                      client=None):
+        """
+        Re-generates tags, reusing the replies an earlier run gave to
+        chunks that have not changed, so the cost of analysing an edited
+        document scales with the size of the edit. Use it with
+        chunking='cdc', whose chunks survive edits elsewhere in the content.
+
+        Args:
+            previous (dict, optional): The chunk hash to reply map returned
+            by the earlier run. Defaults to None, analysing every chunk.
+            task_prompt, client: See agent_async.
+
+        Returns:
+            tuple: What agent_async returns, and the chunk hash to reply map
+            to pass to the next run.
+
+        Raises:
+            ollama.ResponseError: If an error occurs during the Ollama API call.
+        """
+        result = await self.agent_async(task_prompt, client=client, previous=previous or {})
+        return result, self.chunk_verdicts
+
+    def agent_incremental(self, previous=None, task_prompt=None):
+        """
+        Re-generates tags, only sending the chunks that changed.
+
+        Args:
+            previous (dict, optional): The chunk hash to reply map returned
+            by the earlier run. Defaults to None.
+            task_prompt (str, optional): See agent_async.
+
+        Returns:
+            tuple: What agent returns, and the chunk hash to reply map to
+            pass to the next run.
+
+        Raises:
+            ollama.ResponseError: If an error occurs during the Ollama API call.
+        """
+        return run(self.agent_incremental_async(previous, task_prompt),
+                   self.backend or shared_backend())
+
+    @classmethod
+    async def agent_batch_async(cls, task, docs, career_list, client=None,
+                                max_chars=DEFAULT_BATCH_CHARS, **options):
+        """
+        Generates career tags for many documents, packing short ones into
+        shared prompts so the task preamble and career list are sent once
+        per batch instead of once per document.
+
+        Args:
+            task (str): The primary instruction for the AI model.
+            docs (list): The text content of each document.
+            career_list (list): A list of career titles to compare
+            against the content.
+            client (ollama.AsyncClient, optional): The client used to
+            reach the Ollama API. Defaults to the agent's backend.
+            max_chars (int, optional): The maximum size of the packed
+            content of one prompt. Defaults to DEFAULT_BATCH_CHARS.
+            **options: Further TagGenerator arguments, such as
+            concurrency, model, options or cache.
+
+        Returns:
+            list: For each document, the list of replies agent would
+            return for it. Batched documents have a single reply.
+
+        Raises:
+            ValueError: If the task, career list or any document is invalid,
+            or structured replies or a cascade are requested.
+            ollama.ResponseError: If an error occurs during the Ollama API call.
+        """
+        if not all(isinstance(doc, str) for doc in docs):
+            raise ValueError("Batched documents must be strings.")
+        if options.get('structured'):
+            raise ValueError("Batches do not support structured replies.")
+        if options.get('cascade'):
+            raise ValueError("Batches do not support cascades.")
+        generators = [cls(task, doc, career_list, **options) for doc in docs]
+        batcher = cls(task + BATCH_INSTRUCTIONS, "batch", career_list, **options)
+
+        if client is None:
+            client = batcher.backend or shared_backend()
+
+        async def run_single(index, limited):
+            return await generators[index].agent_async(client=limited)
+
+        return await dispatch_batches(
+            client,
+            docs,
+            batcher._messages,
+            run_single,
+            model=batcher.model,
+            concurrency=batcher.concurrency,
+            max_chars=max_chars,
+            cache=batcher.cache,
+            options=batcher.options,
+            retry=batcher.retry,
+            breaker=batcher.breaker,
+        )
+
+    @classmethod
+    def agent_batch(cls, task, docs, career_list, **options):
+        """
+        Generates career tags for many documents, packing short ones into
+        shared prompts.
+
+        Args:
+            task (str): The primary instruction for the AI model.
+            docs (list): The text content of each document.
+            career_list (list): A list of career titles to compare
+            against the content.
+            **options: See agent_batch_async.
+
+        Returns:
+            list: For each document, the list of replies agent would
+            return for it.
+
+        Raises:
+            ValueError: If the task, career list or any document is invalid.
+            ollama.ResponseError: If an error occurs during the Ollama API call.
+        """
+        return run(cls.agent_batch_async(task, docs, career_list, **options),
+                   options.get('client') or options.get('backend') or shared_backend())
+
+
+if __name__ == "__main__":
+    configure_logging(path=DEFAULT_LOG_PATH)
+    guard = TagGenerator(task, content, career_list)
+    results = guard.agent()
+    for result in results:
+        print(result)
@@ -0,0 +1,191 @@
+"""
+    Unit tests for the stub Ollama server and the benchmark runner.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+# Add the directory containing the agents to the system path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.run_benchmark import main, make_corpus, percentile
+from benchmarks.stub_ollama import StubOllama, parse_keep_alive
+from content_guard import ContentGuard
+from utils.backend import OllamaBackend
+from utils.backend_pool import BackendPool
+from utils.chunk_data import chunk_prompt, estimate_tokens
+
+
+class TestStubOllama(unittest.TestCase):
+
+    def run_against_stub(self, stub, scenario):
+        async def run():
+            url = await stub.start()
+            backend = OllamaBackend(url)
+            try:
+                return await scenario(backend)
+            finally:
+                await backend.aclose()
+                await stub.stop()
+
+        return asyncio.run(run())
+
+    def test_agent_runs_against_stub(self):
+        """
+        Test that an agent gets the stub's replies through a real client.
+        """
+        stub = StubOllama(reply="No, no forbidden content found.", parallel=2)
+        guard = ContentGuard("Check this.", make_corpus(1, 600)[0],
+                             chunk_size=500, concurrency=4)
+
+        replies = self.run_against_stub(stub, lambda backend: guard.agent_async(client=backend))
+
+        self.assertGreater(len(replies), 1)
+        self.assertEqual(set(replies), {"No, no forbidden content found."})
+        self.assertEqual(stub.requests, len(replies))
+        self.assertLessEqual(stub.peak_in_flight, 2)
+
+    def test_latency_and_metadata(self):
+        """
+        Test that replies take the simulated time and report token counts.
+        """
+        stub = StubOllama(reply="one two three four", token_latency=0.01)
+
+        async def scenario(backend):
+            started = time.perf_counter()
+            response = await backend.chat('phi3', [{'role': 'user', 'content': "hi"}])
+            return response, time.perf_counter() - started
+
+        response, elapsed = self.run_against_stub(stub, scenario)
+
+        self.assertEqual(response['message']['content'], "one two three four")
+        self.assertEqual(response['eval_count'], estimate_tokens("one two three four"))
+        self.assertEqual(response['prompt_eval_count'], estimate_tokens("hi"))
+        self.assertGreaterEqual(elapsed, 0.01 * response['eval_count'])
+
+    def test_model_is_reloaded_after_keep_alive(self):
+        """
+        Test that the model stays loaded for keep_alive and is loaded again
+        after it expires.
+        """
+        stub = StubOllama()
+
+        async def scenario(backend):
+            messages = [{'role': 'user', 'content': "hi"}]
+            await backend.chat('phi3', messages, keep_alive='1m')
+            await backend.chat('phi3', messages, keep_alive=0)
+            await backend.chat('phi3', messages)
+
+        self.run_against_stub(stub, scenario)
+
+        self.assertEqual(stub.loads, 2)
+
+    def test_prompt_cache_reuses_leading_messages(self):
+        """
+        Test that a repeated system message is only evaluated once.
+        """
+        stub = StubOllama(prompt_cache=True)
+        system = {'role': 'system', 'content': "A long fixed task preamble."}
+
+        async def scenario(backend):
+            first = await backend.chat('phi3', [system, {'role': 'user', 'content': "one"}])
+            second = await backend.chat('phi3', [system, {'role': 'user', 'content': "two"}])
+            return first, second
+
+        first, second = self.run_against_stub(stub, scenario)
+
+        self.assertEqual(second['prompt_eval_count'], estimate_tokens("two"))
+        self.assertEqual(first['prompt_eval_count'] - second['prompt_eval_count'],
+                         stub.cached_tokens)
+
+    def test_pool_spreads_chunks_over_stubs(self):
+        """
+        Test that one document's chunks spread over several servers, that
+        a failing server is ejected and that health checks see it.
+        """
+        stubs = [StubOllama(token_latency=0.001, parallel=2) for _ in range(3)]
+        stubs[2].failing = True
+        guard = ContentGuard("Check this.", make_corpus(1, 2000)[0],
+                             chunk_size=300, concurrency=6)
+
+        async def run():
+            urls = [await stub.start() for stub in stubs]
+            pool = BackendPool(urls, max_in_flight=2, failure_threshold=1)
+            try:
+                health = await pool.check_health()
+                replies = await guard.agent_async(client=pool)
+                return health, replies, pool.stats()
+            finally:
+                await pool.aclose()
+                for stub in stubs:
+                    await stub.stop()
+
+        with self.assertLogs('utils.backend_pool', 'WARNING'):
+            health, replies, stats = asyncio.run(run())
+
+        self.assertEqual(list(health.values()), [True, True, False])
+        self.assertEqual(stubs[0].requests + stubs[1].requests, len(replies))
+        self.assertGreater(min(stubs[0].requests, stubs[1].requests), 0)
+        self.assertTrue(all(stub.peak_in_flight <= 2 for stub in stubs))
+        self.assertEqual([stat["ejected"] for stat in stats], [False, False, True])
+
+    def test_parse_keep_alive(self):
+        self.assertEqual(parse_keep_alive('30m'), 1800)
+        self.assertEqual(parse_keep_alive('500ms'), 0.5)
+        self.assertEqual(parse_keep_alive(-1), -1)
+        with self.assertRaises(ValueError):
+            parse_keep_alive('soon')
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            StubOllama(jitter=2)
+        with self.assertRaises(ValueError):
+            StubOllama(parallel=0)
+
+
+class TestRunBenchmark(unittest.TestCase):
+
+    def test_percentile(self):
+        self.assertEqual(percentile([3, 1, 2, 4], 50), 2.5)
+        self.assertEqual(percentile([1, 2, 3], 100), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def test_corpus_is_reproducible(self):
+        self.assertEqual(make_corpus(2, 50, seed=1), make_corpus(2, 50, seed=1))
+        self.assertEqual(len(make_corpus(3, 50)[0].split()), 50)
+
+    def test_report(self):
+        """
+        Test a small end-to-end run against the stub.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "report.json")
+            main(["--agents", "guard", "--docs", "2", "--doc-words", "300",
+                  "--chunk-sizes", "500", "--concurrency", "2",
+                  "--token-latency", "0", "--prompt-token-latency", "0.00001",
+                  "--output", path])
+            with open(path, encoding="utf-8") as file:
+                report = json.load(file)
+
+        self.assertEqual(report["server"], "stub")
+        inline, system = report["agents"]
+        self.assertEqual((inline["prompting"], system["prompting"]), ("inline", "system"))
+        self.assertEqual(inline["chunks"], sum(
+            len(chunk_prompt(doc, 500)) for doc in make_corpus(2, 300)))
+        self.assertGreater(inline["docs_per_sec"], 0)
+        self.assertEqual(set(inline["latency_ms"]), {"p50", "p95", "p99", "max"})
+        self.assertEqual(set(inline["chunk_stages_ms"]),
+                         {"queue_wait", "prompt_eval", "eval", "total"})
+        # Only the system prompt stays the same across chunks
+        self.assertEqual(inline["prompt_eval_saved_ms"], 0)
+        self.assertGreater(system["prompt_eval_saved_ms"], 0)
+        self.assertEqual(len(report["chunking"]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
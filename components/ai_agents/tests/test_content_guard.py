@@ -2,15 +2,24 @@
     Unit tests for the ContentGuard class in the content_guard module.
 """
 
+import asyncio
+import io
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
 import sys
 import os
 
+import ollama
+
 # Adjust the sys.path to include the path where content_guard.py is located
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from content_guard import ContentGuard
+from utils.backend import OllamaBackend
+from utils.cache import VerdictCache
+from utils.cascade import Cascade
+from utils.near_duplicate import NearDuplicateIndex
+from utils.prefilter import LexicalPrefilter
 
 
 class TestContentGuard(unittest.TestCase):
@@ -48,48 +57,487 @@ class TestContentGuard(unittest.TestCase):
         with self.assertRaises(ValueError):
             ContentGuard(self.task, "")
 
-    @patch('utils.chunk_data.chunk_prompt')
-    @patch('ollama.chat')
-    def test_agent_method(self, mock_ollama_chat, mock_chunk_prompt):
+    @patch('content_guard.iter_chunks')
+    @patch('content_guard.ollama.AsyncClient', autospec=True)
+    def test_agent_method(self, mock_async_client, mock_iter_chunks):
         """
         Test the agent method's functionality.
-        Mocks the Ollama API call and chunk_prompt function.
-        """
-        # Mock chunk_prompt to return a predefined chunk
-        mock_chunk_prompt.return_value = ["This is a chunk of content."]
-        
-        # Mock ollama.chat to return a fake response
-        mock_ollama_chat.return_value = {
-            'message': {
-                'content': "No, no forbidden content found."
+        Mocks the Ollama API call and iter_chunks function.
+        """
+        # Mock iter_chunks to return a predefined chunk
+        mock_iter_chunks.return_value = ["This is a chunk of content."]
+
+        # Mock the async client's chat call to return a fake response
+        mock_chat = mock_async_client.return_value.chat = AsyncMock(
+            return_value={
+                'message': {
+                    'content': "No, no forbidden content found."
+                }
             }
-        }
-        
+        )
+
         guard = ContentGuard(self.task, self.content)
         result = guard.agent()
-        
-        # Ensure chunk_prompt was called correctly
-        mock_chunk_prompt.assert_called_once_with(self.content, chunk_size=1000)
-        
-        # Ensure ollama.chat was called with the expected prompt
-        mock_ollama_chat.assert_called_once_with(
+
+        # Ensure iter_chunks was called correctly
+        mock_iter_chunks.assert_called_once_with(self.content, chunk_size=1000, spans=True)
+
+        # Ensure the chat call was made with the expected prompt
+        mock_chat.assert_called_once_with(
             model='phi3',
             messages=[
                 {'role': 'user', 'content': f"{self.task}\nThis is a chunk of content."}
-            ]
+            ],
+            keep_alive='30m',
         )
-        
+
         # Check that the result is as expected
         self.assertEqual(result, ["No, no forbidden content found."])
 
-    @patch('ollama.chat', side_effect=Exception("API Error"))
-    def test_agent_method_ollama_error(self, mock_ollama_chat):
+    @patch('content_guard.ollama.AsyncClient', autospec=True)
+    def test_sync_calls_leave_no_clients_behind(self, mock_async_client):
+        """
+        Test that each synchronous call closes the client it opened on its
+        own event loop.
+        """
+        mock_async_client.return_value.chat = AsyncMock(
+            return_value={'message': {'content': "No, no forbidden content found."}})
+        backend = OllamaBackend()
+
+        for _ in range(5):
+            ContentGuard(self.task, self.content, backend=backend).agent()
+
+        self.assertEqual(len(backend._clients), 0)
+        self.assertEqual(mock_async_client.return_value.close.await_count, 5)
+
+    @patch('content_guard.ollama.AsyncClient', autospec=True)
+    def test_agent_method_ollama_error(self, mock_async_client):
         """
         Test that the agent method raises an error when the Ollama API fails.
         """
+        mock_async_client.return_value.chat = AsyncMock(
+            side_effect=Exception("API Error"))
         guard = ContentGuard(self.task, self.content)
-        
+
         with self.assertRaises(Exception) as context:
             guard.agent()
-        
+
         self.assertIn("API Error", str(context.exception))
+
+    @patch('content_guard.iter_chunks')
+    def test_agent_async_keeps_chunk_order(self, mock_iter_chunks):
+        """
+        Test that agent_async returns replies in chunk order even when
+        later chunks finish first.
+        """
+        mock_iter_chunks.return_value = ["first", "second", "third"]
+        delays = {"first": 0.03, "second": 0.02, "third": 0.0}
+
+        async def fake_chat(model, messages):
+            chunk = messages[0]['content'].rsplit("\n", 1)[1]
+            await asyncio.sleep(delays[chunk])
+            return {'message': {'content': f"No: {chunk}"}}
+
+        client = MagicMock()
+        client.chat = fake_chat
+        guard = ContentGuard(self.task, self.content, concurrency=3)
+        result = asyncio.run(guard.agent_async(client=client))
+
+        self.assertEqual(result, ["No: first", "No: second", "No: third"])
+
+    def test_streamed_file_content(self):
+        """
+        Test that file content is streamed and chunks are dispatched
+        before the whole file has been read.
+        """
+        consumed = []
+
+        def lazy_chunks(content, chunk_size, spans):
+            self.assertFalse(spans)  # File content is streamed as text
+            for chunk in ["one", "two", "three"]:
+                consumed.append(chunk)
+                yield chunk
+
+        async def fake_chat(model, messages):
+            # With a single slot, only the chunk being sent has been read
+            seen.append(len(consumed))
+            return {'message': {'content': "No, no forbidden content found."}}
+
+        seen = []
+        client = MagicMock()
+        client.chat = fake_chat
+        guard = ContentGuard(self.task, io.StringIO(self.content), concurrency=1)
+        with patch('content_guard.iter_chunks', lazy_chunks):
+            result = asyncio.run(guard.agent_async(client=client))
+
+        self.assertEqual(len(result), 3)
+        self.assertEqual(seen, [1, 2, 3])
+
+    @patch('content_guard.ollama.AsyncClient', autospec=True)
+    def test_cached_chunks_skip_the_model(self, mock_async_client):
+        """
+        Test that a repeated document is answered from the cache.
+        """
+        mock_chat = mock_async_client.return_value.chat = AsyncMock(
+            return_value={'message': {'content': "No, no forbidden content found."}})
+        cache = VerdictCache()
+
+        first = ContentGuard(self.task, self.content, cache=cache).agent()
+        second = ContentGuard(self.task, "This  is a test\ncontent.", cache=cache).agent()
+
+        self.assertEqual(first, second)
+        self.assertEqual(mock_chat.call_count, 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    @patch('content_guard.ollama.AsyncClient', autospec=True)
+    def test_near_duplicate_chunks_reuse_verdicts(self, mock_async_client):
+        """
+        Test that a lightly edited repost reuses the verdict, while another
+        task does not.
+        """
+        mock_chat = mock_async_client.return_value.chat = AsyncMock(
+            return_value={'message': {'content': "No, no forbidden content found."}})
+        index = NearDuplicateIndex()
+        post = ("The library opens a new reading room on Monday, with quiet desks, "
+                "late opening hours and free coffee for every student.")
+        repost = "UPDATE: " + post.replace("Monday,", "Monday;")
+
+        ContentGuard(self.task, post, near_duplicates=index).agent()
+        guard = ContentGuard(self.task, repost, near_duplicates=index)
+        self.assertEqual(guard.agent(), ["No, no forbidden content found."])
+        self.assertEqual(guard.chunk_results[0].tier, 'near_duplicate')
+        self.assertEqual(mock_chat.call_count, 1)
+
+        ContentGuard(self.task + " Be strict.", repost, near_duplicates=index).agent()
+        self.assertEqual(mock_chat.call_count, 2)
+
+    @patch('content_guard.iter_chunks')
+    @patch('content_guard.ollama.AsyncClient', autospec=True)
+    def test_prefilter_tiers(self, mock_async_client, mock_iter_chunks):
+        """
+        Test that the prefilter decides clear-cut chunks and only the rest
+        reach the model, recording the tier of each chunk.
+        """
+        mock_iter_chunks.return_value = [
+            "Where to buy cocaine tonight", "A quiet walk in the park"]
+        mock_chat = mock_async_client.return_value.chat = AsyncMock(
+            return_value={'message': {'content': "No, no forbidden content found."}})
+
+        guard = ContentGuard(self.task, self.content, prefilter=LexicalPrefilter())
+        result = guard.agent()
+
+        self.assertEqual(result, ["Yes: Drug-related content",
+                                  "No, no forbidden content found."])
+        self.assertEqual([r.tier for r in guard.chunk_results], ['prefilter', 'llm'])
+        mock_chat.assert_called_once()
+
+    @patch('content_guard.iter_chunks')
+    def test_fail_fast_stops_at_first_flagged_chunk(self, mock_iter_chunks):
+        """
+        Test that fail_fast cancels outstanding chunks once one is flagged
+        and reports the flagged chunk.
+        """
+        mock_iter_chunks.return_value = [f"chunk {i}" for i in range(20)]
+        started = []
+        cancelled = []
+
+        async def fake_chat(model, messages):
+            chunk = messages[0]['content'].rsplit("\n", 1)[1]
+            started.append(chunk)
+            try:
+                if chunk == "chunk 1":
+                    return {'message': {'content': "Yes: Hate speech"}}
+                await asyncio.sleep(1)
+                return {'message': {'content': "No, no forbidden content found."}}
+            except asyncio.CancelledError:
+                cancelled.append(chunk)
+                raise
+
+        client = MagicMock()
+        client.chat = fake_chat
+        guard = ContentGuard(self.task, self.content, concurrency=4)
+        verdict = asyncio.run(guard.agent_async(client=client, fail_fast=True))
+
+        self.assertTrue(verdict.flagged)
+        self.assertEqual(verdict.chunk_index, 1)
+        self.assertEqual(verdict.response, "Yes: Hate speech")
+        # Chunk 1 is flagged at once, before chunks 2 and 3 get to start, so
+        # only chunks 0 and 1 reached the model; chunk 0, still waiting on
+        # it, was cancelled
+        self.assertEqual(started, ["chunk 0", "chunk 1"])
+        self.assertEqual(cancelled, ["chunk 0"])
+
+    @patch('content_guard.ollama.AsyncClient', autospec=True)
+    def test_fail_fast_clean_document(self, mock_async_client):
+        """
+        Test that fail_fast reports a clean document after every chunk.
+        """
+        mock_async_client.return_value.chat = AsyncMock(
+            return_value={'message': {'content': "No, no forbidden content found."}})
+        verdict = ContentGuard(self.task, self.content).agent(fail_fast=True)
+        self.assertFalse(verdict.flagged)
+        self.assertIsNone(verdict.chunk_index)
+        self.assertEqual(verdict.chunks_analysed, 1)
+
+    @patch('content_guard.ollama.AsyncClient', autospec=True)
+    def test_agent_batch_shares_one_prompt(self, mock_async_client):
+        """
+        Test that short documents are answered from one labelled prompt.
+        """
+        mock_chat = mock_async_client.return_value.chat = AsyncMock(return_value={
+            'message': {'content': "[[1]] No, no forbidden content found.\n"
+                                   "[[2]] Yes: Hate speech"}})
+
+        results = ContentGuard.agent_batch(self.task, ["A tweet.", "Another post."])
+
+        self.assertEqual(results, [["No, no forbidden content found."],
+                                   ["Yes: Hate speech"]])
+        mock_chat.assert_called_once()
+        prompt = mock_chat.call_args.kwargs['messages'][0]['content']
+        self.assertIn("[[1]] A tweet.\n[[2]] Another post.", prompt)
+        self.assertEqual(prompt.count("AI Content Guard"), 1)
+
+    def test_agent_batch_leftovers_respect_concurrency(self):
+        """
+        Test that documents run on their own overlap in flight, while all
+        their requests together stay within concurrency.
+        """
+        in_flight = peak = short_in_flight = short_peak = 0
+
+        async def chat(model, messages, **kwargs):
+            nonlocal in_flight, peak, short_in_flight, short_peak
+            content = messages[-1]['content']
+            if "[[1]]" in content:
+                # The model drops every label of the batch
+                return {'message': {'content': "No, no forbidden content found."}}
+            short = "Short post" in content
+            in_flight += 1
+            short_in_flight += short
+            peak = max(peak, in_flight)
+            short_peak = max(short_peak, short_in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            short_in_flight -= short
+            return {'message': {'content': "No, no forbidden content found."}}
+
+        client = MagicMock()
+        client.chat = chat
+        docs = ["word " * 200] * 2 + [f"Short post {i}." for i in range(4)]
+
+        results = ContentGuard.agent_batch(self.task, docs, client=client,
+                                           max_chars=100, chunk_size=100,
+                                           concurrency=3)
+
+        self.assertEqual([len(replies) for replies in results], [10, 10, 1, 1, 1, 1])
+        self.assertEqual(peak, 3)
+        self.assertGreater(short_peak, 1)
+
+    def test_model_and_options(self):
+        """
+        Test that the configured model and options reach the client, and
+        that token chunking sizes num_ctx to the model by default.
+        """
+        client = MagicMock()
+        client.chat = AsyncMock(return_value={
+            'message': {'content': "No, no forbidden content found."}})
+        guard = ContentGuard(self.task, self.content, chunking='tokens',
+                             model='llama3', options={'num_thread': 4})
+        asyncio.run(guard.agent_async(client=client))
+
+        self.assertEqual(client.chat.call_args.kwargs['model'], 'llama3')
+        self.assertEqual(client.chat.call_args.kwargs['options'],
+                         {'num_thread': 4, 'num_ctx': 8192})
+
+    def test_system_prompting(self):
+        """
+        Test that system prompting sends the task as an unchanging system
+        message and only the chunk as the user message.
+        """
+        client = MagicMock()
+        client.chat = AsyncMock(return_value={
+            'message': {'content': "No, no forbidden content found."}})
+        guard = ContentGuard(self.task, self.content, prompting='system')
+        asyncio.run(guard.agent_async(client=client))
+
+        messages = client.chat.call_args.kwargs['messages']
+        self.assertEqual(messages, [{'role': 'system', 'content': self.task},
+                                    {'role': 'user', 'content': self.content}])
+
+        with self.assertRaises(ValueError):
+            ContentGuard(self.task, self.content, prompting='chat')
+
+    @patch('content_guard.iter_chunks')
+    def test_structured_replies(self, mock_iter_chunks):
+        """
+        Test that structured mode asks for short JSON replies and returns
+        the parsed verdicts.
+        """
+        mock_iter_chunks.return_value = ["Clean.", "Hateful.", "Also clean."]
+        client = MagicMock()
+        client.chat = AsyncMock(side_effect=[
+            {'message': {'content': '{"forbidden": []}'}},
+            {'message': {'content': '{"forbidden": ["Hate speech", "Abusive content"]}'}},
+            {'message': {'content': "No, no forbidden content found."}},
+        ])
+        guard = ContentGuard(self.task, self.content, concurrency=1, structured=True)
+        verdict = asyncio.run(guard.agent_async(client=client))
+
+        self.assertTrue(verdict.flagged)
+        self.assertEqual(verdict.categories, {"Hate speech", "Abusive content"})
+        self.assertEqual([chunk.flagged for chunk in verdict.chunks], [False, True, False])
+        call = client.chat.call_args.kwargs
+        self.assertEqual(call['format'], 'json')
+        self.assertEqual(call['options'], {'num_predict': 96, 'stop': ["\n\n"]})
+        self.assertIn('{"forbidden"', call['messages'][0]['content'])
+
+    def test_flagged_chunks_keep_source_offsets(self):
+        """
+        Test that text content is chunked into spans and the verdicts
+        point back at the flagged region of the source.
+        """
+        content = "A calm  opening line here.\nThen a hateful remark here.\nA calm ending."
+
+        async def fake_chat(model, messages, format=None, **kwargs):
+            hateful = "hateful" in messages[0]['content'].split("\n")[-1]
+            if format == 'json':
+                reply = '{"forbidden": ["Hate speech"]}' if hateful else '{"forbidden": []}'
+            else:
+                reply = "Yes: Hate speech" if hateful else "No, no forbidden content found."
+            return {'message': {'content': reply}}
+
+        client = MagicMock()
+        client.chat = fake_chat
+        guard = ContentGuard(self.task, content, chunk_size=27, structured=True)
+        verdict = asyncio.run(guard.agent_async(client=client))
+
+        self.assertEqual([result.span for result in guard.chunk_results],
+                         [(0, 26), (27, 54), (55, 69)])
+        (start, end), = verdict.flagged_spans()
+        self.assertEqual(content[start:end], "Then a hateful remark here.")
+
+        fail_fast = ContentGuard(self.task, content, chunk_size=27)
+        document = asyncio.run(fail_fast.agent_async(client=client, fail_fast=True))
+        self.assertEqual(document.span, (27, 54))
+
+    def test_partial_results_mark_failed_chunks(self):
+        """
+        Test that with partial, a chunk whose request fails is marked and
+        the verdicts of the other chunks are kept.
+        """
+        content = "A calm  opening line here.\nThen a hateful remark here.\nA calm ending."
+
+        async def fake_chat(model, messages, format=None, **kwargs):
+            chunk = messages[0]['content'].split("\n")[-1]
+            if "ending" in chunk:
+                raise ollama.ResponseError("model not found", 404)
+            if "hateful" in chunk:
+                return {'message': {'content': '{"forbidden": ["Hate speech"]}'}}
+            return {'message': {'content': '{"forbidden": []}'}}
+
+        client = MagicMock()
+        client.chat = fake_chat
+        guard = ContentGuard(self.task, content, chunk_size=27, structured=True)
+        verdict = asyncio.run(guard.agent_async(client=client, partial=True))
+
+        self.assertTrue(verdict.flagged)
+        failure, = verdict.failed
+        self.assertEqual((failure.index, failure.reason, failure.span), (2, 'failed', (55, 69)))
+        self.assertEqual(verdict.to_dict()["failed"], [2])
+
+        with self.assertRaises(ollama.ResponseError):
+            asyncio.run(ContentGuard(self.task, content, chunk_size=27)
+                        .agent_async(client=client))
+
+    @patch('content_guard.iter_chunks')
+    def test_structured_fail_fast(self, mock_iter_chunks):
+        mock_iter_chunks.return_value = ["Hateful.", "Clean."]
+        client = MagicMock()
+        client.chat = AsyncMock(return_value={
+            'message': {'content': '{"forbidden": ["Hate speech"]}'}})
+        guard = ContentGuard(self.task, self.content, concurrency=1, structured=True)
+        verdict = asyncio.run(guard.agent_async(client=client, fail_fast=True))
+
+        self.assertEqual(client.chat.call_count, 1)
+        self.assertEqual(verdict.categories, {"Hate speech"})
+        with self.assertRaises(ValueError):
+            ContentGuard.agent_batch(self.task, ["A tweet."], structured=True)
+
+    @patch('content_guard.iter_chunks')
+    def test_cascade_escalates_flagged_and_unsure_chunks(self, mock_iter_chunks):
+        """
+        Test that confident clean verdicts stay at the fast tier, while
+        flagged and unsure ones go to the larger model.
+        """
+        mock_iter_chunks.return_value = ["Clean.", "Hateful.", "Odd."]
+        fast = {
+            "Clean.": '{"forbidden": [], "confidence": 0.97}',
+            "Hateful.": '{"forbidden": ["Hate speech"], "confidence": 0.99}',
+            "Odd.": '{"forbidden": [], "confidence": 0.3}',
+        }
+
+        async def chat(model, messages, **kwargs):
+            chunk = messages[0]['content'].rsplit("\n", 1)[-1]
+            if model == 'tiny':
+                return {'message': {'content': fast[chunk]}}
+            return {'message': {'content': "Yes: Hate speech" if chunk == "Hateful."
+                                else "No, no forbidden content found."}}
+
+        client = MagicMock()
+        client.chat = AsyncMock(side_effect=chat)
+        guard = ContentGuard(self.task, self.content, concurrency=1, model='large',
+                             cascade=Cascade('tiny'))
+        result = asyncio.run(guard.agent_async(client=client))
+
+        self.assertEqual(result, ["No, no forbidden content found.", "Yes: Hate speech",
+                                  "No, no forbidden content found."])
+        self.assertEqual([r.path for r in guard.chunk_results],
+                         [('tiny',), ('tiny', 'large'), ('tiny', 'large')])
+        self.assertEqual(client.chat.call_count, 5)
+
+        # Without confirmation, a confident flag is kept as it is
+        client.chat.reset_mock()
+        guard = ContentGuard(self.task, self.content, concurrency=1, model='large',
+                             cascade=Cascade('tiny', confirm_flagged=False), structured=True)
+        verdict = asyncio.run(guard.agent_async(client=client))
+        self.assertEqual(verdict.categories, {"Hate speech"})
+        self.assertEqual(client.chat.call_count, 4)
+
+    def test_incremental_sends_only_changed_chunks(self):
+        """
+        Test that re-analysing edited content only sends the chunks whose
+        text changed.
+        """
+        client = MagicMock()
+        client.chat = AsyncMock(return_value={
+            'message': {'content': "No, no forbidden content found."}})
+        words = [f"word{i * 7919 % 1000}" for i in range(2000)]
+        guard = ContentGuard(self.task, " ".join(words), chunking='cdc', chunk_size=500)
+        replies, verdicts = asyncio.run(guard.agent_incremental_async(client=client))
+        self.assertEqual(client.chat.call_count, len(replies))
+
+        client.chat.reset_mock()
+        edited = ContentGuard(self.task, " ".join(words[:1000] + ["edit"] + words[1000:]),
+                              chunking='cdc', chunk_size=500)
+        replies, _ = asyncio.run(edited.agent_incremental_async(verdicts, client=client))
+
+        self.assertLessEqual(client.chat.call_count, 2)
+        self.assertEqual(len(replies), len(edited.chunk_results))
+        self.assertIn('reused', {result.tier for result in edited.chunk_results})
+
+    def test_agent_batch_invalid_document(self):
+        """
+        Test that a non-string document in a batch raises ValueError.
+        """
+        with self.assertRaises(ValueError):
+            ContentGuard.agent_batch(self.task, ["fine", io.StringIO("file")])
+
+    def test_invalid_content_type(self):
+        """
+        Test that initializing with unsupported content raises ValueError.
+        """
+        with self.assertRaises(ValueError):
+            ContentGuard(self.task, 1234)
+
+
+if __name__ == '__main__':
+    unittest.main()
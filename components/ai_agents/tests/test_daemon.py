@@ -0,0 +1,259 @@
+"""
+    Unit tests for the AgentDaemon class in the daemon module.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+# Add the directory containing daemon.py to the system path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from daemon import AgentDaemon
+from utils.resilience import CircuitBreaker
+
+
+class FakeClient:
+    """
+    Answers every chat call, optionally waiting on a gate first.
+    """
+
+    def __init__(self, reply="No, no forbidden content found.", gate=None):
+        self.reply = reply
+        self.gate = gate
+        self.calls = 0
+        self.closed = False
+
+    async def chat(self, model, messages):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        return {'message': {'content': self.reply},
+                'prompt_eval_count': 30, 'eval_count': 5,
+                'prompt_eval_duration': 2_000_000, 'eval_duration': 10_000_000}
+
+    async def aclose(self):
+        self.closed = True
+
+
+async def http_request(socket_path, method, path, body=None, length=None):
+    """
+    Sends one HTTP request over a Unix socket and decodes the reply,
+    returning non-JSON bodies as text. length overrides the
+    Content-Length header.
+    """
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    payload = json.dumps(body).encode() if body is not None else b""
+    length = len(payload) if length is None else length
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+        f"Content-Length: {length}\r\n\r\n".encode() + payload)
+    await writer.drain()
+    raw = await reader.read()
+    writer.close()
+    head, _, data = raw.partition(b"\r\n\r\n")
+    if b"application/json" not in head:
+        return int(head.split()[1]), data.decode()
+    return int(head.split()[1]), json.loads(data)
+
+
+class TestAgentDaemon(unittest.TestCase):
+
+    def test_invalid_queue_size(self):
+        with self.assertRaises(ValueError):
+            AgentDaemon(queue_size=0)
+
+    def test_invalid_prompting(self):
+        with self.assertRaises(ValueError):
+            AgentDaemon(prompting='chat')
+
+    def test_submit_and_wait(self):
+        async def scenario():
+            daemon = AgentDaemon(client=FakeClient(), warm_up=False)
+            await daemon.start()
+            job = daemon.submit("guard", {"content": "Some feed item."})
+            await job.done.wait()
+            await daemon.stop()
+            return job
+
+        job = asyncio.run(scenario())
+        self.assertEqual(job.status, "done")
+        self.assertEqual(job.result, ["No, no forbidden content found."])
+        # The finished job no longer holds the agent or its content
+        self.assertIsNone(job.agent)
+
+    def test_partial_job_past_its_deadline(self):
+        async def scenario():
+            daemon = AgentDaemon(client=FakeClient(gate=asyncio.Event()), warm_up=False,
+                                 breaker=CircuitBreaker())
+            await daemon.start()
+            job = daemon.submit("guard", {"content": "Some feed item.", "partial": True,
+                                          "deadline": 0.05})
+            await job.done.wait()
+            with self.assertRaises(ValueError):
+                daemon.submit("guard", {"content": "Some feed item.", "deadline": -1})
+            await daemon.stop()
+            return job
+
+        job = asyncio.run(scenario())
+        self.assertEqual(job.status, "done")
+        self.assertEqual(job.result[0]["failed"], "timeout")
+
+    def test_warm_up_loads_model(self):
+        async def scenario():
+            client = FakeClient()
+            daemon = AgentDaemon(client=client)
+            await daemon.start()
+            await daemon.stop()
+            return client
+
+        self.assertEqual(asyncio.run(scenario()).calls, 1)
+
+    def test_stop_closes_the_client(self):
+        async def scenario():
+            client = FakeClient()
+            daemon = AgentDaemon(client=client, warm_up=False)
+            await daemon.start()
+            await daemon.stop()
+            return client
+
+        self.assertTrue(asyncio.run(scenario()).closed)
+
+    def test_invalid_job(self):
+        async def scenario():
+            daemon = AgentDaemon(client=FakeClient(), warm_up=False)
+            await daemon.start()
+            try:
+                daemon.submit("tags", {"content": "Backend work."})
+            finally:
+                await daemon.stop()
+
+        with self.assertRaises(ValueError):
+            asyncio.run(scenario())
+
+    def test_http_api_with_backpressure(self):
+        async def scenario(socket_path):
+            gate = asyncio.Event()
+            daemon = AgentDaemon(client=FakeClient("Backend Developer", gate),
+                                 queue_size=1, workers=1, warm_up=False)
+            server = asyncio.ensure_future(daemon.serve(socket_path=socket_path))
+            while not os.path.exists(socket_path):
+                await asyncio.sleep(0.01)
+
+            body = {"content": "APIs and databases.",
+                    "career_list": ["Backend Developer"]}
+            first = await http_request(socket_path, "POST", "/jobs/tags", body)
+            await asyncio.sleep(0.01)  # Let the worker pick the first job up
+            second = await http_request(socket_path, "POST", "/jobs/tags", body)
+            third = await http_request(socket_path, "POST", "/jobs/tags", body)
+
+            gate.set()
+            await daemon.jobs[second[1]["job_id"]].done.wait()
+            status = await http_request(
+                socket_path, "GET", f"/jobs/{second[1]['job_id']}")
+            health = await http_request(socket_path, "GET", "/health")
+            server.cancel()
+            await asyncio.gather(server, return_exceptions=True)
+            return first, second, third, status, health
+
+        with tempfile.TemporaryDirectory() as tmp:
+            first, second, third, status, health = asyncio.run(
+                scenario(os.path.join(tmp, "daemon.sock")))
+
+        self.assertEqual(first[0], 202)
+        self.assertEqual(second[0], 202)
+        self.assertEqual(third[0], 429)
+        self.assertEqual(status[0], 200)
+        self.assertEqual(status[1]["result"], ["Backend Developer"])
+        self.assertEqual(health[1]["workers"], 1)
+
+    def test_identical_jobs_share_model_calls(self):
+        async def scenario():
+            gate = asyncio.Event()
+            client = FakeClient(gate=gate)
+            daemon = AgentDaemon(client=client, workers=3, warm_up=False)
+            await daemon.start()
+            jobs = [daemon.submit("guard", {"content": "Wire copy."}) for _ in range(3)]
+            await asyncio.sleep(0.01)  # Let every worker send its chunk
+            gate.set()
+            for job in jobs:
+                await job.done.wait()
+            await daemon.stop()
+            return client, daemon, jobs
+
+        client, daemon, jobs = asyncio.run(scenario())
+        self.assertEqual(client.calls, 1)
+        self.assertTrue(all(job.result == ["No, no forbidden content found."] for job in jobs))
+        self.assertEqual(daemon.singleflight.stats()["hits"], 2)
+        self.assertEqual(daemon.metrics.summary()["content_guard"]["chunks"],
+                         {"coalesced": 2, "llm": 1})
+
+    def test_malformed_requests_are_rejected(self):
+        async def scenario(socket_path):
+            daemon = AgentDaemon(client=FakeClient(), warm_up=False, max_body=64)
+            server = asyncio.ensure_future(daemon.serve(socket_path=socket_path))
+            while not os.path.exists(socket_path):
+                await asyncio.sleep(0.01)
+
+            body = {"content": "Some feed item."}
+            replies = [
+                await http_request(socket_path, "POST", "/jobs/guard", body, length="ten"),
+                await http_request(socket_path, "POST", "/jobs/guard", body, length=-1),
+                await http_request(socket_path, "POST", "/jobs/guard",
+                                   {"content": "x" * 100}),
+                await http_request(socket_path, "POST", "/jobs/guard",
+                                   {**body, "task": ["not", "text"]}),
+                await http_request(socket_path, "POST", "/jobs/tags",
+                                   {**body, "career_list": "Nurse"}),
+            ]
+            server.cancel()
+            await asyncio.gather(server, return_exceptions=True)
+            return replies
+
+        with tempfile.TemporaryDirectory() as tmp:
+            replies = asyncio.run(scenario(os.path.join(tmp, "daemon.sock")))
+
+        self.assertEqual([status for status, _ in replies], [400, 400, 413, 400, 400])
+        self.assertEqual(replies[3][1]["error"], "Task must be a string.")
+        self.assertEqual(replies[4][1]["error"], "Career list must be a list of strings.")
+
+    def test_invalid_max_body(self):
+        with self.assertRaises(ValueError):
+            AgentDaemon(max_body=0)
+
+    def test_coalescing_can_be_disabled(self):
+        self.assertIsNone(AgentDaemon(coalesce=False).singleflight)
+
+    def test_metrics_endpoint(self):
+        async def scenario(socket_path):
+            daemon = AgentDaemon(client=FakeClient(), warm_up=False)
+            server = asyncio.ensure_future(daemon.serve(socket_path=socket_path))
+            while not os.path.exists(socket_path):
+                await asyncio.sleep(0.01)
+
+            await http_request(socket_path, "POST", "/jobs/guard",
+                               {"content": "Some feed item.", "wait": True})
+            metrics = await http_request(socket_path, "GET", "/metrics")
+            server.cancel()
+            await asyncio.gather(server, return_exceptions=True)
+            return daemon, metrics
+
+        with tempfile.TemporaryDirectory() as tmp:
+            daemon, (status, text) = asyncio.run(
+                scenario(os.path.join(tmp, "daemon.sock")))
+
+        self.assertEqual(status, 200)
+        self.assertIn('ai_agents_documents_total{agent="content_guard"} 1', text)
+        self.assertIn('ai_agents_eval_tokens_total{agent="content_guard"} 5', text)
+        self.assertIn("ai_agents_queue_depth 0", text)
+        summary = daemon.metrics.summary()["content_guard"]
+        self.assertEqual(summary["chunks"], {"llm": 1})
+        self.assertEqual(summary["prompt_tokens"], 30)
+        self.assertAlmostEqual(summary["timings"]["chunk_eval_seconds"]["mean"], 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
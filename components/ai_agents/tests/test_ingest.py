@@ -0,0 +1,145 @@
+"""
+    Unit tests for the FeedIngest class in the ingest module.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+# Add the directory containing ingest.py to the system path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ingest import FeedIngest, iter_feed
+
+
+class FakeClient:
+    """
+    Flags content mentioning a stabbing, and fails once `fail_after` calls
+    have been answered.
+    """
+
+    def __init__(self, fail_after=None, delay=0.0):
+        self.fail_after = fail_after
+        self.delay = delay
+        self.calls = 0
+
+    async def chat(self, model, messages, **kwargs):
+        self.calls += 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            raise ConnectionError("Ollama went away")
+        await asyncio.sleep(self.delay)
+        prompt = messages[-1]['content']
+        if "AI Content Guard" in messages[0]['content']:
+            reply = "Yes: Violent content" if "stabbing" in prompt else \
+                "No, no forbidden content found."
+        else:
+            reply = "Backend Developer"
+        return {'message': {'content': reply}}
+
+
+def write_feed(path, items):
+    with open(path, "w", encoding="utf-8") as file:
+        for item in items:
+            file.write((item if isinstance(item, str) else json.dumps(item)) + "\n")
+
+
+def read_output(path):
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+class TestFeedIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.feed = os.path.join(self.tmp.name, "feed.jsonl")
+        self.output = os.path.join(self.tmp.name, "results.jsonl")
+        self.items = [{"id": f"item-{n}", "content": f"APIs and databases, part {n}."}
+                      for n in range(30)]
+
+    def ingest(self, client, inputs=None, **settings):
+        runner = FeedIngest(inputs or [self.feed], self.output, career_list=["Backend Developer"],
+                            **settings)
+        return asyncio.run(runner.run_async(client))
+
+    def test_every_item_written(self):
+        self.items[3]["content"] = "A stabbing in the park."
+        write_feed(self.feed, self.items)
+        counts = self.ingest(FakeClient(delay=0.001), max_in_flight=4)
+
+        records = {record["id"]: record for record in read_output(self.output)}
+        self.assertEqual(set(records), {item["id"] for item in self.items})
+        self.assertEqual(counts["written"], 30)
+        self.assertTrue(records["item-3"]["flagged"])
+        self.assertIsNone(records["item-3"]["tags"])
+        self.assertEqual(records["item-4"]["tags"], ["Backend Developer"])
+
+    def test_bad_lines_become_error_records(self):
+        write_feed(self.feed, ['{"id": "ok", "content": "APIs."}', "not json", "",
+                               '{"id": "empty", "content": "  "}', '["a list"]'])
+        counts = self.ingest(FakeClient())
+
+        records = read_output(self.output)
+        self.assertEqual(counts, {"written": 4, "errors": 3,
+                                  "total": {"written": 4, "errors": 3}})
+        errors = {record["id"] for record in records if "error" in record}
+        self.assertIn("empty", errors)
+        self.assertIn(f"{self.feed}:33", errors)  # Byte offset of "not json"
+
+    def test_resume_after_failure(self):
+        write_feed(self.feed, self.items)
+        with self.assertRaises(ConnectionError):
+            self.ingest(FakeClient(fail_after=25, delay=0.001), max_in_flight=3,
+                        checkpoint_every=2)
+        partial = read_output(self.output)
+        self.assertLess(len(partial), 30)
+
+        client = FakeClient()
+        counts = self.ingest(client, max_in_flight=3)
+
+        records = read_output(self.output)
+        ids = [record["id"] for record in records]
+        self.assertEqual(sorted(ids), sorted(item["id"] for item in self.items))
+        self.assertEqual(counts["total"]["written"], 30)
+        self.assertLess(client.calls, 60)
+
+    def test_finished_run_is_not_repeated(self):
+        write_feed(self.feed, self.items[:5])
+        self.ingest(FakeClient())
+        client = FakeClient()
+        counts = self.ingest(client)
+
+        self.assertEqual(client.calls, 0)
+        self.assertEqual(counts["written"], 0)
+        self.assertEqual(len(read_output(self.output)), 5)
+
+    def test_checkpoint_for_other_inputs(self):
+        write_feed(self.feed, self.items[:2])
+        self.ingest(FakeClient())
+        other = os.path.join(self.tmp.name, "other.jsonl")
+        write_feed(other, self.items[2:4])
+        with self.assertRaises(ValueError):
+            self.ingest(FakeClient(), inputs=[other])
+
+    def test_iter_feed_resumes_across_files(self):
+        second = os.path.join(self.tmp.name, "second.jsonl")
+        write_feed(self.feed, ['{"n": 1}', '{"n": 2}'])
+        write_feed(second, ['{"n": 3}'])
+
+        lines = list(iter_feed([self.feed, second], start=(0, 9)))
+        self.assertEqual([(position, line) for position, _, line in lines],
+                         [((0, 9), b'{"n": 2}\n'), ((1, 0), b'{"n": 3}\n')])
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            FeedIngest([], self.output)
+        with self.assertRaises(ValueError):
+            FeedIngest([self.feed], self.output, max_in_flight=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+"""
+    Unit tests for the FeedPipeline class in the pipeline module.
+"""
+
+import asyncio
+import io
+import json
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+import ollama
+
+# Add the directory containing pipeline.py to the system path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pipeline import FeedPipeline
+from utils.metrics import InMemoryMetrics
+from utils.verdicts import ChunkFailure, parse_combined_reply
+
+
+class RoutingClient:
+    """
+    Answers each chat call according to the agent that sent it.
+    """
+
+    def __init__(self, guard="No, no forbidden content found.",
+                 tags="Backend Developer", combined=None):
+        self.guard = guard
+        self.tags = tags
+        self.combined = combined
+        self.calls = []
+
+    async def chat(self, model, messages, **kwargs):
+        self.calls.append(kwargs)
+        prompt = messages[0]['content']
+        if kwargs.get('format') == 'json':
+            reply = self.combined
+        elif "AI Content Guard" in prompt:
+            reply = self.guard
+        else:
+            reply = self.tags
+        return {'message': {'content': reply}}
+
+
+class TestFeedPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.content = "Backend APIs and databases. " * 100
+        self.career_list = ["Backend Developer", "Data Scientist"]
+
+    def run_pipeline(self, client, **settings):
+        pipeline = FeedPipeline(self.content, self.career_list, chunk_size=500, **settings)
+        return asyncio.run(pipeline.run_async(client=client))
+
+    def test_stages_share_chunks(self):
+        client = RoutingClient()
+        result = self.run_pipeline(client)
+
+        self.assertGreater(result.chunks, 1)
+        self.assertFalse(result.flagged)
+        self.assertEqual(result.moderation, ["No, no forbidden content found."] * result.chunks)
+        self.assertEqual(result.tags, ["Backend Developer"] * result.chunks)
+        self.assertEqual(result.llm_calls, 2 * result.chunks)
+        self.assertEqual(len(client.calls), 2 * result.chunks)
+        self.assertEqual(len(result.spans), result.chunks)
+        self.assertEqual(result.spans[0][0], 0)
+        self.assertEqual(result.spans[-1][1], len(self.content.rstrip()))
+
+    def test_flagged_items_are_not_tagged(self):
+        client = RoutingClient(guard="Yes: Hate speech")
+        result = self.run_pipeline(client, concurrency=1)
+
+        self.assertTrue(result.flagged)
+        self.assertIsNone(result.tags)
+        self.assertEqual(result.moderation, ["Yes: Hate speech"])
+        self.assertEqual(result.llm_calls, 1)
+
+    def test_flagged_items_tagged_when_asked(self):
+        client = RoutingClient(guard="Yes: Hate speech")
+        result = self.run_pipeline(client, skip_flagged=False)
+
+        self.assertTrue(result.flagged)
+        self.assertEqual(len(result.tags), result.chunks)
+        self.assertEqual(result.llm_calls, 2 * result.chunks)
+
+    def test_combined_call_per_chunk(self):
+        client = RoutingClient(combined=json.dumps(
+            {"forbidden": [], "careers": ["Backend Developer", "Data Scientist"]}))
+        metrics = InMemoryMetrics()
+        result = self.run_pipeline(client, combined=True, metrics=metrics)
+
+        self.assertEqual(result.llm_calls, result.chunks)
+        self.assertEqual(result.moderation, ["No, no forbidden content found."] * result.chunks)
+        self.assertEqual(result.tags, ["Backend Developer, Data Scientist"] * result.chunks)
+        self.assertTrue(all(call['format'] == 'json' for call in client.calls))
+        self.assertEqual(metrics.summary()["pipeline"]["chunks"], {"llm": result.chunks})
+
+    def test_combined_flagged(self):
+        client = RoutingClient(combined=json.dumps(
+            {"forbidden": ["Hate speech", "Violent content"], "careers": []}))
+        result = self.run_pipeline(client, combined=True, concurrency=1)
+
+        self.assertTrue(result.flagged)
+        self.assertEqual(result.moderation, ["Yes: Hate speech, Violent content"])
+        self.assertIsNone(result.tags)
+
+    def test_unreadable_combined_reply_falls_back(self):
+        client = RoutingClient(combined="Sure! Here is the JSON you asked for")
+        result = self.run_pipeline(client, combined=True)
+
+        self.assertEqual(result.moderation, ["No, no forbidden content found."] * result.chunks)
+        self.assertEqual(result.tags, ["Backend Developer"] * result.chunks)
+        self.assertEqual(result.llm_calls, 3 * result.chunks)
+
+    def test_partial_run_marks_failed_chunks(self):
+        class FailingClient(RoutingClient):
+            async def chat(self, model, messages, **kwargs):
+                if "AI Content Guard" in messages[0]['content'] and len(self.calls) == 1:
+                    self.calls.append(kwargs)
+                    raise ollama.ResponseError("model not found", 404)
+                return await super().chat(model, messages, **kwargs)
+
+        result = self.run_pipeline(FailingClient(), concurrency=1, partial=True)
+
+        self.assertFalse(result.flagged)
+        self.assertEqual(result.failed, [1])
+        self.assertIsInstance(result.moderation[1], ChunkFailure)
+        self.assertEqual(result.tags, ["Backend Developer"] * result.chunks)
+        view = json.loads(json.dumps(result.to_dict()))
+        self.assertEqual(view["moderation"][1]["failed"], "failed")
+
+    def test_deadline_covers_the_whole_run(self):
+        class StuckClient(RoutingClient):
+            async def chat(self, model, messages, **kwargs):
+                await asyncio.sleep(5)
+
+        result = self.run_pipeline(StuckClient(), combined=True, deadline=0.05, partial=True)
+        self.assertEqual(result.failed, list(range(result.chunks)))
+        self.assertTrue(all(reply.reason == 'timeout' for reply in result.moderation))
+
+        with self.assertRaises(asyncio.TimeoutError):
+            self.run_pipeline(StuckClient(), deadline=0.05)
+
+    def test_stages_share_one_request_limit(self):
+        class SlowClient(RoutingClient):
+            in_flight = peak = 0
+
+            async def chat(self, model, messages, **kwargs):
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+                await asyncio.sleep(0.01)
+                self.in_flight -= 1
+                return await super().chat(model, messages, **kwargs)
+
+        client = SlowClient()
+        result = self.run_pipeline(client, skip_flagged=False, concurrency=2)
+
+        self.assertEqual(len(result.tags), result.chunks)
+        self.assertEqual(client.peak, 2)
+
+    def test_chunks_are_read_as_stages_take_them(self):
+        def lazy_chunks(content, chunk_size, spans):
+            passes.append([])
+            for chunk in ["one", "two", "three"]:
+                passes[-1].append(chunk)
+                yield chunk
+
+        class Stream(io.StringIO):
+            def seekable(self):
+                return False
+
+        class WatchingClient(RoutingClient):
+            async def chat(self, model, messages, **kwargs):
+                # Chunks read by every pass so far when this one is sent
+                seen.append(sum(map(len, passes)))
+                return await super().chat(model, messages, **kwargs)
+
+        for content, reads in ((io.StringIO("text"), 2), (Stream("text"), 1)):
+            passes, seen = [], []
+            pipeline = FeedPipeline(content, self.career_list, concurrency=1)
+            with patch('pipeline.iter_chunks', lazy_chunks):
+                result = asyncio.run(pipeline.run_async(client=WatchingClient()))
+
+            self.assertEqual(result.chunks, 3)
+            self.assertEqual(result.tags, ["Backend Developer"] * 3)
+            # Moderation only read each chunk as it was sent
+            self.assertEqual(seen[:3], [1, 2, 3])
+            # A seekable file is read again for tagging; other streams once
+            self.assertEqual(len(passes), reads)
+
+    def test_parse_combined_reply(self):
+        self.assertEqual(parse_combined_reply('{"forbidden": [" Hate speech "], "careers": []}'),
+                         (["Hate speech"], []))
+        self.assertIsNone(parse_combined_reply('{"forbidden": []}'))
+        self.assertIsNone(parse_combined_reply('{"forbidden": "none", "careers": []}'))
+        self.assertIsNone(parse_combined_reply('["Hate speech"]'))
+
+    def test_invalid_task(self):
+        with self.assertRaises(ValueError):
+            FeedPipeline(self.content, self.career_list, task=" ")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,15 +2,19 @@
     Unit tests for the TagGenerator class in the tag_generator module.
 """
 
+import asyncio
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
 import sys
 import os
 
 # Add the directory containing tag_generator to the system path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from tag_generator import TagGenerator, ollama
+from tag_generator import MAX_STRUCTURED_NUM_PREDICT, TagGenerator, ollama
+from utils.cascade import Cascade
+from utils.chunk_data import estimate_tokens
+from utils.shortlist import CareerShortlist
 
 
 class TestTagGenerator(unittest.TestCase):
@@ -60,26 +64,171 @@ class TestTagGenerator(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.tag_generator.validate_input(self.task, self.content, [])
 
-    @patch('tag_generator.ollama.chat')
-    def test_agent(self, mock_chat):
-        # Mock the response from ollama.chat
-        mock_response = MagicMock()
-        mock_response['message']['content'] = "Backend Developer, Database Administrator"
-        mock_chat.return_value = mock_response
+    @patch('tag_generator.ollama.AsyncClient', autospec=True)
+    def test_agent(self, mock_async_client):
+        # Mock the response from the async client's chat call
+        mock_async_client.return_value.chat = AsyncMock(return_value={
+            'message': {'content': "Backend Developer, Database Administrator"}
+        })
 
         results = self.tag_generator.agent()
         self.assertIn("Backend Developer", results[0])
         self.assertIn("Database Administrator", results[0])
 
-    @patch('tag_generator.ollama.chat')
-    def test_agent_no_relevant_careers(self, mock_chat):
-        # Mock the response from ollama.chat
-        mock_response = MagicMock()
-        mock_response['message']['content'] = "No relevant careers found."
-        mock_chat.return_value = mock_response
+    @patch('tag_generator.ollama.AsyncClient', autospec=True)
+    def test_agent_no_relevant_careers(self, mock_async_client):
+        # Mock the response from the async client's chat call
+        mock_async_client.return_value.chat = AsyncMock(return_value={
+            'message': {'content': "No relevant careers found."}
+        })
 
         results = self.tag_generator.agent()
         self.assertIn("No relevant careers found.", results[0])
 
+    @patch('tag_generator.ollama.AsyncClient', autospec=True)
+    def test_agent_sends_career_list(self, mock_async_client):
+        # The career list is appended to every chunk prompt
+        mock_chat = mock_async_client.return_value.chat = AsyncMock(return_value={
+            'message': {'content': "Backend Developer"}
+        })
+
+        self.tag_generator.agent()
+        prompt = mock_chat.call_args.kwargs['messages'][0]['content']
+        self.assertTrue(prompt.endswith(", ".join(self.career_list)))
+
+    @patch('tag_generator.ollama.AsyncClient', autospec=True)
+    def test_token_chunking_accounts_for_prompt_overhead(self, mock_async_client):
+        # Token-sized chunks are fewer and fuller than 1000-character ones,
+        # and every prompt still fits the model's context window
+        mock_chat = mock_async_client.return_value.chat = AsyncMock(return_value={
+            'message': {'content': "Backend Developer"}
+        })
+        content = "server-side APIs and databases " * 800
+        generator = TagGenerator(self.task, content, self.career_list,
+                                 chunking='tokens')
+        generator.agent()
+
+        char_chunks = len(list(
+            TagGenerator(self.task, content, self.career_list)._chunks()))
+        self.assertLess(mock_chat.call_count, char_chunks)
+        for call in mock_chat.call_args_list:
+            prompt = call.kwargs['messages'][0]['content']
+            self.assertLessEqual(estimate_tokens(prompt), 4096 - 256)
+
+    def test_shortlist_with_token_chunking(self):
+        # Only the shortlisted titles count against the context window, so
+        # a taxonomy far larger than the window still leaves room for content
+        careers = [f"Senior Specialist in Applied Field Number {n}" for n in range(2000)]
+        shortlist = CareerShortlist(careers, top_k=5)
+        content = "server-side APIs and databases " * 800
+        generator = TagGenerator(self.task, content, careers, shortlist=shortlist,
+                                 chunking='tokens')
+
+        chunks = [str(chunk) for chunk in generator._chunks()]
+        self.assertGreater(len(chunks), 1)
+        longest = generator._prompt_careers()
+        self.assertEqual(len(longest), 5)
+        for chunk in chunks:
+            prompt = generator._messages(chunk, longest)[0]['content']
+            self.assertLessEqual(estimate_tokens(prompt), 4096 - 256)
+
+    @patch('tag_generator.iter_chunks')
+    def test_shortlist_narrows_career_list(self, mock_iter_chunks):
+        # Only the shortlisted titles go into the prompt
+        mock_iter_chunks.return_value = ["APIs and databases"]
+        client = MagicMock()
+        client.chat = AsyncMock(return_value={
+            'message': {'content': "Backend Developer"}
+        })
+        shortlist = MagicMock()
+        shortlist.load = AsyncMock()
+        shortlist.select = AsyncMock(return_value=["Backend Developer"])
+
+        generator = TagGenerator(self.task, self.content, self.career_list,
+                                 shortlist=shortlist)
+        asyncio.run(generator.agent_async(client=client))
+
+        shortlist.load.assert_awaited_once_with(client)
+        shortlist.select.assert_awaited_once_with(client, "APIs and databases")
+        prompt = client.chat.call_args.kwargs['messages'][0]['content']
+        self.assertTrue(prompt.endswith("\nBackend Developer"))
+
+    def test_system_prompting(self):
+        # The task and career list form a system message shared by every chunk
+        client = MagicMock()
+        client.chat = AsyncMock(return_value={
+            'message': {'content': "Backend Developer"}
+        })
+        generator = TagGenerator(self.task, self.content, self.career_list,
+                                 prompting='system')
+        asyncio.run(generator.agent_async(client=client))
+
+        system, user = client.chat.call_args.kwargs['messages']
+        self.assertEqual(system['role'], 'system')
+        self.assertTrue(system['content'].startswith(self.task))
+        self.assertIn("Database Administrator", system['content'])
+        self.assertEqual(user, {'role': 'user', 'content': self.content})
+
+    def test_structured_replies(self):
+        # Titles outside the list are dropped and the document keeps each once
+        client = MagicMock()
+        client.chat = AsyncMock(side_effect=[
+            {'message': {'content': '{"careers": ["Backend Developer", "Astronaut"]}'}},
+            {'message': {'content': '{"careers": ["database administrator", "Backend Developer"]}'}},
+        ])
+        generator = TagGenerator(self.task, self.content, self.career_list,
+                                 concurrency=1, structured=True)
+        with patch('tag_generator.iter_chunks', return_value=["APIs", "SQL"]):
+            tags = asyncio.run(generator.agent_async(client=client))
+
+        self.assertEqual(tags.careers, ("Backend Developer", "Database Administrator"))
+        self.assertEqual(tags.chunks[1].careers, ("Backend Developer", "Database Administrator"))
+        call = client.chat.call_args.kwargs
+        self.assertEqual(call['format'], 'json')
+        self.assertGreaterEqual(call['options']['num_predict'],
+                                estimate_tokens(", ".join(self.career_list)))
+
+    def test_structured_reply_cap_is_bounded(self):
+        careers = [f"Senior Specialist in Applied Field Number {n}" for n in range(2000)]
+        generator = TagGenerator(self.task, self.content, careers, structured=True)
+        self.assertEqual(generator.options['num_predict'], MAX_STRUCTURED_NUM_PREDICT)
+
+        shortlisted = TagGenerator(self.task, self.content, careers, structured=True,
+                                   shortlist=CareerShortlist(careers, top_k=3))
+        self.assertEqual(shortlisted.options['num_predict'], 8 + sum(
+            estimate_tokens(f'"{career}", ') for career in shortlisted._prompt_careers()))
+        self.assertLess(shortlisted.options['num_predict'], MAX_STRUCTURED_NUM_PREDICT)
+
+    def test_cascade_escalates_titles_off_the_list(self):
+        async def chat(model, messages, **kwargs):
+            if model == 'tiny':
+                chunk = messages[0]['content']
+                careers = ["Astronaut"] if "rockets" in chunk else ["backend developer"]
+                return {'message': {'content': f'{{"careers": {careers}, "confidence": 0.9}}'
+                                    .replace("'", '"')}}
+            return {'message': {'content': "Data Scientist"}}
+
+        client = MagicMock()
+        client.chat = AsyncMock(side_effect=chat)
+        generator = TagGenerator(self.task, self.content, self.career_list,
+                                 concurrency=1, cascade=Cascade('tiny'))
+        with patch('tag_generator.iter_chunks', return_value=["APIs", "rockets"]):
+            tags = asyncio.run(generator.agent_async(client=client))
+
+        self.assertEqual(tags, ["Backend Developer", "Data Scientist"])
+        self.assertEqual([r.path for r in generator.chunk_results],
+                         [('tiny',), ('tiny', 'phi3')])
+        self.assertIn('"careers"', client.chat.call_args_list[0].kwargs['messages'][0]['content'])
+        with self.assertRaises(ValueError):
+            TagGenerator.agent_batch(self.task, ["A tweet."], self.career_list,
+                                     cascade=Cascade('tiny'))
+
+    def test_invalid_chunking(self):
+        with self.assertRaises(ValueError):
+            TagGenerator(self.task, self.content, self.career_list, chunking='lines')
+        with self.assertRaises(ValueError):
+            TagGenerator(self.task, self.content, self.career_list, prompting='chat')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,202 @@
+"""
+A module that provides a shared, pooled Ollama client for the agents.
+"""
+
+import asyncio
+import inspect
+import weakref
+from typing import Any, Awaitable, Dict, Mapping, Optional, Sequence
+
+import httpx
+import ollama
+
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_KEEP_ALIVE = '30m'
+DEFAULT_MAX_CONNECTIONS = 16
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+
+
+class OllamaBackend:
+    """
+    Shared connection to one Ollama server.
+
+    The backend owns a pooled ollama.AsyncClient per event loop, asks the
+    server to keep models loaded between bursts and applies default model
+    options, which each call can override. It exposes the same chat and
+    embed coroutines as ollama.AsyncClient, so it can be passed anywhere
+    a client is expected.
+
+    Attributes:
+        host (str): The Ollama server URL, or None for the default.
+        timeout (float): The request timeout, in seconds.
+        keep_alive (str): How long the server keeps a model loaded after
+        a request, e.g. '30m', or -1 to keep it loaded indefinitely.
+        options (dict): Default model options, such as num_ctx,
+        num_predict or num_thread.
+        max_connections (int): The connection pool size.
+
+    Methods:
+        chat(model, messages, **kwargs): Sends a chat request.
+        embed(model, input, **kwargs): Sends an embedding request.
+        ps(): Lists the loaded models, which doubles as a health check.
+        aclose(): Closes the client of the running event loop.
+    """
+
+    def __init__(self, host: Optional[str] = None, timeout=DEFAULT_TIMEOUT,
+                 keep_alive=DEFAULT_KEEP_ALIVE, options: Optional[Mapping] = None,
+                 max_connections=DEFAULT_MAX_CONNECTIONS,
+                 keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY):
+        """
+        Initializes the backend. No connection is made until the first call.
+
+        Args:
+            host (str, optional): The Ollama server URL. Defaults to the
+            OLLAMA_HOST environment variable or the local server.
+            timeout (float, optional): The request timeout, in seconds.
+            keep_alive (str or float, optional): How long the server keeps
+            a model loaded after a request. Defaults to DEFAULT_KEEP_ALIVE.
+            options (dict, optional): Default model options.
+            max_connections (int, optional): The connection pool size.
+            keepalive_expiry (float, optional): Seconds an idle pooled
+            connection is kept open.
+
+        Raises:
+            ValueError: If the pool size or timeout is not positive.
+        """
+        if not isinstance(max_connections, int) or max_connections <= 0:
+            raise ValueError("Max connections must be a positive integer.")
+        if timeout is not None and timeout <= 0:
+            raise ValueError("Timeout must be positive.")
+
+        self.host = host
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.options = dict(options or {})
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        # httpx clients are bound to the event loop they were created on
+        self._clients = weakref.WeakKeyDictionary()
+
+    @property
+    def client(self) -> Any:
+        """
+        The pooled ollama.AsyncClient of the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        # Forget the clients of loops that were closed without aclose()
+        for closed in [other for other in self._clients if other.is_closed()]:
+            del self._clients[closed]
+        client = self._clients.get(loop)
+        if client is None:
+            client = ollama.AsyncClient(
+                host=self.host,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+            )
+            self._clients[loop] = client
+        return client
+
+    def _merge(self, options: Optional[Mapping], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        merged = {**self.options, **(options or {})}
+        if merged:
+            kwargs['options'] = merged
+        if self.keep_alive is not None:
+            kwargs.setdefault('keep_alive', self.keep_alive)
+        return kwargs
+
+    async def chat(self, model: str, messages: Sequence[Mapping[str, Any]],
+                   options: Optional[Mapping] = None, **kwargs) -> Any:
+        """
+        Sends a chat request with the backend's keep-alive and options.
+
+        Args:
+            model (str): The model to use.
+            messages (Sequence): The chat messages.
+            options (dict, optional): Model options overriding the defaults.
+            **kwargs: Further ollama.AsyncClient.chat arguments.
+
+        Returns:
+            ollama.ChatResponse: The server's reply.
+        """
+        return await self.client.chat(
+            model=model, messages=messages, **self._merge(options, kwargs))
+
+    async def embed(self, model: str, input: Any,
+                    options: Optional[Mapping] = None, **kwargs) -> Any:
+        """
+        Sends an embedding request with the backend's keep-alive and options.
+
+        Args:
+            model (str): The embedding model to use.
+            input (str or Sequence[str]): The text(s) to embed.
+            options (dict, optional): Model options overriding the defaults.
+            **kwargs: Further ollama.AsyncClient.embed arguments.
+
+        Returns:
+            ollama.EmbedResponse: The server's reply.
+        """
+        return await self.client.embed(
+            model=model, input=input, **self._merge(options, kwargs))
+
+    async def ps(self) -> Any:
+        """
+        Lists the models the server has loaded. It is cheap, so it also
+        serves as a health check.
+
+        Returns:
+            ollama.ProcessResponse: The server's reply.
+        """
+        return await self.client.ps()
+
+    async def aclose(self) -> None:
+        """
+        Closes the pooled client of the running event loop.
+        """
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+
+_shared = None
+
+
+def run(main: Awaitable, client: Any) -> Any:
+    """
+    Runs a coroutine in a new event loop, as asyncio.run does, and then
+    closes the connections the client opened on that loop.
+
+    The pooled clients are bound to the loop they were created on, so
+    every synchronous agent call would otherwise leave one behind.
+
+    Parameters:
+    main (Awaitable): The coroutine to run.
+    client: The client the coroutine uses. Clients with an async aclose,
+        such as OllamaBackend and BackendPool, are closed; others are
+        left alone.
+
+    Returns:
+    Any: The coroutine's result.
+    """
+    async def closing():
+        try:
+            return await main
+        finally:
+            aclose = getattr(client, "aclose", None)
+            if inspect.iscoroutinefunction(aclose):
+                await aclose()
+
+    return asyncio.run(closing())
+
+
+def shared_backend() -> OllamaBackend:
+    """
+    Returns the process-wide backend the agents use by default.
+    """
+    global _shared
+    if _shared is None:
+        _shared = OllamaBackend()
+    return _shared
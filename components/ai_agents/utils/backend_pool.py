@@ -0,0 +1,374 @@
+"""
+A module that spreads the agents' requests over several Ollama servers.
+"""
+
+import asyncio
+import logging
+import time
+import weakref
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Union
+
+from utils.backend import OllamaBackend
+from utils.resilience import is_transient
+
+logger = logging.getLogger(__name__)
+
+# Requests each backend is sent at once
+DEFAULT_MAX_IN_FLIGHT = 4
+
+# Consecutive failures after which a backend is ejected
+DEFAULT_FAILURE_THRESHOLD = 3
+
+# Seconds an ejected backend is left out before it is tried again
+DEFAULT_EJECT_SECONDS = 30.0
+
+# Seconds between background health checks, and the time each may take
+DEFAULT_HEALTH_INTERVAL = 10.0
+DEFAULT_HEALTH_TIMEOUT = 2.0
+
+# Weight of the latest request in a backend's average latency
+LATENCY_SMOOTHING = 0.3
+
+# Requests a backend must have served before it can be ejected as slow
+MIN_LATENCY_SAMPLES = 3
+
+
+class _Member:
+    """
+    The routing state of one backend in the pool.
+    """
+
+    __slots__ = ("backend", "limit", "position", "outstanding", "failures",
+                 "ejected_until", "trial", "latency", "samples", "requests", "errors")
+
+    def __init__(self, backend, limit, position):
+        self.backend = backend
+        self.limit = limit
+        self.position = position
+        self.outstanding = 0
+        self.failures = 0  # Consecutive
+        self.ejected_until = None  # Monotonic time, or None while in service
+        self.trial = False  # Half open: back from ejection, one request at a time
+        self.latency = None  # Smoothed seconds per request
+        self.samples = 0
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def host(self):
+        return self.backend.host
+
+    @property
+    def free(self):
+        # A backend on trial takes a single request until one succeeds
+        return self.outstanding < (1 if self.trial else self.limit)
+
+
+class BackendPool:
+    """
+    Routes requests over several Ollama backends.
+
+    Each request goes to the backend with the fewest requests outstanding,
+    among those below their concurrency cap; when all are at their cap,
+    callers wait for a slot. Backends that fail several requests in a row
+    with transient errors, or get slower than slow_seconds on average, are
+    ejected for a while. They then come back half open, taking one request
+    at a time until one succeeds; a failure ejects them again. Errors the
+    server answers with, such as an unknown model, don't count. Optional
+    background health checks eject unreachable backends before a request
+    hits them and confirm ejected ones are back. If every backend is
+    ejected, requests are routed to all of them anyway rather than failing.
+
+    The pool exposes the same chat and embed coroutines as OllamaBackend,
+    so it can be passed anywhere a client is expected.
+
+    Attributes:
+        failure_threshold (int): Consecutive failures that eject a backend.
+        eject_seconds (float): How long an ejected backend is left out.
+        slow_seconds (float): The average request time that ejects a
+        backend, or None to never eject for slowness.
+        health_timeout (float): The time a health check may take.
+
+    Methods:
+        chat(model, messages, **kwargs): Sends a chat request.
+        embed(model, input, **kwargs): Sends an embedding request.
+        check_health(): Checks every backend once.
+        start_health_checks(interval): Checks the backends periodically.
+        stats(): Returns the routing state of every backend.
+        aclose(): Stops the health checks and closes every backend.
+    """
+
+    def __init__(self, backends: Sequence[Union[str, OllamaBackend]],
+                 max_in_flight: Union[int, Sequence[int]] = DEFAULT_MAX_IN_FLIGHT,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 eject_seconds=DEFAULT_EJECT_SECONDS, slow_seconds=None,
+                 health_timeout=DEFAULT_HEALTH_TIMEOUT,
+                 backend_options: Optional[Mapping[str, Any]] = None):
+        """
+        Initializes the pool. No connection is made until the first call.
+
+        Args:
+            backends (Sequence): The backends, or the URLs of the Ollama
+            servers to create them for.
+            max_in_flight (int or Sequence[int], optional): The requests
+            sent to each backend at once, for all backends or one per
+            backend. Defaults to DEFAULT_MAX_IN_FLIGHT.
+            failure_threshold (int, optional): Consecutive failures that
+            eject a backend. Defaults to DEFAULT_FAILURE_THRESHOLD.
+            eject_seconds (float, optional): How long an ejected backend is
+            left out. Defaults to DEFAULT_EJECT_SECONDS.
+            slow_seconds (float, optional): The average request time that
+            ejects a backend. Defaults to None.
+            health_timeout (float, optional): The time a health check may
+            take. Defaults to DEFAULT_HEALTH_TIMEOUT.
+            backend_options (dict, optional): OllamaBackend arguments, such
+            as timeout or keep_alive, for backends given as URLs.
+
+        Raises:
+            ValueError: If there are no backends or a setting is invalid.
+        """
+        if not backends:
+            raise ValueError("The pool needs at least one backend.")
+        if isinstance(max_in_flight, int):
+            max_in_flight = [max_in_flight] * len(backends)
+        if len(max_in_flight) != len(backends):
+            raise ValueError("Give one concurrency cap per backend.")
+        if not all(isinstance(limit, int) and limit > 0 for limit in max_in_flight):
+            raise ValueError("Concurrency caps must be positive integers.")
+        if not isinstance(failure_threshold, int) or failure_threshold <= 0:
+            raise ValueError("Failure threshold must be a positive integer.")
+        if eject_seconds < 0:
+            raise ValueError("Eject seconds cannot be negative.")
+
+        self._members = [
+            _Member(OllamaBackend(backend, **(backend_options or {}))
+                    if isinstance(backend, str) else backend,
+                    limit, position)
+            for position, (backend, limit) in enumerate(zip(backends, max_in_flight))
+        ]
+        self.failure_threshold = failure_threshold
+        self.eject_seconds = eject_seconds
+        self.slow_seconds = slow_seconds
+        self.health_timeout = health_timeout
+        self._turn = 0  # Rotates ties between equally loaded backends
+        # asyncio primitives are bound to the event loop they were used on
+        self._conditions = weakref.WeakKeyDictionary()
+        self._health_task = None
+
+    @property
+    def backends(self) -> List[OllamaBackend]:
+        """
+        The pooled backends, in order.
+        """
+        return [member.backend for member in self._members]
+
+    def _condition(self):
+        loop = asyncio.get_running_loop()
+        condition = self._conditions.get(loop)
+        if condition is None:
+            condition = self._conditions[loop] = asyncio.Condition()
+        return condition
+
+    def _eject(self, member, reason):
+        if member.ejected_until is None:
+            logger.warning("Ejecting Ollama backend %s: %s.", member.host, reason)
+        member.ejected_until = time.monotonic() + self.eject_seconds
+        member.trial = False
+
+    def _reinstate(self, member, trial):
+        logger.info("Reinstating Ollama backend %s%s.", member.host,
+                    " for a trial request" if trial else "")
+        member.ejected_until = None
+        member.latency = None
+        member.samples = 0
+        member.failures = 0
+        member.trial = trial
+
+    def _pick(self):
+        """
+        Returns the least loaded backend with a free slot, or None.
+        """
+        now = time.monotonic()
+        for member in self._members:
+            if member.ejected_until is not None and member.ejected_until <= now:
+                self._reinstate(member, trial=True)
+
+        free = [member for member in self._members if member.free]
+        in_service = [member for member in free if member.ejected_until is None]
+        if in_service or any(member.ejected_until is None for member in self._members):
+            free = in_service
+        if not free:
+            return None
+
+        self._turn += 1
+        count = len(self._members)
+        return min(free, key=lambda member: (
+            member.outstanding, (member.position - self._turn) % count))
+
+    async def _acquire(self):
+        condition = self._condition()
+        async with condition:
+            while True:
+                member = self._pick()
+                if member is not None:
+                    member.outstanding += 1
+                    return member
+                await condition.wait()
+
+    async def _release(self, member):
+        member.outstanding -= 1
+        condition = self._condition()
+        async with condition:
+            condition.notify()
+
+    def _record(self, member, seconds, error):
+        member.requests += 1
+        if error is not None:
+            member.errors += 1
+            if not is_transient(error):
+                # The server answered; the request itself was refused
+                member.failures = 0
+                member.trial = False
+                return
+            member.failures += 1
+            if member.trial:
+                self._eject(member, f"trial request failed ({error!r})")
+            elif member.failures >= self.failure_threshold:
+                self._eject(member, f"{member.failures} failures in a row ({error!r})")
+            return
+
+        if member.trial:
+            logger.info("Ollama backend %s passed its trial request.", member.host)
+            member.trial = False
+        member.failures = 0
+        member.samples += 1
+        member.latency = seconds if member.latency is None else (
+            LATENCY_SMOOTHING * seconds + (1 - LATENCY_SMOOTHING) * member.latency)
+        if (self.slow_seconds is not None and member.samples >= MIN_LATENCY_SAMPLES
+                and member.latency > self.slow_seconds):
+            self._eject(member, f"averaging {member.latency:.2f}s per request")
+
+    async def _call(self, method, *args, **kwargs):
+        member = await self._acquire()
+        started = time.perf_counter()
+        try:
+            response = await getattr(member.backend, method)(*args, **kwargs)
+        except Exception as error:
+            self._record(member, time.perf_counter() - started, error)
+            raise
+        finally:
+            await self._release(member)
+        self._record(member, time.perf_counter() - started, None)
+        return response
+
+    async def chat(self, model: str, messages: Sequence[Mapping[str, Any]], **kwargs) -> Any:
+        """
+        Sends a chat request to the least loaded backend.
+
+        Args:
+            model (str): The model to use.
+            messages (Sequence): The chat messages.
+            **kwargs: Further OllamaBackend.chat arguments.
+
+        Returns:
+            ollama.ChatResponse: The server's reply.
+        """
+        return await self._call('chat', model, messages, **kwargs)
+
+    async def embed(self, model: str, input: Any, **kwargs) -> Any:
+        """
+        Sends an embedding request to the least loaded backend.
+
+        Args:
+            model (str): The embedding model to use.
+            input (str or Sequence[str]): The text(s) to embed.
+            **kwargs: Further OllamaBackend.embed arguments.
+
+        Returns:
+            ollama.EmbedResponse: The server's reply.
+        """
+        return await self._call('embed', model, input, **kwargs)
+
+    async def check_health(self) -> Dict[str, bool]:
+        """
+        Checks every backend once. Unreachable backends are ejected, and
+        ejected backends that answer are reinstated once their ejection
+        has run out.
+
+        Returns:
+            dict: Whether each backend answered, by host.
+        """
+        async def probe(member):
+            try:
+                await asyncio.wait_for(member.backend.ps(), self.health_timeout)
+                return True
+            except Exception as error:
+                logger.debug("Health check of %s failed: %r", member.host, error)
+                return False
+
+        healthy = await asyncio.gather(*(probe(member) for member in self._members))
+        now = time.monotonic()
+        for member, ok in zip(self._members, healthy):
+            if not ok:
+                self._eject(member, "health check failed")
+            elif member.ejected_until is not None and member.ejected_until <= now:
+                self._reinstate(member, trial=False)
+        return {member.host: ok for member, ok in zip(self._members, healthy)}
+
+    def start_health_checks(self, interval=DEFAULT_HEALTH_INTERVAL) -> asyncio.Task:
+        """
+        Checks the backends every interval seconds on the running event
+        loop until aclose is called.
+
+        Args:
+            interval (float, optional): Seconds between checks. Defaults to
+            DEFAULT_HEALTH_INTERVAL.
+
+        Returns:
+            asyncio.Task: The background task.
+
+        Raises:
+            ValueError: If the interval is not positive.
+        """
+        if interval <= 0:
+            raise ValueError("Interval must be positive.")
+
+        async def run():
+            while True:
+                await self.check_health()
+                await asyncio.sleep(interval)
+
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.ensure_future(run())
+        return self._health_task
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        Returns the routing state of every backend.
+
+        Returns:
+            list: For each backend, its host, requests outstanding and cap,
+            requests and errors so far, average latency in seconds, whether
+            it is ejected and whether it is on trial.
+        """
+        return [{
+            "host": member.host,
+            "outstanding": member.outstanding,
+            "max_in_flight": member.limit,
+            "requests": member.requests,
+            "errors": member.errors,
+            "latency": member.latency,
+            "ejected": member.ejected_until is not None,
+            "trial": member.trial,
+        } for member in self._members]
+
+    async def aclose(self) -> None:
+        """
+        Stops the health checks and closes every backend's client.
+        """
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        for member in self._members:
+            await member.backend.aclose()
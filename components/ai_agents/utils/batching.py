@@ -0,0 +1,206 @@
+"""
+A module that packs many short documents into shared prompts and splits
+the model's labelled reply back into per-document answers.
+"""
+
+import asyncio
+import logging
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Sequence
+
+from utils.dispatch import DEFAULT_CONCURRENCY, DEFAULT_MODEL, dispatch_chunks
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_CHARS = 3000
+DEFAULT_MAX_ITEMS = 20
+
+BATCH_INSTRUCTIONS = """
+The content below contains several separate items. Each item starts with
+a marker such as [[1]]. Analyse every item on its own and answer with one
+line per item, starting with the item's marker, for example:
+[[1]] <answer for item 1>
+[[2]] <answer for item 2>
+"""
+
+_LABELLED = re.compile(r"\[\[(\d+)\]\]\s*(.*?)(?=\[\[\d+\]\]|\Z)", re.DOTALL)
+
+
+class _Limited:
+    """
+    Passes requests on to a client, no more at once than a semaphore
+    shared with other callers allows.
+    """
+
+    def __init__(self, client: Any, semaphore: asyncio.Semaphore):
+        self._client = client
+        self._semaphore = semaphore
+
+    async def chat(self, *args, **kwargs):
+        async with self._semaphore:
+            return await self._client.chat(*args, **kwargs)
+
+    async def embed(self, *args, **kwargs):
+        async with self._semaphore:
+            return await self._client.embed(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def pack_documents(
+        docs: Sequence[str],
+        max_chars: int = DEFAULT_BATCH_CHARS,
+        max_items: int = DEFAULT_MAX_ITEMS) -> List[List[int]]:
+    """
+    Greedily groups documents into batches that fit one prompt.
+
+    Parameters:
+    docs (Sequence[str]): The documents to pack.
+    max_chars (int): The maximum size of a formatted batch.
+    max_items (int): The maximum number of documents per batch.
+
+    Returns:
+    List[List[int]]: The indices of the documents in each batch, in order.
+        Documents too large to share a prompt are left out.
+
+    Raises:
+    ValueError: If max_chars or max_items is not a positive integer.
+    """
+    if not isinstance(max_chars, int) or max_chars <= 0:
+        raise ValueError("Max chars must be a positive integer.")
+    if not isinstance(max_items, int) or max_items <= 0:
+        raise ValueError("Max items must be a positive integer.")
+
+    batches: List[List[int]] = []
+    current: List[int] = []
+    size = 0
+
+    for index, doc in enumerate(docs):
+        if len(_item(1, doc)) > max_chars:
+            continue
+        item_size = len(_item(len(current) + 1, doc))
+        if current and (size + item_size > max_chars or len(current) == max_items):
+            batches.append(current)
+            current, size = [], 0
+            item_size = len(_item(1, doc))
+        current.append(index)
+        size += item_size
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _item(label: int, doc: str) -> str:
+    return f"[[{label}]] {' '.join(doc.split())}\n"
+
+
+def format_batch(docs: Sequence[str]) -> str:
+    """
+    Renders documents as one labelled block, numbering them from 1.
+
+    Each document is flattened onto a single line so a marker can only
+    appear at the start of an item.
+    """
+    return "".join(_item(label, doc) for label, doc in enumerate(docs, 1))
+
+
+def parse_batch(response: str, count: int) -> Dict[int, str]:
+    """
+    Splits a labelled reply into per-item answers.
+
+    Parameters:
+    response (str): The model's reply to a formatted batch.
+    count (int): The number of items in the batch.
+
+    Returns:
+    Dict[int, str]: The answer for each label from 1 to count that the
+        reply covered. Missing, empty or out-of-range labels are left out.
+    """
+    answers: Dict[int, str] = {}
+    for label, answer in _LABELLED.findall(response):
+        label, answer = int(label), answer.strip()
+        if 1 <= label <= count and answer and label not in answers:
+            answers[label] = answer
+    return answers
+
+
+async def dispatch_batches(
+        client: Any,
+        docs: Sequence[str],
+        build_messages: Callable[[str], List[Dict[str, str]]],
+        run_single: Callable[[int, Any], Awaitable[List[str]]],
+        model: str = DEFAULT_MODEL,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_chars: int = DEFAULT_BATCH_CHARS,
+        max_items: int = DEFAULT_MAX_ITEMS,
+        cache: Any = None,
+        options: Optional[Mapping[str, Any]] = None,
+        retry: Any = None,
+        breaker: Any = None) -> List[List[str]]:
+    """
+    Analyses many documents with as few model calls as possible.
+
+    Small documents are packed into shared prompts. Documents that are too
+    large to share a prompt, and documents whose answer could not be found
+    in the batch reply, are run on their own through run_single once the
+    batches are done. They run concurrently, but share one limit of
+    concurrency requests in flight.
+
+    Parameters:
+    client: See dispatch.dispatch_chunks.
+    docs (Sequence[str]): The documents to analyse.
+    build_messages (Callable): Builds the chat messages for a formatted
+        batch; the task should include BATCH_INSTRUCTIONS.
+    run_single (Callable): Analyses the document at an index on its own,
+        sending its requests through the given client, and returns its
+        per-chunk replies.
+    model (str): The model to run the batches through.
+    concurrency (int): The maximum number of requests in flight at once.
+    max_chars (int): The maximum size of a formatted batch.
+    max_items (int): The maximum number of documents per batch.
+    cache (VerdictCache, optional): Consulted before each batch request.
+    options (Mapping, optional): Model options sent with each batch request.
+    retry (RetryPolicy, optional): Retries failed batch requests.
+    breaker (CircuitBreaker, optional): Refuses batch requests while the
+        backend keeps failing.
+
+    Returns:
+    List[List[str]]: The replies for each document, in document order; a
+        batched document has a single reply.
+    """
+    batches = pack_documents(docs, max_chars, max_items)
+    results: List[List[str]] = [None] * len(docs)
+
+    replies = await dispatch_chunks(
+        client,
+        (format_batch([docs[i] for i in batch]) for batch in batches),
+        build_messages,
+        model=model,
+        concurrency=concurrency,
+        cache=cache,
+        options=options,
+        retry=retry,
+        breaker=breaker,
+    )
+    for batch, reply in zip(batches, replies):
+        answers = parse_batch(reply.response, len(batch))
+        for label, index in enumerate(batch, 1):
+            if label in answers:
+                results[index] = [answers[label]]
+
+    # Re-queue everything that could not be answered from a shared prompt.
+    # Each document dispatches its own chunks, so the requests of all of
+    # them go through one limit
+    leftovers = [index for index, result in enumerate(results) if result is None]
+    if leftovers:
+        logger.info(f"Running {len(leftovers)} documents individually.")
+        limited = _Limited(client, asyncio.Semaphore(concurrency))
+
+        async def single(index):
+            results[index] = await run_single(index, limited)
+
+        await asyncio.gather(*(single(index) for index in leftovers))
+
+    return results
@@ -0,0 +1,243 @@
+"""
+A module that caches model verdicts by the content they were given.
+"""
+
+import hashlib
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Mapping, Optional
+
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_FLUSH_EVERY = 64
+
+
+def normalize(text: str) -> str:
+    """
+    Collapses runs of whitespace so reflowed copies of a text share a key.
+    """
+    return " ".join(text.split())
+
+
+def make_key(model: str, messages: Iterable[Mapping[str, str]]) -> str:
+    """
+    Builds the cache key for a chat request.
+
+    The key covers the model and every message, so the task preamble and,
+    for TagGenerator, the career list are part of it along with the chunk.
+
+    Parameters:
+    model (str): The model the request is sent to.
+    messages (Iterable[Mapping]): The chat messages of the request.
+
+    Returns:
+    str: A hex SHA-256 digest.
+    """
+    digest = hashlib.sha256(model.encode("utf-8"))
+    for message in messages:
+        digest.update(b"\x00" + message['role'].encode("utf-8"))
+        digest.update(b"\x00" + normalize(message['content']).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class VerdictCache:
+    """
+    Two-tier cache of model replies keyed by make_key.
+
+    The first tier is an in-memory LRU. The optional second tier is a
+    SQLite file that survives restarts and can be shared between
+    processes. Both tiers honour the same TTL. Writes to the file are
+    committed every flush_every changes and on flush or close, and reads
+    only note when an entry was used, so lookups never wait on a commit.
+
+    Attributes:
+        max_entries (int): The maximum number of entries kept in memory.
+        ttl (float): The number of seconds an entry stays valid, or None
+        to keep entries until they are evicted.
+        path (str): The SQLite file of the on-disk tier, or None.
+        max_disk_entries (int): The maximum number of entries kept on disk.
+        flush_every (int): The SQLite writes buffered before a commit.
+        hits (int): Lookups answered from either tier.
+        misses (int): Lookups that found nothing.
+
+    Methods:
+        make_key(model, messages): Builds the key for a chat request.
+        get(key): Returns the cached reply or None.
+        set(key, value): Stores a reply.
+        stats(): Returns the hit/miss counters and sizes.
+        flush(): Commits the buffered SQLite writes.
+        close(): Flushes and closes the on-disk tier.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=None, path=None,
+                 max_disk_entries=None, clock: Callable[[], float] = time.time,
+                 flush_every=DEFAULT_FLUSH_EVERY):
+        """
+        Initializes the cache.
+
+        Args:
+            max_entries (int, optional): The in-memory LRU size.
+            ttl (float, optional): Seconds an entry stays valid. Defaults
+            to None, meaning entries only leave through eviction.
+            path (str, optional): A SQLite file for the on-disk tier.
+            max_disk_entries (int, optional): The on-disk tier size.
+            Defaults to unbounded.
+            clock (Callable, optional): The time source, in seconds.
+            flush_every (int, optional): The SQLite writes buffered before
+            they are committed. Defaults to DEFAULT_FLUSH_EVERY.
+
+        Raises:
+            ValueError: If a size or the TTL is not positive.
+        """
+        if not isinstance(max_entries, int) or max_entries <= 0:
+            raise ValueError("Max entries must be a positive integer.")
+        if ttl is not None and ttl <= 0:
+            raise ValueError("TTL must be positive.")
+        if max_disk_entries is not None and (
+                not isinstance(max_disk_entries, int) or max_disk_entries <= 0):
+            raise ValueError("Max disk entries must be a positive integer.")
+        if not isinstance(flush_every, int) or flush_every <= 0:
+            raise ValueError("Flush interval must be a positive integer.")
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.clock = clock
+        self.flush_every = flush_every
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self._memory = OrderedDict()  # key -> (stored_at, value)
+        self._db = None
+        self._touched = {}  # key -> last use not yet written
+        self._unflushed = 0
+
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "stored_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS verdicts_used_at ON verdicts (used_at)")
+            self._db.commit()
+
+    make_key = staticmethod(make_key)
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached reply for the key, or None on a miss.
+        """
+        now = self.clock()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if not self._expired(entry[0], now):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._memory[key]
+
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT value, stored_at FROM verdicts WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                if not self._expired(row[1], now):
+                    self._touched[key] = now
+                    self._written()
+                    self._remember(key, row[1], row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+                self._touched.pop(key, None)
+                self._db.execute("DELETE FROM verdicts WHERE key = ?", (key,))
+                self._written()
+
+        self.misses += 1
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        """
+        Stores the reply under the key in every tier.
+        """
+        now = self.clock()
+        self._remember(key, now, value)
+
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO verdicts (key, value, stored_at, used_at) "
+                "VALUES (?, ?, ?, ?)", (key, value, now, now))
+            self._touched.pop(key, None)
+            if self.max_disk_entries is not None:
+                # Drop the least recently used rows beyond the size limit
+                self._write_touched()
+                cursor = self._db.execute(
+                    "DELETE FROM verdicts WHERE key IN ("
+                    "SELECT key FROM verdicts ORDER BY used_at DESC "
+                    "LIMIT -1 OFFSET ?)", (self.max_disk_entries,))
+                self.evictions += cursor.rowcount
+            self._written()
+
+    def _written(self, changes=1) -> None:
+        self._unflushed += changes
+        if self._unflushed >= self.flush_every:
+            self.flush()
+
+    def _write_touched(self) -> None:
+        # Records the buffered uses, without committing them
+        if self._touched:
+            self._db.executemany("UPDATE verdicts SET used_at = ? WHERE key = ?",
+                                 [(used_at, key) for key, used_at in self._touched.items()])
+            self._touched.clear()
+
+    def _remember(self, key: str, stored_at: float, value: str) -> None:
+        """
+        Puts an entry in the in-memory tier, evicting the least recently
+        used entries beyond max_entries.
+        """
+        self._memory[key] = (stored_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the hit/miss counters and the size of each tier.
+        """
+        disk_size = 0
+        if self._db is not None:
+            disk_size = self._db.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "memory_size": len(self._memory),
+            "disk_size": disk_size,
+        }
+
+    def flush(self) -> None:
+        """
+        Commits the buffered SQLite writes.
+        """
+        if self._db is None:
+            return
+        self._write_touched()
+        self._db.commit()
+        self._unflushed = 0
+
+    def close(self) -> None:
+        """
+        Flushes and closes the on-disk tier.
+        """
+        if self._db is not None:
+            self.flush()
+            self._db.close()
+            self._db = None
@@ -0,0 +1,150 @@
+"""
+A module that sends chunks to a small model first and only escalates the
+verdicts it is unsure of to the agent's own model.
+"""
+
+import json
+from typing import Any, Callable, List, Optional, Sequence
+
+# A small model that follows the JSON format reliably
+DEFAULT_FAST_MODEL = 'qwen2.5:0.5b'
+
+# Self-reported confidence below which a fast verdict is escalated
+DEFAULT_MIN_CONFIDENCE = 0.8
+
+# Reply length cap of the fast tier
+DEFAULT_FAST_NUM_PREDICT = 64
+
+# Appended to the agents' tasks for the fast tier
+MODERATION_CASCADE_FORMAT = """
+Respond only with a JSON object of the form
+{"forbidden": ["Hate speech"], "confidence": 0.9},
+listing the forbidden content types found, or an empty list if none are,
+and how sure you are of the answer, from 0 to 1.
+"""
+TAGS_CASCADE_FORMAT = """
+Respond only with a JSON object of the form
+{"careers": ["Data Scientist"], "confidence": 0.9},
+listing the relevant career titles, or an empty list if none are, and how
+sure you are of the answer, from 0 to 1.
+"""
+
+
+class CascadeStage:
+    """
+    The fast tier of one agent run, as dispatch_chunks uses it.
+
+    Attributes:
+        model (str): The fast model.
+        options (dict): Model options sent with every fast request.
+        build_messages (Callable): Builds the fast tier's chat messages for
+        a chunk, directly or as an awaitable.
+        accept (Callable): Returns the verdict to keep for a fast reply, or
+        None to escalate the chunk.
+    """
+
+    __slots__ = ("model", "options", "build_messages", "accept")
+
+    def __init__(self, model, options, build_messages, accept):
+        self.model = model
+        self.options = options
+        self.build_messages = build_messages
+        self.accept = accept
+
+
+class Cascade:
+    """
+    Settings of a two-tier model cascade.
+
+    Each chunk goes to the fast model first, asking for a JSON verdict with
+    the model's confidence. The agent keeps that verdict unless it cannot be
+    read, names something the agent did not ask about, or the confidence
+    is below min_confidence; those chunks go on to the agent's model.
+
+    Attributes:
+        model (str): The fast model.
+        min_confidence (float): The confidence a fast verdict needs.
+        options (dict): Model options for the fast tier.
+        confirm_flagged (bool): Whether ContentGuard escalates every chunk
+        the fast model flags, so only the larger model flags content.
+
+    Methods:
+        read(response, field, allowed=None): Reads a fast tier reply.
+        stage(build_messages, accept): Binds the cascade to an agent run.
+    """
+
+    def __init__(self, model=DEFAULT_FAST_MODEL, min_confidence=DEFAULT_MIN_CONFIDENCE,
+                 num_predict=DEFAULT_FAST_NUM_PREDICT, options=None,
+                 confirm_flagged=True):
+        """
+        Initializes the cascade.
+
+        Args:
+            model (str, optional): The fast model. Defaults to
+            DEFAULT_FAST_MODEL.
+            min_confidence (float, optional): The confidence, from 0 to 1,
+            a fast verdict needs to be kept. Defaults to
+            DEFAULT_MIN_CONFIDENCE.
+            num_predict (int, optional): The fast tier's reply length cap.
+            Defaults to DEFAULT_FAST_NUM_PREDICT.
+            options (dict, optional): Further model options for the fast
+            tier. Defaults to None.
+            confirm_flagged (bool, optional): Escalate every chunk the fast
+            model flags. Defaults to True.
+
+        Raises:
+            ValueError: If the model is empty or min_confidence is not
+            between 0 and 1.
+        """
+        if not model:
+            raise ValueError("Fast model cannot be empty.")
+        if not 0 <= min_confidence <= 1:
+            raise ValueError("Min confidence must be between 0 and 1.")
+        self.model = model
+        self.min_confidence = min_confidence
+        self.options = {'num_predict': num_predict, 'temperature': 0, **(options or {})}
+        self.confirm_flagged = confirm_flagged
+
+    def read(self, response: str, field: str,
+             allowed: Optional[Sequence[str]] = None) -> Optional[List[str]]:
+        """
+        Reads a fast tier reply.
+
+        Args:
+            response (str): The reply, such as
+            '{"forbidden": [], "confidence": 0.95}'.
+            field (str): The name of the list in the reply.
+            allowed (Sequence[str], optional): The values the list may hold,
+            compared case-insensitively. Defaults to any.
+
+        Returns:
+            list: The values, spelled as in allowed, or None if the reply
+            cannot be read, holds other values or is not confident enough.
+        """
+        try:
+            reply = json.loads(response)
+        except ValueError:
+            return None
+        if not isinstance(reply, dict):
+            return None
+        values, confidence = reply.get(field), reply.get("confidence")
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            return None
+        if isinstance(confidence, bool) or not isinstance(confidence, (int, float)) \
+                or confidence < self.min_confidence:
+            return None
+
+        values = [value.strip() for value in values if value.strip()]
+        if allowed is None:
+            return values
+        spelling = {value.lower(): value for value in allowed}
+        if not all(value.lower() in spelling for value in values):
+            return None
+        return [spelling[value.lower()] for value in values]
+
+    def stage(self, build_messages: Callable[[str], Any],
+              accept: Callable[[str], Optional[str]]) -> CascadeStage:
+        """
+        Binds the cascade to an agent's fast prompt and reply reader.
+        """
+        return CascadeStage(self.model, dict(self.options), build_messages, accept)
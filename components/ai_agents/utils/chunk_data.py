@@ -2,7 +2,491 @@
 A module that chunks data into a provided max figure.
 """
 
-from typing import List
+import codecs
+import hashlib
+import mmap
+import os
+import re
+import zlib
+from collections import deque
+from itertools import repeat
+from typing import IO, Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+# Number of characters (or bytes) read from a file at a time
+READ_BLOCK_SIZE = 1 << 16
+
+# Characters per chunk in the agents' 'chars' chunking mode
+DEFAULT_CHUNK_SIZE = 1000
+
+# Rough number of characters per token for English text under the BPE
+# tokenizers of the models we run; estimate_tokens rounds up per word
+CHARS_PER_TOKEN = 4
+
+# Context window, in tokens, that each model is run with. Models that are
+# not listed get Ollama's default context size.
+MODEL_CONTEXT_TOKENS = {
+    'phi3': 4096,
+    'llama3': 8192,
+    'llama3.1': 8192,
+    'mistral': 8192,
+}
+DEFAULT_CONTEXT_TOKENS = 2048
+
+# Tokens kept free in the context window for the model's reply
+DEFAULT_OUTPUT_RESERVE = 256
+
+# Words in the rolling hash window of content-defined chunking
+CDC_WINDOW = 8
+
+# Rough characters per word, including the space, used to aim
+# content-defined chunks at half of the chunk size on average
+CDC_WORD_CHARS = 6
+
+Source = Union[str, IO, os.PathLike]
+
+# Buffers that chunks can be kept as offsets into: text, or the bytes of a
+# memory-mapped file
+Buffer = Union[str, bytes, bytearray, memoryview, mmap.mmap]
+
+# A word with its offsets in the source, which are None for streamed sources
+Word = Tuple[str, Optional[int], Optional[int]]
+
+_WORD = re.compile(r'\S+')
+_BYTE_WORD = re.compile(rb'\S+')
+
+
+class Span:
+    """
+    A chunk kept as offsets into the source instead of as a copy of its text.
+
+    Attributes:
+        source (str or bytes-like): The buffer the chunk was taken from.
+        start (int): The offset of the chunk's first character, or byte
+        for bytes-like sources.
+        end (int): The offset just past the chunk's last character or byte.
+        raw (str): The source text of the chunk, whitespace included.
+        text (str): The chunk as sent to the model, its words joined by
+        single spaces as iter_chunks returns them. Both are built on each
+        access, and a Span of an mmap can only be read while it is open.
+    """
+
+    __slots__ = ("source", "start", "end")
+
+    def __init__(self, source: Buffer, start: int, end: int):
+        self.source = source
+        self.start = start
+        self.end = end
+
+    @property
+    def raw(self) -> str:
+        raw = self.source[self.start:self.end]
+        if isinstance(raw, str):
+            return raw
+        return bytes(raw).decode("utf-8", errors="replace")
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.raw.split())
+
+    def __str__(self):
+        return self.text
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"Span(start={self.start!r}, end={self.end!r})"
+
+
+def _iter_block_words(blocks: Iterable[str]) -> Iterator[str]:
+    """
+    Yields the words of a text that arrives in blocks, carrying a word
+    split across two blocks over to the next one.
+    """
+    tail = ""
+    for block in blocks:
+        block = tail + block
+        words = block.split()
+        if words and not block[-1].isspace():
+            tail = words.pop()
+        else:
+            tail = ""
+        yield from words
+    if tail:
+        yield tail
+
+
+def _iter_file_blocks(file: IO) -> Iterator[str]:
+    """
+    Reads a text or binary file object block by block as text.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        block = file.read(READ_BLOCK_SIZE)
+        if not block:
+            break
+        yield decoder.decode(block) if isinstance(block, bytes) else block
+    yield decoder.decode(b"", final=True)
+
+
+def _iter_mmap_blocks(path: os.PathLike) -> Iterator[str]:
+    """
+    Memory-maps the file at path and decodes it block by block.
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            for start in range(0, len(mapped), READ_BLOCK_SIZE):
+                yield decoder.decode(mapped[start:start + READ_BLOCK_SIZE])
+            yield decoder.decode(b"", final=True)
+
+
+def iter_words(source: Source) -> Iterator[str]:
+    """
+    Lazily yields the whitespace-separated words of the source.
+
+    Parameters:
+    source (str, file object or os.PathLike): The text itself, an open
+        text or binary file, or the path of a file to memory-map. Plain
+        strings are always treated as text, so pass paths as pathlib.Path.
+
+    Returns:
+    Iterator[str]: The words of the source, in order.
+
+    Raises:
+    ValueError: If the source is none of the supported types.
+    """
+    if isinstance(source, str):
+        return (match.group() for match in _WORD.finditer(source))
+    if isinstance(source, os.PathLike):
+        return _iter_block_words(_iter_mmap_blocks(source))
+    if hasattr(source, "read"):
+        return _iter_block_words(_iter_file_blocks(source))
+    raise ValueError("Input must be a string, a file object or a path.")
+
+
+def _iter_buffer_words(buffer: Buffer) -> Iterator[Word]:
+    """
+    Yields the words of a buffer with their offsets.
+    """
+    if isinstance(buffer, str):
+        for match in _WORD.finditer(buffer):
+            yield match.group(), match.start(), match.end()
+        return
+    for match in _BYTE_WORD.finditer(buffer):
+        yield match.group().decode("utf-8", errors="replace"), match.start(), match.end()
+
+
+def _words(source, spans: bool) -> Iterator[Word]:
+    """
+    Yields the words of the source as (word, start, end), with offsets
+    only when spans are asked for.
+    """
+    if not spans:
+        return zip(iter_words(source), repeat(None), repeat(None))
+    if not isinstance(source, (str, bytes, bytearray, memoryview, mmap.mmap)):
+        raise ValueError("Spans need a string or a bytes-like buffer, such as an mmap.")
+    return _iter_buffer_words(source)
+
+
+def _emit(source, chunks: Iterator[List[Word]], spans: bool) -> Iterator[Union[str, Span]]:
+    """
+    Turns each chunk's words into its text, or into a Span of the source.
+    """
+    for chunk in chunks:
+        if spans:
+            yield Span(source, chunk[0][1], chunk[-1][2])
+        else:
+            yield " ".join(word for word, _, _ in chunk)
+
+
+def _chunk_words(words: Iterator[Word], chunk_size: int) -> Iterator[List[Word]]:
+    """
+    Greedily packs words into chunks of at most chunk_size characters.
+    """
+    current_chunk: List[Word] = []
+    current_size = 0  # Length of the chunk once joined with single spaces
+
+    for word in words:
+        length = len(word[0])
+        if not current_chunk:
+            current_chunk.append(word)  # Start with the first word
+            current_size = length
+        elif current_size + length + 1 > chunk_size:
+            # If adding the next word exceeds the chunk size, emit the current chunk
+            yield current_chunk
+            current_chunk = [word]  # Start a new chunk with the current word
+            current_size = length
+        else:
+            current_chunk.append(word)  # Add the word to the current chunk
+            current_size += length + 1
+
+    if current_chunk:
+        yield current_chunk
+
+
+def iter_chunks(source: Source, chunk_size: int, spans: bool = False) -> Iterator[str]:
+    """
+    Lazily splits the source into chunks of specified size.
+
+    Only the words of the chunk being built are held in memory, so the
+    first chunk is available before the rest of the source has been read.
+
+    Parameters:
+    source (str, file object or os.PathLike): The text to be chunked, see
+        iter_words. With spans, a string or a bytes-like buffer such as an
+        mmap.
+    chunk_size (int): The maximum size of each chunk.
+    spans (bool): Yield each chunk as a Span of the source rather than as
+        a new string, so the text is only built when a prompt needs it and
+        each chunk keeps its position in the source.
+
+    Returns:
+    Iterator[str]: The text chunks, or their Spans, in order.
+
+    Raises:
+    ValueError: If the source is not a supported type or if the chunk size
+        is not a positive integer.
+    """
+    if not isinstance(chunk_size, int) or chunk_size <= 0:
+        raise ValueError("Chunk size must be a positive integer.")
+
+    return _emit(source, _chunk_words(_words(source, spans), chunk_size), spans)
+
+
+def _cdc_chunk_words(words: Iterator[Word], chunk_size: int,
+                     window: int) -> Iterator[List[Word]]:
+    """
+    Ends chunks where a rolling hash of the last window words hits a
+    boundary value, so boundaries move with the words around them rather
+    than with their distance from the start.
+    """
+    minimum = chunk_size // 4
+    divisor = max(1, (chunk_size // 2 - minimum) // CDC_WORD_CHARS)
+    recent = deque()  # Fingerprints of the words in the hash window
+    rolling = 0
+    chunk: List[Word] = []
+    size = 0
+
+    for word in words:
+        length = len(word[0])
+        if chunk and size + length + 1 > chunk_size:
+            # Forced cut; the next content-defined boundary resynchronises
+            yield chunk
+            chunk, size = [], 0
+        size += length + 1 if chunk else length
+        chunk.append(word)
+
+        # crc32 rather than hash(), which differs between processes
+        fingerprint = zlib.crc32(word[0].encode("utf-8"))
+        recent.append(fingerprint)
+        rolling += fingerprint
+        if len(recent) > window:
+            rolling -= recent.popleft()
+
+        if size >= minimum and rolling % divisor == 0:
+            yield chunk
+            chunk, size = [], 0
+
+    if chunk:
+        yield chunk
+
+
+def iter_cdc_chunks(source: Source, chunk_size: int, window: int = CDC_WINDOW,
+                    spans: bool = False) -> Iterator[str]:
+    """
+    Lazily splits the source into content-defined chunks.
+
+    Chunk boundaries are chosen by a rolling hash over the words, so an
+    edit only moves the boundaries near it and the other chunks come out
+    unchanged. Chunks average about half of chunk_size and are at least a
+    quarter of it, except at the end of the source.
+
+    Parameters:
+    source (str, file object or os.PathLike): The text to be chunked, see
+        iter_chunks.
+    chunk_size (int): The maximum size of each chunk.
+    window (int): The number of words the rolling hash covers.
+    spans (bool): Yield Spans of the source, see iter_chunks.
+
+    Returns:
+    Iterator[str]: The text chunks, or their Spans, in order.
+
+    Raises:
+    ValueError: If the source is not a supported type or if the chunk size
+        or window is not a positive integer.
+    """
+    if not isinstance(chunk_size, int) or chunk_size <= 0:
+        raise ValueError("Chunk size must be a positive integer.")
+    if not isinstance(window, int) or window <= 0:
+        raise ValueError("Window must be a positive integer.")
+
+    return _emit(source, _cdc_chunk_words(_words(source, spans), chunk_size, window), spans)
+
+
+def chunk_hash(chunk: str) -> str:
+    """
+    Returns a stable fingerprint of a chunk's text.
+
+    Parameters:
+    chunk (str): The chunk.
+
+    Returns:
+    str: The hex SHA-256 digest of the chunk.
+    """
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+
+def iter_hashed(chunks: Iterable[str], hashes: List[str]) -> Iterator[str]:
+    """
+    Passes the chunks through, recording the chunk_hash of each.
+
+    Parameters:
+    chunks (Iterable[str]): The chunks, as text or Spans.
+    hashes (List[str]): The list each chunk's hash is appended to, in order.
+
+    Returns:
+    Iterator[str]: The same chunks, in order.
+    """
+    for chunk in chunks:
+        hashes.append(chunk_hash(str(chunk)))
+        yield chunk
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens the model will see for the text.
+
+    Every word counts as at least one token, plus one more for every
+    CHARS_PER_TOKEN characters, which errs on the side of overcounting.
+
+    Parameters:
+    text (str): The text to measure.
+
+    Returns:
+    int: The estimated token count.
+    """
+    return sum(len(word) // CHARS_PER_TOKEN + 1 for word in text.split())
+
+
+def context_tokens(model: str) -> int:
+    """
+    Returns the context window, in tokens, used for the model.
+
+    Parameters:
+    model (str): The model name, optionally with a ':tag' suffix.
+
+    Returns:
+    int: The context window size.
+    """
+    return MODEL_CONTEXT_TOKENS.get(
+        model, MODEL_CONTEXT_TOKENS.get(model.split(':')[0], DEFAULT_CONTEXT_TOKENS))
+
+
+def token_budget(
+        model: str,
+        overhead: str = "",
+        reserve: int = DEFAULT_OUTPUT_RESERVE,
+        count_tokens: Callable[[str], int] = estimate_tokens) -> int:
+    """
+    Works out how many content tokens fit in one prompt for the model.
+
+    Parameters:
+    model (str): The model the prompts are sent to.
+    overhead (str): The fixed part of every prompt, such as the task
+        preamble, measured once and subtracted from the context window.
+    reserve (int): The tokens kept free for the model's reply.
+    count_tokens (Callable): The token counter.
+
+    Returns:
+    int: The number of tokens left for each chunk.
+
+    Raises:
+    ValueError: If the overhead and reserve leave no room for content.
+    """
+    budget = context_tokens(model) - count_tokens(overhead) - reserve
+    if budget <= 0:
+        raise ValueError("Prompt overhead leaves no room for content.")
+    return budget
+
+
+def _token_chunk_words(
+        words: Iterator[Word],
+        max_tokens: int,
+        overlap: int,
+        count_tokens: Callable[[str], int]) -> Iterator[List[Word]]:
+    """
+    Greedily packs words into chunks of at most max_tokens tokens, starting
+    each chunk with up to overlap tokens from the end of the previous one.
+    """
+    chunk = deque()  # (word, tokens) pairs of the chunk being built
+    chunk_tokens = 0
+    new_words = 0  # Words in the chunk that were not carried over
+
+    for word in words:
+        tokens = count_tokens(word[0])
+        if new_words and chunk_tokens + tokens > max_tokens:
+            yield [pair[0] for pair in chunk]
+
+            # Carry the tail of this chunk over as the start of the next one
+            carried = deque()
+            carried_tokens = 0
+            while chunk and carried_tokens + chunk[-1][1] <= overlap:
+                pair = chunk.pop()
+                carried.appendleft(pair)
+                carried_tokens += pair[1]
+            chunk, chunk_tokens, new_words = carried, carried_tokens, 0
+
+            # Drop carried words if they leave no room for the next word
+            while chunk and chunk_tokens + tokens > max_tokens:
+                chunk_tokens -= chunk.popleft()[1]
+
+        chunk.append((word, tokens))
+        chunk_tokens += tokens
+        new_words += 1
+
+    if new_words:
+        yield [pair[0] for pair in chunk]
+
+
+def iter_token_chunks(
+        source: Source,
+        max_tokens: int,
+        overlap: int = 0,
+        count_tokens: Callable[[str], int] = estimate_tokens,
+        spans: bool = False) -> Iterator[str]:
+    """
+    Lazily splits the source into chunks sized in tokens rather than
+    characters.
+
+    Parameters:
+    source (str, file object or os.PathLike): The text to be chunked, see
+        iter_chunks.
+    max_tokens (int): The maximum number of tokens in each chunk, usually
+        from token_budget.
+    overlap (int): The number of tokens from the end of each chunk to repeat
+        at the start of the next one.
+    count_tokens (Callable): The token counter, applied to one word at a time.
+    spans (bool): Yield Spans of the source, see iter_chunks. Overlapping
+        chunks have overlapping Spans.
+
+    Returns:
+    Iterator[str]: The text chunks, or their Spans, in order.
+
+    Raises:
+    ValueError: If the source is not a supported type, if max_tokens is not
+        a positive integer or if overlap is negative or not below max_tokens.
+    """
+    if not isinstance(max_tokens, int) or max_tokens <= 0:
+        raise ValueError("Max tokens must be a positive integer.")
+    if not isinstance(overlap, int) or not 0 <= overlap < max_tokens:
+        raise ValueError("Overlap must be a non-negative integer below max tokens.")
+
+    return _emit(source, _token_chunk_words(_words(source, spans), max_tokens, overlap,
+                                            count_tokens), spans)
+
 
 def chunk_prompt(text: str, chunk_size: int) -> List[str]:
     """
@@ -21,32 +505,5 @@ def chunk_prompt(text: str, chunk_size: int) -> List[str]:
     # Input validation
     if not isinstance(text, str):
         raise ValueError("Input text must be a string.")
-    
-    if not isinstance(chunk_size, int) or chunk_size <= 0:
-        raise ValueError("Chunk size must be a positive integer.")
-
-    # Split the text into words
-    words = text.split()
-    
-    # Initialize an empty list to hold the chunks
-    chunks: List[str] = []  # Specify that chunks is a list of strings
-    
-    # Create a variable to hold the current chunk
-    if not words:
-        return chunks
-
-    current_chunk: str = words[0]  # Start with the first word
-
-    for word in words[1:]:
-        # If adding the next word exceeds the chunk size, save the current chunk
-        if len(current_chunk) + len(word) + 1 > chunk_size:
-            chunks.append(current_chunk)
-            current_chunk = word  # Start a new chunk with the current word
-        else:
-            current_chunk += " " + word  # Add the word to the current chunk
-
-    # Add the last chunk if it's not empty
-    if current_chunk:
-        chunks.append(current_chunk)
 
-    return chunks
\ No newline at end of file
+    return list(iter_chunks(text, chunk_size))
@@ -0,0 +1,425 @@
+"""
+A module that fans chunked prompts out to the Ollama API concurrently.
+"""
+
+import asyncio
+import inspect
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional
+
+import ollama
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = 'phi3'
+DEFAULT_CONCURRENCY = 4
+
+# Statistics Ollama reports with every reply; durations are in nanoseconds
+RESPONSE_COUNTS = ('prompt_eval_count', 'eval_count')
+RESPONSE_DURATIONS = ('prompt_eval_duration', 'eval_duration', 'load_duration',
+                      'total_duration')
+
+
+class ChunkResult:
+    """
+    The outcome of one chunk.
+
+    Attributes:
+        index (int): The position of the chunk in the document.
+        response (str): The verdict for the chunk.
+        tier (str): What decided the verdict: 'llm' for the model,
+        'cache' for the verdict cache, 'prefilter' for the screen,
+        'reused' for a verdict carried over from an earlier run or
+        'coalesced' for a reply shared with an identical request that
+        was already in flight or 'near_duplicate' for the verdict of a
+        nearly identical chunk analysed before. In partial results,
+        'failed' or 'timeout' marks a chunk that got no verdict.
+        queue_wait (float): Seconds the chunk waited for a request slot.
+        prompt_tokens (int): The estimated size of the whole prompt, when
+        dispatch_chunks was given count_tokens.
+        preamble (int): A hash of the messages before the chunk's own, which
+        are the same for every chunk and may come from the server's prompt
+        cache, or None for single-message prompts.
+        preamble_tokens (int): The estimated size of those messages.
+        wall_time (float): Seconds from dispatch to verdict.
+        prompt_eval_count (int): Prompt tokens the model evaluated.
+        eval_count (int): Tokens the model generated.
+        prompt_eval_duration (float): Seconds spent evaluating the prompt.
+        eval_duration (float): Seconds spent generating.
+        load_duration (float): Seconds spent loading the model.
+        total_duration (float): Seconds the server spent on the request.
+        The model statistics are None unless the tier is 'llm', and add
+        up both requests of an escalated chunk.
+        path (tuple): The models the chunk was sent to, in order; empty
+        unless the tier is 'llm' or 'coalesced'.
+        escalated (bool): Whether a cascade's fast verdict was passed on
+        to the larger model, or None when no cascade was used.
+        span (tuple): The (start, end) offsets of the chunk in the source,
+        or None unless the chunk was a Span.
+        error (str): What went wrong, for a chunk that got no verdict; its
+        response is None.
+    """
+
+    __slots__ = ("index", "response", "tier", "queue_wait", "wall_time", "prompt_tokens",
+                 "preamble", "preamble_tokens", "path", "escalated", "span", "error") + RESPONSE_COUNTS + RESPONSE_DURATIONS
+
+    def __init__(self, index, response, tier, queue_wait=0.0, wall_time=0.0):
+        self.index = index
+        self.response = response
+        self.tier = tier
+        self.queue_wait = queue_wait
+        self.wall_time = wall_time
+        self.prompt_tokens = None
+        self.preamble = None
+        self.preamble_tokens = None
+        self.path = ()
+        self.escalated = None
+        self.span = None
+        self.error = None
+        for name in RESPONSE_COUNTS + RESPONSE_DURATIONS:
+            setattr(self, name, None)
+
+    def record_response(self, response):
+        """
+        Adds the token counts and durations of an Ollama reply.
+        """
+        for name in RESPONSE_COUNTS + RESPONSE_DURATIONS:
+            value = _response_stat(response, name)
+            if value is None:
+                continue
+            if name in RESPONSE_DURATIONS:
+                value /= 1e9
+            current = getattr(self, name)
+            setattr(self, name, value if current is None else current + value)
+
+    def __repr__(self):
+        return (f"ChunkResult(index={self.index!r}, response={self.response!r}, "
+                f"tier={self.tier!r})")
+
+
+def failure(index: int, error: BaseException) -> ChunkResult:
+    """
+    Records a chunk that got no verdict.
+    """
+    timed_out = isinstance(error, (asyncio.TimeoutError, TimeoutError))
+    result = ChunkResult(index, None, 'timeout' if timed_out else 'failed')
+    result.error = str(error) or type(error).__name__
+    return result
+
+
+def _response_stat(response, name):
+    # Works for plain dicts as well as ollama.ChatResponse
+    try:
+        return response[name] if name in response else None
+    except TypeError:
+        return None
+
+
+async def dispatch_chunks(
+        client: Any,
+        chunks: Iterable[str],
+        build_messages: Callable[[str], List[Dict[str, str]]],
+        model: str = DEFAULT_MODEL,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        cache: Optional[Any] = None,
+        screen: Optional[Callable[[str], Optional[str]]] = None,
+        stop_when: Optional[Callable[[ChunkResult], bool]] = None,
+        options: Optional[Mapping[str, Any]] = None,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        format: Optional[str] = None,
+        reuse: Optional[Callable[[str], Optional[str]]] = None,
+        singleflight: Optional[Any] = None,
+        cascade: Optional[Any] = None,
+        near_duplicates: Optional[Any] = None,
+        retry: Optional[Any] = None,
+        breaker: Optional[Any] = None,
+        deadline: Optional[float] = None,
+        partial: bool = False,
+        semaphore: Optional[asyncio.Semaphore] = None) -> List[ChunkResult]:
+    """
+    Sends every chunk to the model concurrently and records each outcome.
+
+    Parameters:
+    client: An object exposing an async ``chat(model=..., messages=...)``
+        method, such as ``ollama.AsyncClient`` or ``OllamaBackend``.
+    chunks (Iterable[str]): The chunks to analyse. The iterable is consumed
+        lazily, one chunk per free request slot. Span chunks are turned into
+        text as they are taken, and their offsets kept in the results.
+    build_messages (Callable): Builds the chat messages for a single chunk,
+        either directly or as an awaitable.
+    model (str): The model to run the chunks through.
+    concurrency (int): The maximum number of requests in flight at once.
+    cache (VerdictCache, optional): Consulted before each request and
+        filled with each reply.
+    screen (Callable, optional): Returns a verdict for chunks it can decide
+        without the model, or None to pass the chunk on.
+    stop_when (Callable, optional): Checked against each result as it
+        arrives. Once it returns True no further chunks are dispatched and
+        the requests still in flight are cancelled.
+    options (Mapping, optional): Model options, such as num_ctx or
+        num_predict, sent with every request.
+    count_tokens (Callable, optional): Estimates the tokens of a message.
+        When given, each result records the size of its whole prompt, so
+        it can be compared with the tokens the model actually evaluated.
+    format (str, optional): The reply format to request, such as 'json'.
+    reuse (Callable, optional): Returns the verdict an unchanged chunk got
+        in an earlier run, or None. Consulted before everything else.
+    singleflight (Singleflight, optional): Shares each request with
+        identical ones already in flight, from this call or another one
+        using the same table, instead of sending it again.
+    cascade (CascadeStage, optional): A cheaper first tier. Each chunk goes
+        to the fast model first, and only to `model` when the stage does
+        not accept the fast reply. Cached verdicts are looked up and stored
+        under the `model` request either way.
+    near_duplicates (NearDuplicateScope, optional): Consulted after the
+        cache; a chunk nearly identical to one analysed before gets its
+        verdict. Filled with each reply from the model.
+    retry (RetryPolicy, optional): Retries transient failures with
+        jittered backoff and limits how long each request may take.
+    breaker (CircuitBreaker, optional): Refuses requests while the backend
+        keeps failing.
+    deadline (float, optional): Seconds the whole call may take. Requests
+        still running then are cancelled.
+    partial (bool): Return the chunks that got a verdict along with a
+        'failed' or 'timeout' result for each one that did not, instead of
+        raising. A passed deadline marks every unfinished chunk.
+    semaphore (asyncio.Semaphore, optional): A request limit shared with
+        other calls running at the same time, so their requests together
+        stay within it. Defaults to a new one of size concurrency.
+
+    Returns:
+    List[ChunkResult]: The outcome of each chunk, in chunk order. When
+        stop_when fired, only the chunks that completed are included.
+
+    Raises:
+    ValueError: If the concurrency limit is not a positive integer.
+    ollama.ResponseError: If an error occurs during the Ollama API call.
+    asyncio.TimeoutError: If a request or the deadline ran out of time,
+        unless partial.
+    """
+    if not isinstance(concurrency, int) or concurrency <= 0:
+        raise ValueError("Concurrency must be a positive integer.")
+    if deadline is not None and deadline <= 0:
+        raise ValueError("Deadline must be positive.")
+
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(concurrency)
+    tasks = []
+    spans = []  # The span of each dispatched chunk
+    error = None  # The first exception raised by any chunk
+    stopped = False
+    expired = False
+    loop = asyncio.get_running_loop()
+    expires = loop.time() + deadline if deadline is not None else None
+
+    def expire():
+        nonlocal expired
+        expired = True
+        logger.warning("Deadline of %ss passed; cancelling %d chunks.", deadline,
+                       sum(not task.done() for task in tasks))
+        abort(None)
+
+    def abort(current):
+        # Cancel every other chunk still waiting on the model
+        for task in tasks:
+            if task is not current:
+                task.cancel()
+
+    async def send(index: int, chunk: str, queue_wait: float, span) -> ChunkResult:
+        nonlocal error, stopped
+        started = time.perf_counter()
+        try:
+            result = await decide(index, chunk)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if partial:
+                logger.warning("Chunk %d got no verdict: %r", index, e)
+                result = failure(index, e)
+            else:
+                if isinstance(e, ollama.ResponseError):
+                    logger.error(f"Ollama API error: {e}")
+                else:
+                    logger.error(f"Unexpected error occurred: {e}")
+                if error is None:
+                    error = e
+                abort(asyncio.current_task())
+                raise e
+        result.span = span
+        result.queue_wait = queue_wait
+        result.wall_time = time.perf_counter() - started
+
+        if stop_when is not None and not stopped and result.response is not None \
+                and stop_when(result):
+            stopped = True
+            abort(asyncio.current_task())
+        return result
+
+    async def decide(index: int, chunk: str) -> ChunkResult:
+        if reuse is not None:
+            verdict = reuse(chunk)
+            if verdict is not None:
+                return ChunkResult(index, verdict, 'reused')
+
+        if screen is not None:
+            verdict = screen(chunk)
+            if verdict is not None:
+                return ChunkResult(index, verdict, 'prefilter')
+
+        messages = build_messages(chunk)
+        if inspect.isawaitable(messages):
+            messages = await messages
+        if cache is not None:
+            key = cache.make_key(model, messages)
+            cached = cache.get(key)
+            if cached is not None:
+                return ChunkResult(index, cached, 'cache')
+        signature = None
+        if near_duplicates is not None:
+            # Signed once, off the event loop, and kept for the record below
+            verdict, signature = await near_duplicates.lookup(chunk)
+            if verdict is not None:
+                return ChunkResult(index, verdict, 'near_duplicate')
+
+        async def ask(model, messages, settings):
+            # Sends one request, sharing it with an identical one in flight
+            call = lambda: client.chat(model=model, messages=messages, **settings)
+            request = call
+            if retry is not None:
+                call = lambda: retry.run(request, breaker, expires)
+            elif breaker is not None:
+                call = lambda: breaker.call(request)
+            if singleflight is not None:
+                return await singleflight.do(
+                    singleflight.make_key(model, messages, **settings), call)
+            return await call(), False
+
+        # Per-chunk, so only formatted when debug logging is on
+        logger.debug("Sending chunk %d to Ollama API...", index)
+        result = ChunkResult(index, None, 'coalesced')
+        result.path = []
+        reply = None
+        if cascade is not None:
+            fast_messages = cascade.build_messages(chunk)
+            if inspect.isawaitable(fast_messages):
+                fast_messages = await fast_messages
+            response, shared = await ask(cascade.model, fast_messages,
+                                         {'options': cascade.options, 'format': 'json'})
+            result.path.append(cascade.model)
+            if not shared:
+                result.tier = 'llm'
+                result.record_response(response)
+            reply = cascade.accept(response['message']['content'])
+            result.escalated = reply is None
+            if reply is None:
+                logger.debug("Escalating chunk %d to %s.", index, model)
+
+        if reply is None:
+            settings = {}
+            if options:
+                settings['options'] = options
+            if format:
+                settings['format'] = format
+            response, shared = await ask(model, messages, settings)
+            result.path.append(model)
+            if not shared:
+                # The model statistics belong to the request that was sent
+                result.tier = 'llm'
+                result.record_response(response)
+                if count_tokens is not None:
+                    result.prompt_tokens = sum(count_tokens(m['content']) for m in messages)
+                    if len(messages) > 1:
+                        leading = tuple(m['content'] for m in messages[:-1])
+                        result.preamble = hash(leading)
+                        result.preamble_tokens = sum(map(count_tokens, leading))
+            reply = response['message']['content']
+
+        result.response = reply
+        result.path = tuple(result.path)
+        if cache is not None:
+            cache.set(key, reply)
+        if near_duplicates is not None:
+            near_duplicates.record(signature, reply)
+        return result
+
+    # Pull chunks only as slots free up, so a lazy chunk iterator is read
+    # no further ahead than the requests actually in flight
+    pending = iter(chunks)
+    timer = loop.call_at(expires, expire) if expires is not None else None
+    try:
+        while True:
+            waiting = time.perf_counter()
+            await semaphore.acquire()
+            queue_wait = time.perf_counter() - waiting
+            chunk = None if error is not None or stopped or expired else next(pending, None)
+            if chunk is None:
+                semaphore.release()
+                break
+            span = None
+            if not isinstance(chunk, str):
+                # Build the text now, while a mapped source is still open
+                span, chunk = (chunk.start, chunk.end), chunk.text
+            task = asyncio.ensure_future(send(len(tasks), chunk, queue_wait, span))
+            # Release from a callback so cancelled tasks free their slot too
+            task.add_done_callback(lambda _: semaphore.release())
+            tasks.append(task)
+            spans.append(span)
+
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        if error is not None:
+            raise error
+        if expired and not stopped:
+            if not partial:
+                raise asyncio.TimeoutError(f"Deadline of {deadline}s passed.")
+            timeout = asyncio.TimeoutError("Deadline passed.")
+            results = []
+            for index, outcome in enumerate(outcomes):
+                if not isinstance(outcome, ChunkResult):
+                    outcome = failure(index, timeout)
+                    outcome.span = spans[index]
+                results.append(outcome)
+            # Chunks never sent ran out of time too
+            for chunk in pending:
+                result = failure(len(results), timeout)
+                if not isinstance(chunk, str):
+                    result.span = (chunk.start, chunk.end)
+                results.append(result)
+            return results
+        return [outcome for outcome in outcomes if isinstance(outcome, ChunkResult)]
+    finally:
+        if timer is not None:
+            timer.cancel()
+        # Don't leave requests running if we are cancelled ourselves
+        for task in tasks:
+            task.cancel()
+
+
+async def chat_chunks(
+        client: Any,
+        chunks: Iterable[str],
+        build_messages: Callable[[str], List[Dict[str, str]]],
+        model: str = DEFAULT_MODEL,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        cache: Optional[Any] = None) -> List[str]:
+    """
+    Sends every chunk to the model concurrently and collects the replies.
+
+    Parameters:
+    client: See dispatch_chunks.
+    chunks (Iterable[str]): The chunks to analyse.
+    build_messages (Callable): Builds the chat messages for a single chunk.
+    model (str): The model to run the chunks through.
+    concurrency (int): The maximum number of requests in flight at once.
+    cache (VerdictCache, optional): Consulted before each request.
+
+    Returns:
+    List[str]: The model's reply for each chunk, in chunk order.
+
+    Raises:
+    ValueError: If the concurrency limit is not a positive integer.
+    ollama.ResponseError: If an error occurs during the Ollama API call.
+    """
+    results = await dispatch_chunks(
+        client, chunks, build_messages, model, concurrency, cache)
+    return [result.response for result in results]
@@ -0,0 +1,160 @@
+"""
+A module that sets up non-blocking, JSON-lines logging for the agents.
+
+Records are handed to a queue on the calling thread and written by a
+background thread, so a slow disk never stalls the event loop. Every record
+carries the correlation ID of the document (or daemon job) it belongs to.
+Nothing is configured on import; call configure_logging from an entry point.
+"""
+
+import atexit
+import contextlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+DEFAULT_LOG_DIR = "/var/log/NRL-product-1/Daemon_Server"
+DEFAULT_LOG_FILE = "ai_agents.log"
+DEFAULT_LOG_PATH = os.path.join(DEFAULT_LOG_DIR, DEFAULT_LOG_FILE)
+DEFAULT_LEVEL = "INFO"
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+correlation_id: ContextVar[Optional[str]] = ContextVar("correlation_id", default=None)
+
+_listener = None
+
+
+@contextlib.contextmanager
+def correlation(value: Optional[str] = None) -> Iterator[str]:
+    """
+    Tags every record logged inside the block with a correlation ID.
+
+    Asyncio tasks created inside the block inherit the ID, so all the
+    chunks of one document share it. An ID that is already set is kept,
+    unless a new value is given, so a daemon job's ID is not replaced by
+    the agent it runs.
+
+    Parameters:
+    value (str, optional): The ID to use. Defaults to the current ID, or a
+        new random one.
+
+    Returns:
+    Iterator[str]: The correlation ID in effect inside the block.
+    """
+    value = value or correlation_id.get() or uuid.uuid4().hex
+    token = correlation_id.set(value)
+    try:
+        yield value
+    finally:
+        correlation_id.reset(token)
+
+
+class CorrelationFilter(logging.Filter):
+    """
+    Stamps records with the current correlation ID. It must run on the
+    thread that logs, before the record is queued.
+    """
+
+    def filter(self, record):
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as single-line JSON objects with the timestamp, level,
+    logger, message and correlation ID, plus any `extra` fields.
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "correlation_id": getattr(record, "correlation_id", None),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and name not in entry:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=DEFAULT_LEVEL, path: Optional[str] = None,
+                      json_lines: bool = True,
+                      logger: Optional[logging.Logger] = None) -> logging.handlers.QueueListener:
+    """
+    Routes log records through a queue to a background writer.
+
+    Calling it again replaces the previous configuration.
+
+    Parameters:
+    level (str or int): The minimum level to log. Defaults to INFO.
+    path (str, optional): The file to append to; its directory is created
+        if needed. Defaults to stderr.
+    json_lines (bool): Write JSON lines rather than plain text.
+    logger (logging.Logger, optional): The logger to configure. Defaults to
+        the root logger.
+
+    Returns:
+    logging.handlers.QueueListener: The running background writer.
+
+    Raises:
+    ValueError: If the level is unknown.
+    """
+    global _listener
+
+    if isinstance(level, str):
+        if not isinstance(logging.getLevelName(level.upper()), int):
+            raise ValueError(f"Unknown log level: {level}")
+        level = level.upper()
+    logger = logger or logging.getLogger()
+
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        destination = logging.FileHandler(path, encoding="utf-8")
+    else:
+        destination = logging.StreamHandler(sys.stderr)
+    destination.setFormatter(JsonFormatter() if json_lines else logging.Formatter(
+        '%(asctime)s - %(levelname)s - %(correlation_id)s - %(message)s'))
+
+    stop_logging()
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(CorrelationFilter())
+    logger.addHandler(handler)
+    logger.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, destination)
+    _listener.start()
+    return _listener
+
+
+def stop_logging() -> None:
+    """
+    Flushes the queued records and stops the background writer.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
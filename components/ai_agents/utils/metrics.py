@@ -0,0 +1,343 @@
+"""
+A module that collects per-chunk and per-document performance metrics
+and exports them as a summary or in the Prometheus text format.
+"""
+
+import bisect
+from collections import OrderedDict, defaultdict, deque
+from typing import Any, Dict, Iterable, Mapping, Optional
+
+NAMESPACE = 'ai_agents'
+
+# Histogram bucket bounds, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Number of recent observations kept per timing for the summary percentiles
+DEFAULT_WINDOW = 1024
+
+# ChunkResult timings and the histograms they are recorded in
+CHUNK_TIMINGS = {
+    'wall_time': ('chunk_seconds', "Time from dispatch to verdict per chunk."),
+    'queue_wait': ('chunk_queue_wait_seconds', "Time each chunk waited for a request slot."),
+    'prompt_eval_duration': ('chunk_prompt_eval_seconds', "Time the model spent on each prompt."),
+    'eval_duration': ('chunk_eval_seconds', "Time the model spent generating each reply."),
+}
+
+# ChunkResult token counts and the counters they are added to
+CHUNK_TOKENS = {
+    'prompt_eval_count': ('prompt_tokens_total', "Prompt tokens evaluated by the model."),
+    'eval_count': ('eval_tokens_total', "Tokens generated by the model."),
+}
+
+DOCUMENT_TIMING = ('document_seconds', "Time to analyse each document.")
+
+CASCADE_CHUNKS = ('cascade_chunks_total',
+                  "Chunks sent through a model cascade, by whether they were escalated.")
+
+# Prompt tokens the server did not have to evaluate, e.g. thanks to its
+# prompt cache, and the prompt evaluation time that saved
+PROMPT_REUSE = {
+    'prompt_tokens_reused_total': "Estimated prompt tokens served from the server's prompt cache.",
+    'prompt_eval_seconds_saved_total': "Estimated prompt evaluation time saved by the prompt cache.",
+}
+
+# Preambles whose real token cost is remembered, least recently seen first out
+MAX_PREAMBLES = 1024
+
+
+class MetricsSink:
+    """
+    Receives the agents' metrics. The base class discards them; subclass
+    it to forward metrics elsewhere.
+
+    Methods:
+        record_chunk(agent, result): Records one ChunkResult.
+        record_document(agent, seconds, chunks): Records one document.
+        record_run(agent, results, seconds): Records a document and all of
+        its chunks.
+    """
+
+    def record_chunk(self, agent: str, result: Any) -> None:
+        """
+        Records the outcome of one chunk.
+
+        Args:
+            agent (str): The agent that analysed the chunk.
+            result (ChunkResult): The chunk's outcome and timings.
+        """
+
+    def record_document(self, agent: str, seconds: float, chunks: int) -> None:
+        """
+        Records one analysed document.
+
+        Args:
+            agent (str): The agent that analysed the document.
+            seconds (float): The time the whole document took.
+            chunks (int): The number of chunks analysed.
+        """
+
+    def record_run(self, agent: str, results: Iterable[Any], seconds: float) -> None:
+        """
+        Records a document and every chunk of it.
+        """
+        results = list(results)
+        for result in results:
+            self.record_chunk(agent, result)
+        self.record_document(agent, seconds, len(results))
+
+
+class _Histogram:
+    """
+    Cumulative bucket counts for the exporter, plus a window of recent
+    observations for the summary percentiles.
+    """
+
+    __slots__ = ("buckets", "counts", "total", "count", "recent")
+
+    def __init__(self, buckets, window):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.total += value
+        self.count += 1
+        self.recent.append(value)
+
+    def summary(self):
+        ordered = sorted(self.recent)
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": _quantile(ordered, 0.50),
+            "p95": _quantile(ordered, 0.95),
+            "p99": _quantile(ordered, 0.99),
+        }
+
+
+def _quantile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class InMemoryMetrics(MetricsSink):
+    """
+    Aggregates metrics in process.
+
+    Timings are kept as fixed-bucket histograms, so memory does not grow
+    with traffic, and the last `window` observations of each are kept for
+    the summary percentiles.
+
+    Attributes:
+        buckets (tuple): The histogram bucket bounds, in seconds.
+        window (int): The observations kept per timing for percentiles.
+
+    Methods:
+        summary(): Returns the aggregated metrics per agent.
+        prometheus(gauges=None): Renders the metrics in the Prometheus
+        text exposition format.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=DEFAULT_WINDOW):
+        """
+        Initializes empty metrics.
+
+        Args:
+            buckets (Sequence[float], optional): The histogram bucket bounds,
+            in seconds. Defaults to DEFAULT_BUCKETS.
+            window (int, optional): The observations kept per timing for the
+            summary percentiles. Defaults to DEFAULT_WINDOW.
+
+        Raises:
+            ValueError: If the buckets are empty or the window is not positive.
+        """
+        if not buckets:
+            raise ValueError("Buckets cannot be empty.")
+        if not isinstance(window, int) or window <= 0:
+            raise ValueError("Window must be a positive integer.")
+        self.buckets = tuple(sorted(buckets))
+        self.window = window
+        self._documents = defaultdict(int)
+        self._chunks = defaultdict(int)  # (agent, tier) -> count
+        self._tokens = defaultdict(int)  # (name, agent) -> count
+        self._reuse = defaultdict(float)  # (name, agent) -> total
+        self._scales = OrderedDict()  # preamble -> real tokens per estimated token
+        self._cascade = defaultdict(int)  # (agent, outcome) -> count
+        self._histograms = {}  # (name, agent) -> _Histogram
+
+    def _observe(self, name, agent, value):
+        histogram = self._histograms.get((name, agent))
+        if histogram is None:
+            histogram = self._histograms[(name, agent)] = _Histogram(self.buckets, self.window)
+        histogram.observe(value)
+
+    def record_chunk(self, agent, result):
+        self._chunks[(agent, result.tier)] += 1
+        escalated = getattr(result, 'escalated', None)
+        if escalated is not None:
+            self._cascade[(agent, 'escalated' if escalated else 'fast')] += 1
+        for attribute, (name, _) in CHUNK_TIMINGS.items():
+            value = getattr(result, attribute, None)
+            if value is not None:
+                self._observe(name, agent, value)
+        for attribute, (name, _) in CHUNK_TOKENS.items():
+            value = getattr(result, attribute, None)
+            if value is not None:
+                self._tokens[(name, agent)] += value
+
+        self._record_reuse(agent, result)
+
+    def _record_reuse(self, agent, result):
+        # The token estimate overcounts, so it is calibrated against the real
+        # count of the first request seen with each preamble, which the
+        # server had to evaluate in full. A later request evaluating at least
+        # half the preamble fewer tokens than that predicts had the preamble
+        # served from the prompt cache.
+        preamble = getattr(result, 'preamble', None)
+        estimated = getattr(result, 'prompt_tokens', None)
+        evaluated = getattr(result, 'prompt_eval_count', None)
+        if preamble is None or not estimated or evaluated is None:
+            return
+        scale = self._scales.get(preamble)
+        if scale is None:
+            if len(self._scales) >= MAX_PREAMBLES:
+                self._scales.popitem(last=False)
+            self._scales[preamble] = evaluated / estimated
+            return
+        self._scales.move_to_end(preamble)
+
+        reused = scale * result.preamble_tokens
+        if scale * estimated - evaluated < reused / 2:
+            return
+        self._reuse[('prompt_tokens_reused_total', agent)] += reused
+        duration = getattr(result, 'prompt_eval_duration', None)
+        if evaluated and duration:
+            self._reuse[('prompt_eval_seconds_saved_total', agent)] += \
+                reused * duration / evaluated
+
+    def record_document(self, agent, seconds, chunks):
+        self._documents[agent] += 1
+        self._observe(DOCUMENT_TIMING[0], agent, seconds)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the aggregated metrics.
+
+        Returns:
+            dict: For each agent, the number of documents, chunks per tier,
+            token totals, generation speed, the chunks kept at and escalated
+            from a cascade's fast tier, and the count, mean and p50/p95/p99
+            of every timing, in seconds.
+        """
+        agents = set(self._documents) | {agent for agent, _ in self._chunks}
+        summary = {}
+        for agent in sorted(agents):
+            timings = {
+                name: histogram.summary()
+                for (name, owner), histogram in sorted(self._histograms.items())
+                if owner == agent
+            }
+            eval_tokens = self._tokens.get(('eval_tokens_total', agent), 0)
+            eval_time = self._histograms.get(('chunk_eval_seconds', agent))
+            fast = self._cascade.get((agent, 'fast'), 0)
+            escalated = self._cascade.get((agent, 'escalated'), 0)
+            summary[agent] = {
+                "documents": self._documents.get(agent, 0),
+                "chunks": {tier: count for (owner, tier), count in sorted(self._chunks.items())
+                           if owner == agent},
+                "prompt_tokens": self._tokens.get(('prompt_tokens_total', agent), 0),
+                "eval_tokens": eval_tokens,
+                "prompt_tokens_reused": int(self._reuse.get(('prompt_tokens_reused_total', agent), 0)),
+                "prompt_eval_seconds_saved": self._reuse.get(('prompt_eval_seconds_saved_total', agent), 0.0),
+                "eval_tokens_per_second": (eval_tokens / eval_time.total
+                                           if eval_time and eval_time.total else None),
+                "cascade": {
+                    "fast": fast,
+                    "escalated": escalated,
+                    "escalation_rate": escalated / (fast + escalated),
+                } if fast + escalated else None,
+                "timings": timings,
+            }
+        return summary
+
+    def prometheus(self, gauges: Optional[Mapping[str, float]] = None) -> str:
+        """
+        Renders the metrics in the Prometheus text exposition format.
+
+        Args:
+            gauges (Mapping, optional): Extra gauges to include, by name
+            without the namespace, such as a queue depth.
+
+        Returns:
+            str: The exposition text.
+        """
+        lines = []
+
+        def header(name, help_text, kind):
+            lines.append(f"# HELP {NAMESPACE}_{name} {help_text}")
+            lines.append(f"# TYPE {NAMESPACE}_{name} {kind}")
+
+        header('documents_total', "Documents analysed.", 'counter')
+        for agent, count in sorted(self._documents.items()):
+            lines.append(f"{NAMESPACE}_documents_total{_labels(agent=agent)} {count}")
+
+        header('chunks_total', "Chunks analysed, by the tier that decided them.", 'counter')
+        for (agent, tier), count in sorted(self._chunks.items()):
+            lines.append(f"{NAMESPACE}_chunks_total{_labels(agent=agent, tier=tier)} {count}")
+
+        header(CASCADE_CHUNKS[0], CASCADE_CHUNKS[1], 'counter')
+        for (agent, outcome), count in sorted(self._cascade.items()):
+            lines.append(f"{NAMESPACE}_{CASCADE_CHUNKS[0]}"
+                         f"{_labels(agent=agent, outcome=outcome)} {count}")
+
+        for name, help_text in CHUNK_TOKENS.values():
+            header(name, help_text, 'counter')
+            for (metric, agent), count in sorted(self._tokens.items()):
+                if metric == name:
+                    lines.append(f"{NAMESPACE}_{name}{_labels(agent=agent)} {count}")
+
+        for name, help_text in PROMPT_REUSE.items():
+            header(name, help_text, 'counter')
+            for (metric, agent), total in sorted(self._reuse.items()):
+                if metric == name:
+                    lines.append(f"{NAMESPACE}_{name}{_labels(agent=agent)} {_number(total)}")
+
+        for name, help_text in list(CHUNK_TIMINGS.values()) + [DOCUMENT_TIMING]:
+            header(name, help_text, 'histogram')
+            for (metric, agent), histogram in sorted(self._histograms.items()):
+                if metric == name:
+                    lines.extend(_histogram_lines(f"{NAMESPACE}_{name}", agent, histogram))
+
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {NAMESPACE}_{name} gauge")
+            lines.append(f"{NAMESPACE}_{name} {_number(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _histogram_lines(name, agent, histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        yield f"{name}_bucket{_labels(agent=agent, le=_number(bound))} {cumulative}"
+    yield f"{name}_bucket{_labels(agent=agent, le='+Inf')} {histogram.count}"
+    yield f"{name}_sum{_labels(agent=agent)} {_number(histogram.total)}"
+    yield f"{name}_count{_labels(agent=agent)} {histogram.count}"
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
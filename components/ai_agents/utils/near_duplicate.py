@@ -0,0 +1,467 @@
+"""
+A module that finds chunks nearly identical to ones analysed before, so
+their verdicts can be reused.
+"""
+
+import asyncio
+import random
+import re
+import sqlite3
+import time
+import zlib
+from array import array
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+# Hash functions per signature, and the LSH bands they are split into.
+# With 16 bands of 8 rows, pairs above ~0.7 similarity share a band with
+# high probability and pairs below ~0.5 rarely do.
+DEFAULT_NUM_PERM = 128
+DEFAULT_BANDS = 16
+
+# Estimated Jaccard similarity from which a verdict is reused
+DEFAULT_THRESHOLD = 0.8
+
+# Words per shingle
+DEFAULT_SHINGLE_SIZE = 3
+
+DEFAULT_MAX_ENTRIES = 100_000
+
+# Texts in a batch from which signatures are computed in a process pool
+DEFAULT_POOL_MIN = 256
+
+# SQLite writes buffered before they are committed together
+DEFAULT_FLUSH_EVERY = 64
+
+# Mersenne prime modulus of the hash permutations
+_PRIME = (1 << 61) - 1
+
+_WORD = re.compile(r"\w+")
+
+Signature = Tuple[int, ...]
+
+
+def shingles(text: str, size: int = DEFAULT_SHINGLE_SIZE) -> Set[int]:
+    """
+    Hashes the overlapping word shingles of a text.
+
+    Words are lower-cased and punctuation is dropped, so reflowed or
+    re-punctuated copies share their shingles.
+
+    Parameters:
+    text (str): The text, typically a chunk from chunk_prompt.
+    size (int): The number of words per shingle.
+
+    Returns:
+    Set[int]: The 32-bit hash of every shingle. Texts shorter than size
+        words have a single shingle; empty texts have none.
+    """
+    words = _WORD.findall(text.lower())
+    if not words:
+        return set()
+    return {zlib.crc32(" ".join(words[start:start + size]).encode("utf-8"))
+            for start in range(max(1, len(words) - size + 1))}
+
+
+@lru_cache(maxsize=8)
+def _permutations(num_perm: int, seed: int) -> Tuple[Tuple[int, int], ...]:
+    rng = random.Random(seed)
+    return tuple((rng.randrange(1, _PRIME), rng.randrange(0, _PRIME))
+                 for _ in range(num_perm))
+
+
+def minhash(text: str, num_perm: int = DEFAULT_NUM_PERM,
+            shingle_size: int = DEFAULT_SHINGLE_SIZE, seed: int = 0) -> Optional[Signature]:
+    """
+    Computes the MinHash signature of a text.
+
+    Parameters:
+    text (str): The text to sign.
+    num_perm (int): The number of hash functions.
+    shingle_size (int): The number of words per shingle.
+    seed (int): Picks the hash functions; signatures are only comparable
+        when computed with the same seed.
+
+    Returns:
+    Optional[Tuple[int, ...]]: The signature, or None for a text without
+        words.
+    """
+    hashes = shingles(text, shingle_size)
+    if not hashes:
+        return None
+    return tuple(min((a * value + b) % _PRIME for value in hashes)
+                 for a, b in _permutations(num_perm, seed))
+
+
+def _minhash_args(args):
+    # Top-level, so the process pool can pickle it
+    return minhash(*args)
+
+
+def signatures(texts: Sequence[str], num_perm: int = DEFAULT_NUM_PERM,
+               shingle_size: int = DEFAULT_SHINGLE_SIZE, seed: int = 0,
+               processes: Optional[int] = None,
+               pool_min: int = DEFAULT_POOL_MIN) -> List[Optional[Signature]]:
+    """
+    Computes the MinHash signatures of many texts, in a process pool once
+    there are at least pool_min of them.
+
+    Parameters:
+    texts (Sequence[str]): The texts to sign.
+    num_perm, shingle_size, seed: See minhash.
+    processes (int, optional): The pool size. Defaults to the CPU count.
+    pool_min (int): The batch size from which the pool is used.
+
+    Returns:
+    List[Optional[Tuple[int, ...]]]: The signature of each text, in order.
+    """
+    args = [(text, num_perm, shingle_size, seed) for text in texts]
+    if len(args) < pool_min:
+        return [_minhash_args(arg) for arg in args]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(_minhash_args, args, chunksize=64))
+
+
+def similarity(first: Signature, second: Signature) -> float:
+    """
+    Estimates the Jaccard similarity of two texts from their signatures.
+    """
+    return sum(a == b for a, b in zip(first, second)) / len(first)
+
+
+class NearDuplicateScope:
+    """
+    The index as seen by one agent configuration, as dispatch_chunks uses it.
+
+    Methods:
+        get(text): Returns the verdict of a near-duplicate, or None.
+        add(text, verdict): Records the verdict of a text.
+        lookup(text): Signs the text in a worker thread and looks it up,
+        returning the verdict and the signature.
+        record(signature, verdict): Records a verdict under a signature
+        from lookup.
+    """
+
+    __slots__ = ("index", "namespace")
+
+    def __init__(self, index, namespace):
+        self.index = index
+        self.namespace = namespace
+
+    def get(self, text: str) -> Optional[str]:
+        return self.index.get(self.namespace, text)
+
+    def add(self, text: str, verdict: str) -> None:
+        self.index.add(self.namespace, text, verdict)
+
+    async def lookup(self, text: str) -> Tuple[Optional[str], Optional[Signature]]:
+        # Keep the event loop free while the signature is computed
+        signature = await asyncio.to_thread(self.index.sign, text)
+        return self.index._lookup(self.namespace, signature), signature
+
+    def record(self, signature: Optional[Signature], verdict: str) -> None:
+        self.index._record(self.namespace, signature, verdict)
+
+
+class NearDuplicateIndex:
+    """
+    MinHash index of analysed chunks and their verdicts.
+
+    Signatures are split into LSH bands, so a lookup only compares the
+    entries sharing at least one band with the text instead of the whole
+    index. A verdict is reused when the estimated Jaccard similarity of
+    the two chunks' word shingles reaches the threshold. Entries are kept
+    per namespace, since a verdict only holds for the task, model and
+    career list it was given under.
+
+    The index keeps at most max_entries entries, evicting the least
+    recently used. With a path, entries are also written to a SQLite file
+    and loaded back on start. Writes are committed every flush_every
+    changes and on flush or close.
+
+    Attributes:
+        threshold (float): The similarity from which verdicts are reused.
+        num_perm (int): The hash functions per signature.
+        bands (int): The LSH bands each signature is split into.
+        shingle_size (int): The words per shingle.
+        max_entries (int): The maximum number of entries kept.
+        path (str): The SQLite file, or None.
+        processes (int): The process pool size for batches, or None for
+        the CPU count.
+        pool_min (int): The batch size from which the pool is used.
+        flush_every (int): The SQLite writes buffered before a commit.
+        hits (int): Lookups that found a near-duplicate.
+        misses (int): Lookups that found nothing.
+        evictions (int): Entries evicted to stay within max_entries.
+
+    Methods:
+        sign(text): Computes the signature of a text.
+        get(namespace, text): Returns the verdict of a near-duplicate.
+        get_many(namespace, texts): Looks up many texts at once.
+        add(namespace, text, verdict): Records a verdict.
+        add_many(namespace, texts, verdicts): Records many verdicts.
+        scope(namespace): Binds the index to one agent configuration.
+        stats(): Returns the counters and the size.
+        flush(): Commits the buffered SQLite writes.
+        close(): Flushes and closes the SQLite file.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, num_perm=DEFAULT_NUM_PERM,
+                 bands=DEFAULT_BANDS, shingle_size=DEFAULT_SHINGLE_SIZE,
+                 max_entries=DEFAULT_MAX_ENTRIES, path=None, processes=None,
+                 pool_min=DEFAULT_POOL_MIN, seed=0,
+                 clock: Callable[[], float] = time.time,
+                 flush_every=DEFAULT_FLUSH_EVERY):
+        """
+        Initializes the index, loading the SQLite file if there is one.
+
+        Args:
+            threshold (float, optional): The similarity, from 0 to 1, from
+            which verdicts are reused. Defaults to DEFAULT_THRESHOLD.
+            num_perm (int, optional): The hash functions per signature.
+            Defaults to DEFAULT_NUM_PERM.
+            bands (int, optional): The LSH bands, which must divide
+            num_perm. More bands find less similar candidates. Defaults to
+            DEFAULT_BANDS.
+            shingle_size (int, optional): The words per shingle. Defaults
+            to DEFAULT_SHINGLE_SIZE.
+            max_entries (int, optional): The maximum number of entries.
+            Defaults to DEFAULT_MAX_ENTRIES.
+            path (str, optional): A SQLite file to persist entries to.
+            processes (int, optional): The process pool size for batches.
+            Defaults to the CPU count.
+            pool_min (int, optional): The batch size from which the pool is
+            used. Defaults to DEFAULT_POOL_MIN.
+            seed (int, optional): Picks the hash functions. Entries saved
+            with another seed or num_perm are ignored. Defaults to 0.
+            clock (Callable, optional): The time source, in seconds.
+            flush_every (int, optional): The SQLite writes buffered before
+            they are committed. Defaults to DEFAULT_FLUSH_EVERY.
+
+        Raises:
+            ValueError: If a setting is invalid.
+        """
+        if not 0 < threshold <= 1:
+            raise ValueError("Threshold must be between 0 and 1.")
+        if not isinstance(num_perm, int) or not isinstance(bands, int) \
+                or num_perm <= 0 or bands <= 0 or num_perm % bands:
+            raise ValueError("Bands must be a positive divisor of num_perm.")
+        if not isinstance(shingle_size, int) or shingle_size <= 0:
+            raise ValueError("Shingle size must be a positive integer.")
+        if not isinstance(max_entries, int) or max_entries <= 0:
+            raise ValueError("Max entries must be a positive integer.")
+        if not isinstance(flush_every, int) or flush_every <= 0:
+            raise ValueError("Flush interval must be a positive integer.")
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.max_entries = max_entries
+        self.path = path
+        self.processes = processes
+        self.pool_min = pool_min
+        self.seed = seed
+        self.clock = clock
+        self.flush_every = flush_every
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._rows = num_perm // bands
+        self._entries = OrderedDict()  # id -> (namespace, signature, verdict)
+        self._buckets = defaultdict(set)  # (namespace, band, band hash) -> ids
+        self._next_id = 0
+        self._db = None
+        self._touched = {}  # id -> last use not yet written
+        self._unflushed = 0
+
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS near_duplicates ("
+                "id INTEGER PRIMARY KEY, namespace TEXT NOT NULL, "
+                "signature BLOB NOT NULL, verdict TEXT NOT NULL, "
+                "used_at REAL NOT NULL, config TEXT NOT NULL)")
+            self._db.commit()
+            self._load()
+
+    def _config(self) -> str:
+        # Signatures are only comparable under the same hash functions
+        return f"{self.num_perm}:{self.seed}"
+
+    def _load(self) -> None:
+        """
+        Loads the most recently used entries from the SQLite file.
+        """
+        rows = self._db.execute(
+            "SELECT id, namespace, signature, verdict FROM ("
+            "SELECT * FROM near_duplicates WHERE config = ? "
+            "ORDER BY used_at DESC LIMIT ?) ORDER BY used_at",
+            (self._config(), self.max_entries)).fetchall()
+        for entry_id, namespace, blob, verdict in rows:
+            self._insert(entry_id, namespace, tuple(array('Q', blob)), verdict)
+        # Drop what was not loaded, including entries signed differently
+        self._db.execute(
+            "DELETE FROM near_duplicates WHERE id NOT IN ("
+            "SELECT id FROM near_duplicates WHERE config = ? "
+            "ORDER BY used_at DESC LIMIT ?)", (self._config(), self.max_entries))
+        self._db.commit()
+        self._next_id = 1 + (self._db.execute(
+            "SELECT MAX(id) FROM near_duplicates").fetchone()[0] or 0)
+
+    def _band_keys(self, namespace, signature):
+        rows = self._rows
+        return [(namespace, band, hash(signature[band * rows:(band + 1) * rows]))
+                for band in range(self.bands)]
+
+    def _insert(self, entry_id, namespace, signature, verdict):
+        self._entries[entry_id] = (namespace, signature, verdict)
+        for key in self._band_keys(namespace, signature):
+            self._buckets[key].add(entry_id)
+
+    def _evict(self) -> None:
+        """
+        Drops the least recently used entries beyond max_entries.
+        """
+        while len(self._entries) > self.max_entries:
+            entry_id, (namespace, signature, _) = self._entries.popitem(last=False)
+            for key in self._band_keys(namespace, signature):
+                bucket = self._buckets[key]
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+            if self._db is not None:
+                self._touched.pop(entry_id, None)
+                self._db.execute("DELETE FROM near_duplicates WHERE id = ?", (entry_id,))
+                self._written()
+            self.evictions += 1
+
+    def _written(self, changes=1) -> None:
+        self._unflushed += changes
+        if self._unflushed >= self.flush_every:
+            self.flush()
+
+    def sign(self, text: str) -> Optional[Signature]:
+        """
+        Computes the signature of a text with the index's hash functions.
+        """
+        return minhash(text, self.num_perm, self.shingle_size, self.seed)
+
+    def _signatures(self, texts):
+        return signatures(texts, self.num_perm, self.shingle_size, self.seed,
+                          self.processes, self.pool_min)
+
+    def _lookup(self, namespace, signature) -> Optional[str]:
+        """
+        Returns the verdict of the most similar entry at or above the
+        threshold, or None.
+        """
+        best, best_score = None, self.threshold
+        if signature is not None:
+            candidates = set().union(*(self._buckets.get(key, ())
+                                       for key in self._band_keys(namespace, signature)))
+            for entry_id in candidates:
+                score = similarity(signature, self._entries[entry_id][1])
+                if score >= best_score:
+                    best, best_score = entry_id, score
+
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(best)
+        if self._db is not None:
+            self._touched[best] = self.clock()
+            self._written()
+        return self._entries[best][2]
+
+    def _record(self, namespace, signature, verdict) -> None:
+        if signature is None:
+            return
+        entry_id = self._next_id
+        self._next_id += 1
+        self._insert(entry_id, namespace, signature, verdict)
+        if self._db is not None:
+            self._db.execute(
+                "INSERT INTO near_duplicates (id, namespace, signature, verdict, used_at, config) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (entry_id, namespace, array('Q', signature).tobytes(), verdict,
+                 self.clock(), self._config()))
+            self._written()
+        self._evict()
+
+    def get(self, namespace: str, text: str) -> Optional[str]:
+        """
+        Returns the verdict recorded for a near-duplicate of the text in
+        the namespace, or None.
+        """
+        return self._lookup(namespace, self._signatures([text])[0])
+
+    def get_many(self, namespace: str, texts: Sequence[str]) -> List[Optional[str]]:
+        """
+        Looks up many texts, computing their signatures in a process pool
+        for large batches.
+        """
+        return [self._lookup(namespace, signature) for signature in self._signatures(texts)]
+
+    def add(self, namespace: str, text: str, verdict: str) -> None:
+        """
+        Records the verdict of a text in the namespace.
+        """
+        self.add_many(namespace, [text], [verdict])
+
+    def add_many(self, namespace: str, texts: Sequence[str], verdicts: Sequence[str]) -> None:
+        """
+        Records many verdicts, computing the signatures in a process pool
+        for large batches.
+
+        Raises:
+            ValueError: If there is not one verdict per text.
+        """
+        if len(texts) != len(verdicts):
+            raise ValueError("Give one verdict per text.")
+        for signature, verdict in zip(self._signatures(texts), verdicts):
+            self._record(namespace, signature, verdict)
+
+    def scope(self, namespace: str) -> NearDuplicateScope:
+        """
+        Binds the index to one namespace, such as the key of an agent's
+        prompt without the chunk.
+        """
+        return NearDuplicateScope(self, namespace)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the hit/miss counters and the number of entries.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+        }
+
+    def flush(self) -> None:
+        """
+        Commits the buffered SQLite writes.
+        """
+        if self._db is None:
+            return
+        if self._touched:
+            self._db.executemany("UPDATE near_duplicates SET used_at = ? WHERE id = ?",
+                                 [(used_at, entry_id)
+                                  for entry_id, used_at in self._touched.items()])
+            self._touched.clear()
+        self._db.commit()
+        self._unflushed = 0
+
+    def close(self) -> None:
+        """
+        Flushes and closes the SQLite file.
+        """
+        if self._db is not None:
+            self.flush()
+            self._db.close()
+            self._db = None
@@ -0,0 +1,194 @@
+"""
+A module that screens chunks against keyword lexicons before they reach
+the model.
+"""
+
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Tuple
+
+from utils.verdicts import CLEAN_REPLY
+
+FLAGGED = 'flagged'
+CLEAN = 'clean'
+NEEDS_LLM = 'llm'
+
+# Deliberately narrow phrases that are unambiguous on their own. Anything
+# subtler is left to the model.
+DEFAULT_LEXICONS = {
+    "Pornographic material": ["hardcore porn", "porn video", "xxx video"],
+    "Hate speech": ["gas the jews", "white power", "racial holy war"],
+    "Promotion of self-harm or suicide": [
+        "kill yourself", "how to commit suicide", "best way to self harm"],
+    "Drug-related content": [
+        "buy cocaine", "buy heroin", "buy meth", "meth recipe"],
+    "Terrorism or extremist propaganda": [
+        "join isis", "join the jihad", "martyrdom operation"],
+    "Child exploitation": ["child porn", "child pornography", "csam"],
+}
+
+
+class AhoCorasick:
+    """
+    Multi-pattern matcher that finds every occurrence of a set of phrases
+    in a single pass over the text.
+
+    Matching is case-insensitive, by Unicode case folding, and only
+    reports whole-word matches. Offsets are always into the original text,
+    even where folding changes the length of a character.
+
+    Methods:
+        iter_matches(text): Yields (start, end, pattern) for every match.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        """
+        Builds the automaton.
+
+        Args:
+            patterns (Iterable[str]): The phrases to look for.
+
+        Raises:
+            ValueError: If a pattern is empty.
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Each state's output is (pattern, length of its folded form)
+        self._out: List[List[Tuple[str, int]]] = [[]]
+
+        for pattern in patterns:
+            pattern = pattern.lower()
+            if not pattern.strip():
+                raise ValueError("Patterns cannot be empty.")
+            folded = pattern.casefold()
+            state = 0
+            for char in folded:
+                following = self._goto[state].get(char)
+                if following is None:
+                    following = len(self._goto)
+                    self._goto[state][char] = following
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = following
+            if (pattern, len(folded)) not in self._out[state]:
+                self._out[state].append((pattern, len(folded)))
+
+        # Breadth-first pass to link every state to its longest proper
+        # suffix that is also a prefix of some pattern
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, following in self._goto[state].items():
+                queue.append(following)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[following] = self._goto[fallback].get(char, 0)
+                self._out[following] = (
+                    self._out[following] + self._out[self._fail[following]])
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """
+        Yields (start, end, pattern) for every whole-word match in the text.
+        """
+        # Fold one character at a time, remembering where each folded
+        # character came from, since folding can change the length
+        folded: List[str] = []
+        origins: List[int] = []
+        for index, char in enumerate(text):
+            for part in char.casefold():
+                folded.append(part)
+                origins.append(index)
+
+        state = 0
+        for position, char in enumerate(folded):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for pattern, length in self._out[state]:
+                start, end = position - length + 1, position + 1
+                if _is_boundary(folded, start - 1) and _is_boundary(folded, end):
+                    yield origins[start], origins[position] + 1, pattern
+
+
+def _is_boundary(text: Sequence[str], position: int) -> bool:
+    return position < 0 or position >= len(text) or not text[position].isalnum()
+
+
+class LexicalPrefilter:
+    """
+    Cheap first tier in front of ContentGuard's model call.
+
+    Each chunk is labelled as definitely flagged (it contains a lexicon
+    phrase), definitely clean (no lexicon or watchlist phrase, only when
+    clean_on_no_match is set) or in need of the model.
+
+    Attributes:
+        lexicons (dict): Forbidden category -> phrases that flag it.
+        watchlist (list): Phrases that always send a chunk to the model.
+        clean_on_no_match (bool): Whether chunks without any match are
+        passed as clean instead of going to the model.
+
+    Methods:
+        classify(chunk): Returns the decision and the matched categories.
+        screen(chunk): Returns a verdict string, or None for the model.
+    """
+
+    def __init__(self, lexicons: Optional[Mapping[str, Iterable[str]]] = None,
+                 watchlist: Iterable[str] = (), clean_on_no_match=False):
+        """
+        Initializes the prefilter.
+
+        Args:
+            lexicons (dict, optional): Forbidden category -> phrases.
+            Defaults to DEFAULT_LEXICONS.
+            watchlist (Iterable[str], optional): Phrases that always send
+            a chunk to the model. Defaults to none.
+            clean_on_no_match (bool, optional): Whether chunks without any
+            match skip the model as clean. Defaults to False.
+        """
+        self.lexicons = {
+            category: list(phrases)
+            for category, phrases in (lexicons or DEFAULT_LEXICONS).items()
+        }
+        self.watchlist = list(watchlist)
+        self.clean_on_no_match = clean_on_no_match
+
+        self._categories: Dict[str, Set[str]] = {}
+        for category, phrases in self.lexicons.items():
+            for phrase in phrases:
+                self._categories.setdefault(phrase.lower(), set()).add(category)
+        self._watch = {phrase.lower() for phrase in self.watchlist}
+        self._automaton = AhoCorasick(list(self._categories) + list(self._watch))
+
+    def classify(self, chunk: str) -> Tuple[str, List[str]]:
+        """
+        Labels the chunk.
+
+        Returns:
+            tuple: The decision (FLAGGED, CLEAN or NEEDS_LLM) and the matched
+            forbidden categories in lexicon order.
+        """
+        matched: Set[str] = set()
+        watched = False
+        for _, _, pattern in self._automaton.iter_matches(chunk):
+            matched |= self._categories.get(pattern, set())
+            watched = watched or pattern in self._watch
+
+        if matched:
+            return FLAGGED, [c for c in self.lexicons if c in matched]
+        if self.clean_on_no_match and not watched:
+            return CLEAN, []
+        return NEEDS_LLM, []
+
+    def screen(self, chunk: str) -> Optional[str]:
+        """
+        Returns the verdict in the model's own format for chunks the
+        prefilter can decide, or None for chunks that need the model.
+        """
+        decision, categories = self.classify(chunk)
+        if decision == FLAGGED:
+            return f"Yes: {', '.join(categories)}"
+        if decision == CLEAN:
+            return CLEAN_REPLY
+        return None
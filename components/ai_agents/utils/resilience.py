@@ -0,0 +1,346 @@
+"""
+A module that bounds how long and how often the agents wait on Ollama:
+retries with jittered backoff, per-request timeouts and a circuit breaker.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+import ollama
+
+logger = logging.getLogger(__name__)
+
+# Requests per chunk, including the first
+DEFAULT_ATTEMPTS = 3
+
+# Backoff before the n-th retry is drawn from [0, min(max, base * 2**n)]
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 8.0
+
+# Consecutive failed requests that open the circuit, and the seconds it
+# stays open before a trial request is let through
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_SECONDS = 30.0
+
+# HTTP statuses worth retrying besides 5xx
+RETRY_STATUSES = (408, 429)
+
+
+class CircuitOpenError(ConnectionError):
+    """
+    Raised instead of sending a request while the circuit is open.
+    """
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Tells whether a failed request is worth retrying.
+
+    Parameters:
+    error (BaseException): The exception the request raised.
+
+    Returns:
+    bool: True for timeouts, connection errors and server-side or
+        rate-limit responses; False for other errors, such as an unknown
+        model, which would fail again.
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, ollama.ResponseError):
+        status = error.status_code
+        # Errors reported mid-stream carry no status
+        return status < 0 or status >= 500 or status in RETRY_STATUSES
+    return isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError,
+                              httpx.TransportError))
+
+
+class CircuitBreaker:
+    """
+    Fails requests fast while the backend is unhealthy.
+
+    After failure_threshold transient failures in a row the circuit opens
+    and every request raises CircuitOpenError without reaching the server.
+    Once reset_seconds have passed, a single trial request is let through:
+    success closes the circuit, failure opens it again. Share one breaker
+    between every agent that talks to the same backend.
+
+    Attributes:
+        failure_threshold (int): Consecutive failures that open the circuit.
+        reset_seconds (float): How long the circuit stays open.
+        failures (int): The current run of consecutive failures.
+        opens (int): How many times the circuit has opened.
+        rejected (int): Requests refused while the circuit was open.
+
+    Methods:
+        call(call, retry_on=is_transient): Sends one request through the
+        breaker.
+        before_call(): Raises CircuitOpenError if no request may be sent.
+        record_success(trial): Closes the circuit.
+        record_failure(trial): Counts a failure, opening the circuit.
+        release(trial): Gives back a trial that ended without an answer.
+        stats(): Returns the state and counters.
+    """
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_seconds=DEFAULT_RESET_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initializes a closed circuit.
+
+        Args:
+            failure_threshold (int, optional): Consecutive failures that
+            open the circuit. Defaults to DEFAULT_FAILURE_THRESHOLD.
+            reset_seconds (float, optional): How long the circuit stays
+            open. Defaults to DEFAULT_RESET_SECONDS.
+            clock (Callable, optional): The time source, in seconds.
+
+        Raises:
+            ValueError: If the threshold is not a positive integer or the
+            reset time is negative.
+        """
+        if not isinstance(failure_threshold, int) or failure_threshold <= 0:
+            raise ValueError("Failure threshold must be a positive integer.")
+        if reset_seconds < 0:
+            raise ValueError("Reset seconds cannot be negative.")
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opens = 0
+        self.rejected = 0
+        self._opened_at = None
+        self._trial = False  # Whether a trial request is in flight
+
+    @property
+    def state(self) -> str:
+        """
+        'closed', 'open', or 'half_open' once a trial may be sent.
+        """
+        if self._opened_at is None:
+            return 'closed'
+        if self.clock() - self._opened_at < self.reset_seconds:
+            return 'open'
+        return 'half_open'
+
+    def before_call(self) -> bool:
+        """
+        Checks that a request may be sent.
+
+        Returns:
+            bool: Whether the request is the circuit's trial; pass it on to
+            record_success, record_failure or release.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half open with a
+            trial already in flight.
+        """
+        state = self.state
+        if state == 'closed':
+            return False
+        if state == 'open' or self._trial:
+            self.rejected += 1
+            raise CircuitOpenError("Circuit open: the Ollama backend keeps failing.")
+        self._trial = True
+        return True
+
+    def record_success(self, trial=False) -> None:
+        """
+        Closes the circuit after an answered request.
+        """
+        if self._opened_at is not None and not trial:
+            return  # A request sent before the circuit opened
+        if trial:
+            logger.info("Circuit closed: the Ollama backend answered again.")
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def record_failure(self, trial=False) -> None:
+        """
+        Counts a transient failure, opening the circuit at the threshold or
+        when the trial fails.
+        """
+        self.failures += 1
+        if trial or (self._opened_at is None and self.failures >= self.failure_threshold):
+            self._opened_at = self.clock()
+            self._trial = False
+            self.opens += 1
+            logger.warning("Circuit open for %.0fs after %d failures in a row.",
+                           self.reset_seconds, self.failures)
+
+    def release(self, trial=False) -> None:
+        """
+        Lets another trial through after one was cancelled.
+        """
+        if trial:
+            self._trial = False
+
+    async def call(self, call: Callable[[], Awaitable[Any]],
+                   retry_on: Callable[[BaseException], bool] = is_transient) -> Any:
+        """
+        Sends one request through the breaker.
+
+        Args:
+            call (Callable): Starts the request, returning an awaitable.
+            retry_on (Callable, optional): Tells the failures of the backend
+            itself, which count against it, from other errors. Defaults to
+            is_transient.
+
+        Returns:
+            The response.
+
+        Raises:
+            CircuitOpenError: If the circuit refused the request.
+            Exception: Whatever the request raised.
+        """
+        trial = self.before_call()
+        try:
+            response = await call()
+        except asyncio.CancelledError:
+            self.release(trial)
+            raise
+        except Exception as error:
+            if retry_on(error):
+                self.record_failure(trial)
+            else:
+                # The backend answered, even if the request was refused
+                self.record_success(trial)
+            raise
+        self.record_success(trial)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the state and counters.
+        """
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opens": self.opens,
+            "rejected": self.rejected,
+        }
+
+
+class RetryPolicy:
+    """
+    How a chunk's request is retried and how long each attempt may take.
+
+    Attributes:
+        attempts (int): Requests per chunk, including the first.
+        timeout (float): Seconds each attempt may take, or None.
+        base_delay (float): The backoff scale, in seconds.
+        max_delay (float): The longest backoff, in seconds.
+        retry_on (Callable): Tells whether an error is worth retrying.
+
+    Methods:
+        delay(retry): Draws the backoff before a retry.
+        run(call, breaker=None, expires=None): Sends a request under the
+        policy.
+    """
+
+    def __init__(self, attempts=DEFAULT_ATTEMPTS, timeout=None,
+                 base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY,
+                 retry_on: Callable[[BaseException], bool] = is_transient,
+                 rng: Optional[random.Random] = None):
+        """
+        Initializes the policy.
+
+        Args:
+            attempts (int, optional): Requests per chunk, including the
+            first. Defaults to DEFAULT_ATTEMPTS.
+            timeout (float, optional): Seconds each attempt may take before
+            it is cancelled and, if attempts remain, retried. Defaults to
+            None, for no limit.
+            base_delay (float, optional): The backoff scale, in seconds.
+            Defaults to DEFAULT_BASE_DELAY.
+            max_delay (float, optional): The longest backoff, in seconds.
+            Defaults to DEFAULT_MAX_DELAY.
+            retry_on (Callable, optional): Tells whether an error is worth
+            retrying. Defaults to is_transient.
+            rng (random.Random, optional): The source of jitter.
+
+        Raises:
+            ValueError: If attempts is not a positive integer, or the
+            timeout or delays are not positive.
+        """
+        if not isinstance(attempts, int) or attempts <= 0:
+            raise ValueError("Attempts must be a positive integer.")
+        if timeout is not None and timeout <= 0:
+            raise ValueError("Timeout must be positive.")
+        if base_delay < 0 or max_delay < base_delay:
+            raise ValueError("Delays must be non-negative, with max_delay >= base_delay.")
+        self.attempts = attempts
+        self.timeout = timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on = retry_on
+        self._rng = rng or random.Random()
+
+    def delay(self, retry: int) -> float:
+        """
+        Draws the backoff before a retry, with full jitter so chunks that
+        failed together don't retry together.
+
+        Args:
+            retry (int): The number of the retry, from 0.
+
+        Returns:
+            float: The seconds to wait.
+        """
+        return self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+    async def run(self, call: Callable[[], Awaitable[Any]],
+                  breaker: Optional[CircuitBreaker] = None,
+                  expires: Optional[float] = None) -> Any:
+        """
+        Sends a request, retrying transient failures.
+
+        Args:
+            call (Callable): Starts the request, returning an awaitable.
+            breaker (CircuitBreaker, optional): Checked before and told the
+            outcome of every attempt.
+            expires (float, optional): The event loop time by which the
+            request must be answered. Attempts and backoffs are cut short
+            to fit.
+
+        Returns:
+            The response.
+
+        Raises:
+            asyncio.TimeoutError: If the last attempt timed out or the
+            deadline left no time for another one.
+            CircuitOpenError: If the breaker refused the request.
+            Exception: The last error, when it is not worth retrying or
+            the attempts ran out.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.attempts):
+            timeout = self.timeout
+            if expires is not None:
+                remaining = expires - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError("Deadline passed before the request was sent.")
+                timeout = remaining if timeout is None else min(timeout, remaining)
+
+            # Bind this attempt's timeout; a timed out attempt counts
+            # against the breaker like any other failure
+            attempt_call = call if timeout is None else \
+                lambda timeout=timeout: asyncio.wait_for(call(), timeout)
+            try:
+                if breaker is not None:
+                    return await breaker.call(attempt_call, self.retry_on)
+                return await attempt_call()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                if not self.retry_on(error) or attempt + 1 == self.attempts:
+                    raise
+                delay = self.delay(attempt)
+                if expires is not None and loop.time() + delay >= expires:
+                    raise
+                logger.warning("Request failed (%r); retrying in %.2fs.", error, delay)
+                await asyncio.sleep(delay)
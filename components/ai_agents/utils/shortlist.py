@@ -0,0 +1,133 @@
+"""
+A module that narrows a large career list down to the titles closest to
+a chunk, using embeddings.
+"""
+
+import hashlib
+import os
+from typing import Any, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed when a shortlist is used
+    np = None
+
+DEFAULT_EMBED_MODEL = 'nomic-embed-text'
+DEFAULT_TOP_K = 20
+
+
+class CareerShortlist:
+    """
+    Embedding-based shortlist of career titles.
+
+    The titles are embedded once into a normalised NumPy matrix, which is
+    cached on disk. Each chunk is then embedded and scored against every
+    title with a single matrix-vector product, and only the top_k titles
+    are kept for the prompt.
+
+    Attributes:
+        career_list (list): The full list of career titles.
+        embed_model (str): The Ollama embedding model.
+        top_k (int): The number of titles kept per chunk.
+        cache_dir (str): Where the title matrix is cached, or None.
+
+    Methods:
+        load(client): Embeds the titles, or loads them from the cache.
+        select(client, chunk): Returns the top_k titles for the chunk.
+    """
+
+    def __init__(self, career_list: Sequence[str], embed_model=DEFAULT_EMBED_MODEL,
+                 top_k=DEFAULT_TOP_K, cache_dir: Optional[str] = None):
+        """
+        Initializes the shortlist.
+
+        Args:
+            career_list (Sequence[str]): The full list of career titles.
+            embed_model (str, optional): The Ollama embedding model.
+            Defaults to DEFAULT_EMBED_MODEL.
+            top_k (int, optional): The number of titles kept per chunk.
+            Defaults to DEFAULT_TOP_K.
+            cache_dir (str, optional): A directory to cache the title
+            matrix in. Defaults to None.
+
+        Raises:
+            ImportError: If numpy is not installed.
+            ValueError: If the career list is empty or top_k is not positive.
+        """
+        if np is None:
+            raise ImportError("CareerShortlist requires numpy.")
+        if not career_list:
+            raise ValueError("Career list must contain valid career titles.")
+        if not isinstance(top_k, int) or top_k <= 0:
+            raise ValueError("Top k must be a positive integer.")
+
+        self.career_list = list(career_list)
+        self.embed_model = embed_model
+        self.top_k = top_k
+        self.cache_dir = cache_dir
+        self._matrix = None
+
+    @property
+    def cache_path(self) -> Optional[str]:
+        """
+        The file the title matrix is cached in, keyed by model and titles.
+        """
+        if self.cache_dir is None:
+            return None
+        digest = hashlib.sha256(self.embed_model.encode("utf-8"))
+        for title in self.career_list:
+            digest.update(b"\x00" + title.encode("utf-8"))
+        return os.path.join(self.cache_dir, f"careers-{digest.hexdigest()[:16]}.npy")
+
+    async def load(self, client: Any) -> None:
+        """
+        Embeds the career titles, unless they are already loaded or cached.
+
+        Args:
+            client: An object exposing an async ``embed(model=..., input=...)``
+            method, such as ``ollama.AsyncClient``.
+        """
+        if self._matrix is not None or len(self.career_list) <= self.top_k:
+            return
+
+        path = self.cache_path
+        if path is not None and os.path.exists(path):
+            self._matrix = np.load(path)
+            return
+
+        response = await client.embed(model=self.embed_model, input=self.career_list)
+        self._matrix = _normalise(np.asarray(response['embeddings'], dtype=np.float32))
+
+        if path is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            np.save(path, self._matrix)
+
+    async def select(self, client: Any, chunk: str) -> List[str]:
+        """
+        Returns the top_k titles closest to the chunk, in career list order.
+
+        Args:
+            client: See load.
+            chunk (str): The chunk to shortlist titles for.
+
+        Returns:
+            list: The shortlisted career titles.
+        """
+        if len(self.career_list) <= self.top_k:
+            return self.career_list
+        await self.load(client)
+
+        response = await client.embed(model=self.embed_model, input=chunk)
+        vector = _normalise(np.asarray(response['embeddings'][0], dtype=np.float32))
+        scores = self._matrix @ vector
+        best = np.argpartition(-scores, self.top_k - 1)[:self.top_k]
+        return [self.career_list[i] for i in np.sort(best)]
+
+
+def _normalise(array):
+    """
+    Scales vectors (or matrix rows) to unit length so dot products are
+    cosine similarities.
+    """
+    norms = np.linalg.norm(array, axis=-1, keepdims=True)
+    return array / np.where(norms == 0, 1, norms)
@@ -0,0 +1,143 @@
+"""
+A module that lets concurrent identical requests share one model call.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Iterable, Mapping, Tuple
+
+from utils.cache import make_key as make_messages_key
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(model: str, messages: Iterable[Mapping[str, str]], **settings) -> str:
+    """
+    Builds the key of a chat request.
+
+    Like the verdict cache key it covers the model and every message, and
+    it also covers the request settings, such as options and format, since
+    they change the reply.
+
+    Parameters:
+    model (str): The model the request is sent to.
+    messages (Iterable[Mapping]): The chat messages of the request.
+    **settings: The other chat arguments of the request.
+
+    Returns:
+    str: A hex SHA-256 digest.
+    """
+    key = make_messages_key(model, messages)
+    if not settings:
+        return key
+    extra = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(f"{key}\x00{extra}".encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """
+    A call in progress and the number of callers waiting on it.
+    """
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class Singleflight:
+    """
+    Table of the model calls in flight, keyed by request.
+
+    The first caller with a key starts the call; callers arriving with the
+    same key while it runs wait for it instead of sending their own, and
+    all of them get its reply or its error. The call is cancelled only
+    when every caller waiting on it has been cancelled, so one agent
+    stopping early does not cut the reply off from the others. Entries
+    leave the table as soon as the call finishes, so this covers the gap
+    before a VerdictCache is filled rather than replacing it.
+
+    Share one instance between agents to coalesce requests across them.
+
+    Attributes:
+        calls (int): Calls started.
+        hits (int): Callers that joined a call already in flight.
+
+    Methods:
+        make_key(model, messages, **settings): Builds the key for a request.
+        do(key, call): Runs the call, or joins the one in flight for the key.
+        stats(): Returns the counters and the number of calls in flight.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty table.
+        """
+        self.calls = 0
+        self.hits = 0
+        # asyncio tasks are bound to the event loop they run on
+        self._flights = weakref.WeakKeyDictionary()
+
+    make_key = staticmethod(make_key)
+
+    def _table(self) -> Dict[str, _Flight]:
+        loop = asyncio.get_running_loop()
+        table = self._flights.get(loop)
+        if table is None:
+            table = self._flights[loop] = {}
+        return table
+
+    async def do(self, key: str, call: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Runs the call, or waits for the identical call already in flight.
+
+        Args:
+            key (str): The request key, from make_key.
+            call (Callable): Starts the request when no identical one is in
+            flight.
+
+        Returns:
+            tuple: The call's result, and whether it was shared with a call
+            another caller started.
+
+        Raises:
+            Exception: Whatever the call raised.
+        """
+        table = self._table()
+        flight = table.get(key)
+        shared = flight is not None
+        if shared:
+            self.hits += 1
+            logger.debug("Joining the request in flight for %s.", key[:12])
+        else:
+            self.calls += 1
+            flight = table[key] = _Flight(asyncio.ensure_future(call()))
+            flight.task.add_done_callback(
+                lambda _: table.pop(key, None) if table.get(key) is flight else None)
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task), shared
+        except asyncio.CancelledError:
+            if not flight.task.done() and flight.waiters == 1:
+                # Nobody is left to read the reply; later callers start afresh
+                if table.get(key) is flight:
+                    del table[key]
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the counters and the number of calls in flight.
+        """
+        return {
+            "calls": self.calls,
+            "hits": self.hits,
+            "in_flight": sum(len(table) for table in self._flights.values()),
+        }
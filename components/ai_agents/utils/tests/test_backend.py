@@ -0,0 +1,116 @@
+"""
+    Unit tests for the OllamaBackend class in the backend module.
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+from unittest.mock import AsyncMock, patch
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend import OllamaBackend, run, shared_backend
+
+
+class TestOllamaBackend(unittest.TestCase):
+
+    @patch('backend.ollama.AsyncClient')
+    def test_chat_merges_options_and_keep_alive(self, mock_async_client):
+        mock_chat = mock_async_client.return_value.chat = AsyncMock(return_value="reply")
+        backend = OllamaBackend(keep_alive=-1, options={'num_ctx': 2048, 'num_thread': 4})
+
+        reply = asyncio.run(backend.chat('phi3', [], options={'num_ctx': 4096}))
+
+        self.assertEqual(reply, "reply")
+        mock_chat.assert_called_once_with(
+            model='phi3', messages=[], keep_alive=-1,
+            options={'num_ctx': 4096, 'num_thread': 4})
+
+    @patch('backend.ollama.AsyncClient')
+    def test_no_options_are_sent_when_none_are_set(self, mock_async_client):
+        mock_chat = mock_async_client.return_value.chat = AsyncMock()
+        backend = OllamaBackend(keep_alive=None)
+
+        asyncio.run(backend.chat('phi3', [], keep_alive='5m'))
+
+        mock_chat.assert_called_once_with(model='phi3', messages=[], keep_alive='5m')
+
+    @patch('backend.ollama.AsyncClient')
+    def test_client_is_pooled_per_event_loop(self, mock_async_client):
+        mock_async_client.side_effect = lambda **kwargs: AsyncMock()
+        backend = OllamaBackend(host="http://ollama:11434", timeout=5, max_connections=2)
+
+        async def use():
+            first, second = backend.client, backend.client
+            await backend.embed('nomic-embed-text', "text")
+            return first, second
+
+        first, second = asyncio.run(use())
+        other, _ = asyncio.run(use())
+
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+        kwargs = mock_async_client.call_args.kwargs
+        self.assertEqual(kwargs['host'], "http://ollama:11434")
+        self.assertEqual(kwargs['timeout'], 5)
+        self.assertEqual(kwargs['limits'].max_connections, 2)
+
+    @patch('backend.ollama.AsyncClient')
+    def test_aclose_closes_the_loop_client(self, mock_async_client):
+        client = mock_async_client.return_value = AsyncMock()
+        backend = OllamaBackend()
+
+        async def use():
+            backend.client
+            await backend.aclose()
+            await backend.aclose()
+
+        asyncio.run(use())
+
+        client.close.assert_awaited_once()
+
+    @patch('backend.ollama.AsyncClient')
+    def test_run_closes_the_loop_client(self, mock_async_client):
+        client = mock_async_client.return_value = AsyncMock()
+        backend = OllamaBackend()
+
+        async def use():
+            await backend.chat('phi3', [])
+            return "done"
+
+        self.assertEqual(run(use(), backend), "done")
+        self.assertEqual(run(use(), backend), "done")
+
+        self.assertEqual(client.close.await_count, 2)
+        self.assertEqual(len(backend._clients), 0)
+
+    @patch('backend.ollama.AsyncClient')
+    def test_clients_of_closed_loops_are_forgotten(self, mock_async_client):
+        # Real clients hold on to their loop, so the weak keys never expire
+        mock_async_client.side_effect = lambda **kwargs: AsyncMock(
+            loop=asyncio.get_running_loop())
+        backend = OllamaBackend()
+
+        async def use():
+            return backend.client
+
+        for _ in range(4):
+            asyncio.run(use())
+
+        # Only the client of the last loop is left until the next access
+        self.assertEqual(len(backend._clients), 1)
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            OllamaBackend(max_connections=0)
+        with self.assertRaises(ValueError):
+            OllamaBackend(timeout=0)
+
+    def test_shared_backend_is_a_singleton(self):
+        self.assertIs(shared_backend(), shared_backend())
+
+
+if __name__ == '__main__':
+    unittest.main()
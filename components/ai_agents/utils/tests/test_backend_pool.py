@@ -0,0 +1,195 @@
+"""
+    Unit tests for the BackendPool class in the backend_pool module.
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+import ollama
+
+# Add the ai_agents directory to the sys.path so utils is importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from utils.backend_pool import BackendPool
+
+
+class FakeBackend:
+    """
+    Answers chat calls after a delay, or fails while `failing` is set.
+    """
+
+    def __init__(self, host, delay=0.01):
+        self.host = host
+        self.delay = delay
+        self.failing = False
+        self.calls = 0
+        self.in_flight = 0
+        self.peak = 0
+        self.closed = False
+
+    async def chat(self, model, messages, **kwargs):
+        self.calls += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.failing:
+                raise ConnectionError(f"{self.host} is down")
+            return {'message': {'content': self.host}}
+        finally:
+            self.in_flight -= 1
+
+    async def ps(self):
+        if self.failing:
+            raise ConnectionError(f"{self.host} is down")
+        return {'models': []}
+
+    async def aclose(self):
+        self.closed = True
+
+
+def burst(pool, count):
+    async def run():
+        return await asyncio.gather(*(pool.chat('phi3', []) for _ in range(count)),
+                                    return_exceptions=True)
+    return asyncio.run(run())
+
+
+class TestBackendPool(unittest.TestCase):
+
+    def setUp(self):
+        self.backends = [FakeBackend("a"), FakeBackend("b"), FakeBackend("c")]
+
+    def test_requests_spread_within_caps(self):
+        pool = BackendPool(self.backends, max_in_flight=[1, 2, 2])
+        replies = burst(pool, 20)
+
+        self.assertEqual(len(replies), 20)
+        self.assertEqual([backend.peak for backend in self.backends], [1, 2, 2])
+        self.assertTrue(all(backend.calls > 0 for backend in self.backends))
+        self.assertEqual(sum(stat["requests"] for stat in pool.stats()), 20)
+
+    def test_least_outstanding_wins(self):
+        slow, fast = FakeBackend("slow", delay=0.2), FakeBackend("fast", delay=0.01)
+        pool = BackendPool([slow, fast], max_in_flight=4)
+        burst(pool, 2)  # One each to start with
+        burst(pool, 12)
+        # The slow backend keeps its requests outstanding, so it gets fewer
+        self.assertLess(slow.calls, fast.calls)
+
+    def test_failing_backend_is_ejected_and_tried_again(self):
+        self.backends[0].failing = True
+        pool = BackendPool(self.backends, max_in_flight=1, failure_threshold=2,
+                           eject_seconds=0.3)
+        with self.assertLogs('utils.backend_pool', 'WARNING'):
+            for _ in range(4):
+                burst(pool, 3)
+        self.assertTrue(pool.stats()[0]["ejected"])
+        calls = self.backends[0].calls
+        self.assertEqual(calls, 2)
+
+        burst(pool, 6)
+        self.assertEqual(self.backends[0].calls, calls)  # Still ejected
+
+        asyncio.run(asyncio.sleep(0.3))
+        burst(pool, 3)
+        # One trial request, which failed again
+        self.assertEqual(self.backends[0].calls, calls + 1)
+        self.assertTrue(pool.stats()[0]["ejected"])
+
+    def test_reinstated_backend_takes_one_request_at_a_time(self):
+        self.backends[0].failing = True
+        pool = BackendPool(self.backends[:2], max_in_flight=4, failure_threshold=1,
+                           eject_seconds=0.05)
+        with self.assertLogs('utils.backend_pool', 'WARNING'):
+            burst(pool, 2)  # One each
+        self.assertTrue(pool.stats()[0]["ejected"])
+
+        asyncio.run(asyncio.sleep(0.05))
+        self.backends[0].failing = False
+        self.backends[0].delay = 0.1
+        self.backends[0].peak = 0
+        burst(pool, 8)
+        # Half open: while the trial is in flight, the rest go elsewhere
+        self.assertEqual(self.backends[0].peak, 1)
+        self.assertEqual(self.backends[0].calls, 2)
+        self.assertEqual(pool.stats()[0]["trial"], False)
+        self.assertEqual(pool.stats()[0]["ejected"], False)
+
+        burst(pool, 8)
+        self.assertGreater(self.backends[0].peak, 1)
+
+    def test_refused_requests_do_not_eject(self):
+        class RefusingBackend(FakeBackend):
+            async def chat(self, model, messages, **kwargs):
+                raise ollama.ResponseError("model not found", 404)
+
+        pool = BackendPool([RefusingBackend("a")], failure_threshold=1)
+        replies = burst(pool, 3)
+        self.assertTrue(all(isinstance(reply, ollama.ResponseError) for reply in replies))
+        self.assertEqual(pool.stats()[0]["errors"], 3)
+        self.assertFalse(pool.stats()[0]["ejected"])
+
+    def test_slow_backend_is_ejected(self):
+        self.backends[0].delay = 0.05
+        pool = BackendPool(self.backends[:2], max_in_flight=1, slow_seconds=0.03)
+        with self.assertLogs('utils.backend_pool', 'WARNING'):
+            for _ in range(4):
+                burst(pool, 2)
+        self.assertEqual([stat["ejected"] for stat in pool.stats()], [True, False])
+
+    def test_all_ejected_still_routes(self):
+        pool = BackendPool(self.backends[:1], failure_threshold=1)
+        self.backends[0].failing = True
+        burst(pool, 1)
+        self.backends[0].failing = False
+        self.assertEqual(burst(pool, 1), [{'message': {'content': "a"}}])
+
+    def test_health_checks(self):
+        pool = BackendPool(self.backends, eject_seconds=0)
+        self.backends[1].failing = True
+        with self.assertLogs('utils.backend_pool', 'WARNING'):
+            health = asyncio.run(pool.check_health())
+        self.assertEqual(health, {"a": True, "b": False, "c": True})
+        self.assertTrue(pool.stats()[1]["ejected"])
+
+        self.backends[1].failing = False
+        asyncio.run(pool.check_health())
+        self.assertFalse(pool.stats()[1]["ejected"])
+
+    def test_background_health_checks_and_close(self):
+        async def run():
+            pool = BackendPool(self.backends)
+            self.backends[2].failing = True
+            pool.start_health_checks(interval=0.01)
+            await asyncio.sleep(0.03)
+            ejected = pool.stats()[2]["ejected"]
+            await pool.aclose()
+            return ejected
+
+        with self.assertLogs('utils.backend_pool', 'WARNING'):
+            self.assertTrue(asyncio.run(run()))
+        self.assertTrue(all(backend.closed for backend in self.backends))
+
+    def test_urls_become_backends(self):
+        pool = BackendPool(["http://a:11434", "http://b:11434"],
+                           backend_options={'keep_alive': '5m'})
+        self.assertEqual([backend.host for backend in pool.backends],
+                         ["http://a:11434", "http://b:11434"])
+        self.assertEqual(pool.backends[0].keep_alive, '5m')
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            BackendPool([])
+        with self.assertRaises(ValueError):
+            BackendPool(self.backends, max_in_flight=[1, 2])
+        with self.assertRaises(ValueError):
+            BackendPool(self.backends, max_in_flight=0)
+        with self.assertRaises(ValueError):
+            BackendPool(self.backends, failure_threshold=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+    Unit tests for the batching module.
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+# Add the ai_agents directory to the sys.path so utils is importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from utils.batching import dispatch_batches, format_batch, pack_documents, parse_batch
+
+
+def build_messages(batch):
+    return [{'role': 'user', 'content': batch}]
+
+
+class LabelClient:
+    """
+    Answers every item of a batch with its upper-cased text, except the
+    labels listed in drop.
+    """
+
+    def __init__(self, drop=()):
+        self.drop = set(drop)
+        self.calls = 0
+
+    async def chat(self, model, messages):
+        self.calls += 1
+        lines = []
+        for line in messages[0]['content'].splitlines():
+            label, _, text = line.partition(" ")
+            if label.strip("[]") and int(label.strip("[]")) not in self.drop:
+                lines.append(f"{label} {text.upper()}")
+        return {'message': {'content': "\n".join(lines)}}
+
+
+class TestBatching(unittest.TestCase):
+
+    def test_pack_documents(self):
+        docs = ["a" * 10, "b" * 10, "c" * 10, "d" * 100, "e"]
+        # Each item costs len("[[n]] ") + text + newline
+        self.assertEqual(pack_documents(docs, max_chars=40), [[0, 1], [2, 4]])
+        self.assertEqual(pack_documents(docs, max_chars=1000, max_items=2),
+                         [[0, 1], [2, 3], [4]])
+
+    def test_format_batch_flattens_items(self):
+        self.assertEqual(format_batch(["one\ntwo", "three"]),
+                         "[[1]] one two\n[[2]] three\n")
+
+    def test_parse_batch(self):
+        reply = "Here you go:\n[[1]] No\n[[2]]   Yes: Hate speech\n[[7]] Junk\n[[3]]"
+        self.assertEqual(parse_batch(reply, 3), {1: "No", 2: "Yes: Hate speech"})
+
+    def test_dispatch_batches_packs_and_requeues(self):
+        client = LabelClient(drop={2})
+        singles = []
+
+        async def run_single(index, client):
+            singles.append(index)
+            return [f"single {index}"]
+
+        docs = ["first", "second", "third", "x" * 500]
+        results = asyncio.run(dispatch_batches(
+            client, docs, build_messages, run_single, max_chars=100))
+
+        self.assertEqual(results, [["FIRST"], ["single 1"], ["THIRD"], ["single 3"]])
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(sorted(singles), [1, 3])
+
+    def test_invalid_limits(self):
+        with self.assertRaises(ValueError):
+            pack_documents(["a"], max_chars=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
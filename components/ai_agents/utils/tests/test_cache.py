@@ -0,0 +1,133 @@
+"""
+    Unit tests for the VerdictCache class in the cache module.
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from contextlib import closing
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cache import VerdictCache, make_key
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def messages(content):
+    return [{'role': 'user', 'content': content}]
+
+
+class TestMakeKey(unittest.TestCase):
+
+    def test_whitespace_is_normalized(self):
+        self.assertEqual(make_key("phi3", messages("a  b\nc")),
+                         make_key("phi3", messages("a b c")))
+
+    def test_model_and_roles_are_part_of_key(self):
+        key = make_key("phi3", messages("a"))
+        self.assertNotEqual(key, make_key("llama3", messages("a")))
+        self.assertNotEqual(key, make_key("phi3", [{'role': 'system', 'content': 'a'}]))
+
+
+class TestVerdictCache(unittest.TestCase):
+
+    def test_hit_and_miss_counters(self):
+        cache = VerdictCache()
+        self.assertIsNone(cache.get("k"))
+        cache.set("k", "No")
+        self.assertEqual(cache.get("k"), "No")
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_lru_eviction(self):
+        cache = VerdictCache(max_entries=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")  # "b" is now the least recently used
+        cache.set("c", "3")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "1")
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = VerdictCache(ttl=10, clock=clock)
+        cache.set("k", "No")
+        clock.now += 5
+        self.assertEqual(cache.get("k"), "No")
+        clock.now += 6
+        self.assertIsNone(cache.get("k"))
+        self.assertEqual(cache.stats()["memory_size"], 0)
+
+    def test_disk_tier_survives_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "verdicts.db")
+            cache = VerdictCache(path=path)
+            cache.set("k", "Yes: Hate speech")
+            cache.close()
+
+            reopened = VerdictCache(path=path)
+            self.assertEqual(reopened.get("k"), "Yes: Hate speech")
+            self.assertEqual(reopened.stats()["disk_hits"], 1)
+            self.assertEqual(reopened.get("k"), "Yes: Hate speech")
+            self.assertEqual(reopened.stats()["disk_hits"], 1)  # Promoted to memory
+            reopened.close()
+
+    def test_disk_tier_size_limit(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            clock = FakeClock()
+            cache = VerdictCache(max_entries=1, path=os.path.join(tmp, "v.db"),
+                                 max_disk_entries=2, clock=clock)
+            for key in "abc":
+                clock.now += 1
+                cache.set(key, key.upper())
+            self.assertEqual(cache.stats()["disk_size"], 2)
+            self.assertIsNone(cache.get("a"))
+            self.assertEqual(cache.get("b"), "B")
+            cache.close()
+
+    def test_sqlite_writes_are_batched(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "verdicts.db")
+            clock = FakeClock()
+            cache = VerdictCache(max_entries=1, path=path, clock=clock, flush_every=3)
+
+            def committed():
+                with closing(sqlite3.connect(path)) as db:
+                    return db.execute(
+                        "SELECT key, used_at FROM verdicts ORDER BY key").fetchall()
+
+            cache.set("a", "A")
+            cache.set("b", "B")
+            # Nothing is committed below flush_every writes
+            self.assertEqual(committed(), [])
+            clock.now += 5
+            # A disk hit only notes the use, and is written with the batch
+            self.assertEqual(cache.get("a"), "A")
+            self.assertEqual(committed(), [("a", 1005.0), ("b", 1000.0)])
+            cache.set("c", "C")
+            cache.close()
+            self.assertEqual(len(committed()), 3)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            VerdictCache(max_entries=0)
+        with self.assertRaises(ValueError):
+            VerdictCache(ttl=0)
+        with self.assertRaises(ValueError):
+            VerdictCache(flush_every=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
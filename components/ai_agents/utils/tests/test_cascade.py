@@ -0,0 +1,111 @@
+"""
+    Unit tests for the Cascade class in the cascade module.
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cascade import Cascade
+from dispatch import dispatch_chunks
+from metrics import InMemoryMetrics
+
+
+class TieredClient:
+    """
+    Answers the fast model from a table of replies by chunk, and the large
+    model with the chunk in capitals.
+    """
+
+    def __init__(self, fast_replies):
+        self.fast_replies = fast_replies
+        self.calls = []
+
+    async def chat(self, model, messages, **kwargs):
+        self.calls.append((model, kwargs))
+        chunk = messages[0]['content']
+        if model == 'tiny':
+            reply = self.fast_replies[chunk]
+        else:
+            reply = chunk.upper()
+        return {'message': {'content': reply}, 'eval_count': 2 if model == 'tiny' else 10}
+
+
+def build_messages(chunk):
+    return [{'role': 'user', 'content': chunk}]
+
+
+class TestCascade(unittest.TestCase):
+
+    def test_read(self):
+        cascade = Cascade('tiny', min_confidence=0.8)
+        self.assertEqual(cascade.read('{"forbidden": [], "confidence": 0.95}', "forbidden"), [])
+        self.assertEqual(cascade.read('{"careers": ["data scientist"], "confidence": 1}',
+                                      "careers", allowed=["Data Scientist"]),
+                         ["Data Scientist"])
+        # Not confident enough, unreadable, or naming something not asked about
+        self.assertIsNone(cascade.read('{"forbidden": [], "confidence": 0.5}', "forbidden"))
+        self.assertIsNone(cascade.read('{"forbidden": []}', "forbidden"))
+        self.assertIsNone(cascade.read('{"forbidden": [], "confidence": true}', "forbidden"))
+        self.assertIsNone(cascade.read('No, nothing found.', "forbidden"))
+        self.assertIsNone(cascade.read('{"careers": ["Chef"], "confidence": 0.9}',
+                                       "careers", allowed=["Data Scientist"]))
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            Cascade('tiny', min_confidence=1.5)
+        with self.assertRaises(ValueError):
+            Cascade('')
+
+    def test_dispatch_escalates_unsure_chunks(self):
+        client = TieredClient({
+            "sure": '{"forbidden": [], "confidence": 0.9}',
+            "unsure": '{"forbidden": [], "confidence": 0.4}',
+            "garbled": 'I think this is fine',
+        })
+        cascade = Cascade('tiny')
+
+        def accept(response):
+            forbidden = cascade.read(response, "forbidden")
+            return None if forbidden is None else "clean"
+
+        results = asyncio.run(dispatch_chunks(
+            client, ["sure", "unsure", "garbled"], build_messages, model='large',
+            cascade=cascade.stage(build_messages, accept)))
+
+        self.assertEqual([r.response for r in results], ["clean", "UNSURE", "GARBLED"])
+        self.assertEqual([r.path for r in results],
+                         [('tiny',), ('tiny', 'large'), ('tiny', 'large')])
+        self.assertEqual([r.escalated for r in results], [False, True, True])
+        # Escalated chunks count the tokens of both requests
+        self.assertEqual([r.eval_count for r in results], [2, 12, 12])
+        fast_calls = [kwargs for model, kwargs in client.calls if model == 'tiny']
+        self.assertTrue(all(kwargs['format'] == 'json' for kwargs in fast_calls))
+        self.assertTrue(all(kwargs['options']['num_predict'] == 64 for kwargs in fast_calls))
+
+        metrics = InMemoryMetrics()
+        metrics.record_run('content_guard', results, 0.1)
+        summary = metrics.summary()['content_guard']['cascade']
+        self.assertEqual(summary['fast'], 1)
+        self.assertEqual(summary['escalated'], 2)
+        self.assertAlmostEqual(summary['escalation_rate'], 2 / 3)
+        self.assertIn('ai_agents_cascade_chunks_total{agent="content_guard",outcome="escalated"} 2',
+                      metrics.prometheus())
+
+    def test_no_cascade_records_single_path(self):
+        client = TieredClient({})
+        results = asyncio.run(dispatch_chunks(client, ["a"], build_messages, model='large'))
+        self.assertEqual(results[0].path, ('large',))
+        self.assertIsNone(results[0].escalated)
+
+        metrics = InMemoryMetrics()
+        metrics.record_run('content_guard', results, 0.1)
+        self.assertIsNone(metrics.summary()['content_guard']['cascade'])
+
+
+if __name__ == '__main__':
+    unittest.main()
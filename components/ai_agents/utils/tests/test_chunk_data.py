@@ -2,6 +2,10 @@
     Unit tests for the chunk_prompt function in the chunk_data module.
 """
 
+import io
+import mmap
+import pathlib
+import tempfile
 import unittest
 import sys
 import os
@@ -9,7 +13,9 @@ import os
 # Add the parent directory to the sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from chunk_data import chunk_prompt
+import chunk_data
+from chunk_data import (Span, chunk_hash, chunk_prompt, estimate_tokens, iter_cdc_chunks,
+                        iter_chunks, iter_hashed, iter_token_chunks, token_budget)
 
 
 class TestChunkPrompt(unittest.TestCase):
@@ -54,6 +60,198 @@ class TestChunkPrompt(unittest.TestCase):
         with self.assertRaises(ValueError):
             chunk_prompt(text, chunk_size)
 
+
+class TestIterChunks(unittest.TestCase):
+
+    text = "This is a simple test case to check chunking functionality."
+    expected = ["This is a", "simple", "test case", "to check", "chunking", "functionality."]
+
+    def test_matches_chunk_prompt(self):
+        result = iter_chunks(self.text, 10)
+        self.assertNotIsInstance(result, list)
+        self.assertEqual(list(result), self.expected)
+
+    def test_is_lazy(self):
+        words = iter_chunks(self.text, 10)
+        self.assertEqual(next(words), "This is a")
+
+    def test_text_file_object(self):
+        result = list(iter_chunks(io.StringIO(self.text), 10))
+        self.assertEqual(result, self.expected)
+
+    def test_binary_file_object_across_blocks(self):
+        # Multi-byte characters and words straddling block boundaries
+        text = " ".join(["caf\u00e9"] * 5000)
+        with patch_block_size(7):
+            result = list(iter_chunks(io.BytesIO(text.encode("utf-8")), 20))
+        self.assertEqual(result, chunk_prompt(text, 20))
+
+    def test_mmap_path(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp, "feed.txt")
+            path.write_text(self.text + "\n")
+            self.assertEqual(list(iter_chunks(path, 10)), self.expected)
+
+    def test_empty_path(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp, "empty.txt")
+            path.write_text("")
+            self.assertEqual(list(iter_chunks(path, 10)), [])
+
+    def test_invalid_source(self):
+        with self.assertRaises(ValueError):
+            iter_chunks(1234, 10)
+
+    def test_invalid_chunk_size(self):
+        with self.assertRaises(ValueError):
+            iter_chunks(self.text, 0)
+
+
+class TestTokenChunks(unittest.TestCase):
+
+    def count_words(self, word):
+        return 1  # One token per word keeps the expectations readable
+
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("a bb"), 2)
+        self.assertEqual(estimate_tokens("functionality."), 4)
+
+    def test_token_budget_subtracts_overhead(self):
+        overhead = "the " * 100
+        self.assertEqual(token_budget("phi3", overhead, reserve=256), 4096 - 100 - 256)
+        self.assertEqual(token_budget("phi3:mini", reserve=0), 4096)
+        self.assertEqual(token_budget("unknown-model", reserve=0), 2048)
+
+    def test_token_budget_too_small(self):
+        with self.assertRaises(ValueError):
+            token_budget("phi3", "the " * 4000)
+
+    def test_chunks_fill_budget(self):
+        text = "one two three four five six seven"
+        result = list(iter_token_chunks(text, 3, count_tokens=self.count_words))
+        self.assertEqual(result, ["one two three", "four five six", "seven"])
+
+    def test_overlap(self):
+        text = "one two three four five six seven"
+        result = list(iter_token_chunks(text, 4, overlap=1, count_tokens=self.count_words))
+        self.assertEqual(result, ["one two three four", "four five six seven"])
+
+    def test_overlap_ends_without_duplicate_tail(self):
+        text = "one two three four five"
+        result = list(iter_token_chunks(text, 3, overlap=2, count_tokens=self.count_words))
+        self.assertEqual(result, ["one two three", "two three four", "three four five"])
+
+    def test_oversized_word_gets_own_chunk(self):
+        result = list(iter_token_chunks("a " + "x" * 40 + " b", 5))
+        self.assertEqual(result, ["a", "x" * 40, "b"])
+
+    def test_invalid_overlap(self):
+        with self.assertRaises(ValueError):
+            iter_token_chunks("text", 3, overlap=3)
+        with self.assertRaises(ValueError):
+            iter_token_chunks("text", 0)
+
+
+class TestCdcChunks(unittest.TestCase):
+
+    def setUp(self):
+        # Varied words, so the rolling hash sees realistic input
+        self.words = [f"word{i * 7919 % 1000}" for i in range(3000)]
+        self.text = " ".join(self.words)
+
+    def test_chunks_keep_words_within_size(self):
+        chunks = list(iter_cdc_chunks(self.text, 500))
+        self.assertEqual(" ".join(chunks), self.text)
+        self.assertTrue(all(len(chunk) <= 500 for chunk in chunks))
+        self.assertTrue(all(len(chunk) >= 125 for chunk in chunks[:-1]))
+
+    def test_boundaries_survive_an_edit(self):
+        before = list(iter_cdc_chunks(self.text, 500))
+        edited = " ".join(self.words[:1500] + ["inserted"] + self.words[1500:])
+        after = list(iter_cdc_chunks(edited, 500))
+        # Only the chunks around the insertion change
+        self.assertLessEqual(len(set(after) - set(before)), 2)
+        self.assertGreater(len(before), 20)
+
+    def test_hashes(self):
+        hashes = []
+        chunks = list(iter_hashed(["a", "b"], hashes))
+        self.assertEqual(chunks, ["a", "b"])
+        self.assertEqual(hashes, [chunk_hash("a"), chunk_hash("b")])
+        self.assertNotEqual(hashes[0], hashes[1])
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            iter_cdc_chunks(self.text, 0)
+        with self.assertRaises(ValueError):
+            iter_cdc_chunks(self.text, 100, window=0)
+
+
+class TestSpans(unittest.TestCase):
+
+    text = "  This is\ta simple   test case\n\nto check chunking functionality. "
+
+    def test_spans_match_text_chunks(self):
+        for chunker in (lambda source, **kw: iter_chunks(source, 10, **kw),
+                        lambda source, **kw: iter_cdc_chunks(source, 20, window=2, **kw),
+                        lambda source, **kw: iter_token_chunks(source, 3, overlap=1, **kw)):
+            spans = list(chunker(self.text, spans=True))
+            self.assertTrue(all(isinstance(span, Span) for span in spans))
+            self.assertEqual([span.text for span in spans], list(chunker(self.text)))
+
+    def test_offsets_point_into_source(self):
+        spans = list(iter_chunks(self.text, 10, spans=True))
+        self.assertEqual([(span.start, span.end) for span in spans[:2]], [(2, 11), (12, 18)])
+        self.assertEqual(spans[0].raw, "This is\ta")
+        self.assertEqual(str(spans[0]), "This is a")
+        self.assertIs(spans[0].source, self.text)
+
+    def test_overlapping_token_spans(self):
+        spans = list(iter_token_chunks("one two three four five", 3, overlap=1,
+                                       count_tokens=lambda word: 1, spans=True))
+        self.assertEqual([span.raw for span in spans], ["one two three", "three four five"])
+        self.assertLess(spans[1].start, spans[0].end)
+
+    def test_mmap_buffer_has_byte_offsets(self):
+        text = "caf\u00e9 au lait, caf\u00e9 noir"
+        with tempfile.TemporaryFile() as file:
+            file.write(text.encode("utf-8"))
+            file.flush()
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                spans = list(iter_chunks(mapped, 14, spans=True))
+                self.assertEqual([span.text for span in spans], chunk_prompt(text, 14))
+                self.assertEqual((spans[1].start, spans[1].end), (15, 25))
+                self.assertEqual(spans[1].raw, "caf\u00e9 noir")
+
+    def test_hashes_of_spans(self):
+        hashes = []
+        list(iter_hashed(iter_chunks(self.text, 10, spans=True), hashes))
+        self.assertEqual(hashes, [chunk_hash(chunk) for chunk in chunk_prompt(self.text, 10)])
+
+    def test_streams_have_no_spans(self):
+        with self.assertRaises(ValueError):
+            iter_chunks(io.StringIO(self.text), 10, spans=True)
+        with self.assertRaises(ValueError):
+            iter_chunks(pathlib.Path("feed.txt"), 10, spans=True)
+
+
+class patch_block_size:
+    """
+    Temporarily shrinks the read block size to exercise block boundaries.
+    """
+
+    def __init__(self, size):
+        self.size = size
+
+    def __enter__(self):
+        self.original = chunk_data.READ_BLOCK_SIZE
+        chunk_data.READ_BLOCK_SIZE = self.size
+
+    def __exit__(self, *exc):
+        chunk_data.READ_BLOCK_SIZE = self.original
+
+
 if __name__ == "__main__":
     unittest.main()
  
\ No newline at end of file
@@ -0,0 +1,144 @@
+"""
+    Unit tests for the chat_chunks function in the dispatch module.
+"""
+
+import asyncio
+import unittest
+import sys
+import os
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dispatch import chat_chunks, dispatch_chunks
+
+
+class FakeClient:
+    """
+    Records how many chat calls are in flight at once.
+    """
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.in_flight = 0
+        self.peak = 0
+        self.calls = 0
+
+    async def chat(self, model, messages):
+        self.calls += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        return {'message': {'content': messages[0]['content'].upper()}}
+
+
+def build_messages(chunk):
+    return [{'role': 'user', 'content': chunk}]
+
+
+class TestChatChunks(unittest.TestCase):
+
+    def test_results_in_chunk_order(self):
+        client = FakeClient()
+        result = asyncio.run(chat_chunks(client, ["a", "b", "c"], build_messages))
+        self.assertEqual(result, ["A", "B", "C"])
+
+    def test_concurrency_limit(self):
+        client = FakeClient()
+        chunks = [str(i) for i in range(10)]
+        asyncio.run(chat_chunks(client, chunks, build_messages, concurrency=3))
+        self.assertEqual(client.calls, 10)
+        self.assertEqual(client.peak, 3)
+
+    def test_no_chunks(self):
+        client = FakeClient()
+        result = asyncio.run(chat_chunks(client, [], build_messages))
+        self.assertEqual(result, [])
+        self.assertEqual(client.calls, 0)
+
+    def test_invalid_concurrency(self):
+        with self.assertRaises(ValueError):
+            asyncio.run(chat_chunks(FakeClient(), ["a"], build_messages, concurrency=0))
+
+    def test_error_propagates(self):
+        class FailingClient:
+            async def chat(self, model, messages):
+                raise RuntimeError("API Error")
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(chat_chunks(FailingClient(), ["a", "b"], build_messages))
+
+    def test_error_cancels_in_flight_chunks(self):
+        cancelled = []
+        finished = []
+
+        class FailingClient:
+            async def chat(self, model, messages):
+                if messages[0]['content'] == "bad":
+                    raise RuntimeError("API Error")
+                try:
+                    await asyncio.sleep(1)
+                except asyncio.CancelledError:
+                    cancelled.append(messages[0]['content'])
+                    raise
+                finished.append(messages[0]['content'])
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(chat_chunks(FailingClient(), ["a", "bad", "c"], build_messages))
+        self.assertEqual(cancelled, ["a"])
+        self.assertEqual(finished, [])
+
+    def test_stop_when(self):
+        client = FakeClient()
+        chunks = iter(["a", "stop", "c", "d", "e"])
+        results = asyncio.run(dispatch_chunks(
+            client, chunks, build_messages, concurrency=1,
+            stop_when=lambda result: result.response == "STOP"))
+        self.assertEqual([r.response for r in results], ["A", "STOP"])
+        self.assertEqual([r.index for r in results], [0, 1])
+        self.assertEqual(next(chunks), "c")  # Nothing read past the stop
+
+    def test_screen_and_tiers(self):
+        client = FakeClient()
+        results = asyncio.run(dispatch_chunks(
+            client, ["a", "b"], build_messages,
+            screen=lambda chunk: "screened" if chunk == "a" else None))
+        self.assertEqual([(r.response, r.tier) for r in results],
+                         [("screened", "prefilter"), ("B", "llm")])
+        self.assertEqual(client.calls, 1)
+
+    def test_reuse_comes_first(self):
+        client = FakeClient()
+        results = asyncio.run(dispatch_chunks(
+            client, ["a", "b"], build_messages,
+            reuse=lambda chunk: "earlier" if chunk == "a" else None,
+            screen=lambda chunk: "screened"))
+        self.assertEqual([(r.response, r.tier) for r in results],
+                         [("earlier", "reused"), ("screened", "prefilter")])
+
+    def test_timings_and_model_statistics(self):
+        class StatsClient(FakeClient):
+            async def chat(self, model, messages):
+                response = await super().chat(model, messages)
+                response.update(prompt_eval_count=12, eval_count=3,
+                                prompt_eval_duration=4_000_000, eval_duration=9_000_000)
+                return response
+
+        results = asyncio.run(dispatch_chunks(
+            StatsClient(delay=0.02), ["a", "b", "c"], build_messages, concurrency=2,
+            screen=lambda chunk: "screened" if chunk == "c" else None))
+
+        llm = results[0]
+        self.assertEqual((llm.prompt_eval_count, llm.eval_count), (12, 3))
+        self.assertAlmostEqual(llm.prompt_eval_duration, 0.004)
+        self.assertAlmostEqual(llm.eval_duration, 0.009)
+        self.assertIsNone(llm.total_duration)
+        self.assertGreaterEqual(llm.wall_time, 0.02)
+        # The third chunk waited for one of the two slots to free up
+        self.assertGreaterEqual(results[2].queue_wait, 0.015)
+        self.assertIsNone(results[2].eval_count)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+    Unit tests for the logging setup in the log module.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import unittest
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from log import JsonFormatter, configure_logging, correlation, correlation_id, stop_logging
+
+
+class TestCorrelation(unittest.TestCase):
+
+    def test_new_id_is_set_and_reset(self):
+        with correlation() as value:
+            self.assertEqual(correlation_id.get(), value)
+            self.assertEqual(len(value), 32)
+        self.assertIsNone(correlation_id.get())
+
+    def test_outer_id_is_kept(self):
+        with correlation("job-1"):
+            with correlation() as inner:
+                self.assertEqual(inner, "job-1")
+            with correlation("doc-2") as explicit:
+                self.assertEqual(explicit, "doc-2")
+
+    def test_tasks_inherit_id(self):
+        async def scenario():
+            async def read():
+                return correlation_id.get()
+            with correlation("doc-3"):
+                return await asyncio.gather(asyncio.ensure_future(read()), read())
+
+        self.assertEqual(asyncio.run(scenario()), ["doc-3", "doc-3"])
+
+
+class TestJsonFormatter(unittest.TestCase):
+
+    def test_format(self):
+        record = logging.makeLogRecord({
+            "name": "dispatch", "levelname": "INFO", "msg": "chunk %d",
+            "args": (3,), "correlation_id": "abc", "chunk_size": 1000})
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "chunk 3")
+        self.assertEqual(entry["logger"], "dispatch")
+        self.assertEqual(entry["correlation_id"], "abc")
+        self.assertEqual(entry["chunk_size"], 1000)
+        self.assertIn("ts", entry)
+
+
+class TestConfigureLogging(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger("test_log")
+        self.addCleanup(stop_logging)
+        self.addCleanup(lambda: self.logger.handlers.clear())
+
+    def test_records_reach_the_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "nested", "agents.log")
+            configure_logging("debug", path, logger=self.logger)
+            with correlation("doc-1"):
+                self.logger.info("hello")
+            self.logger.debug("outside")
+            stop_logging()
+
+            with open(path, encoding="utf-8") as file:
+                entries = [json.loads(line) for line in file]
+
+        self.assertEqual([(e["message"], e["correlation_id"]) for e in entries],
+                         [("hello", "doc-1"), ("outside", None)])
+
+    def test_level_filters_records(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "agents.log")
+            configure_logging("WARNING", path, logger=self.logger)
+            self.logger.info("dropped")
+            self.logger.warning("kept")
+            stop_logging()
+
+            with open(path, encoding="utf-8") as file:
+                messages = [json.loads(line)["message"] for line in file]
+
+        self.assertEqual(messages, ["kept"])
+
+    def test_reconfiguring_replaces_the_handler(self):
+        configure_logging(logger=self.logger)
+        configure_logging(logger=self.logger)
+        self.assertEqual(len(self.logger.handlers), 1)
+
+    def test_unknown_level(self):
+        with self.assertRaises(ValueError):
+            configure_logging("chatty", logger=self.logger)
+
+
+if __name__ == '__main__':
+    unittest.main()
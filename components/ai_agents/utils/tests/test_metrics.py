@@ -0,0 +1,108 @@
+"""
+    Unit tests for the InMemoryMetrics class in the metrics module.
+"""
+
+import os
+import sys
+import unittest
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dispatch import ChunkResult
+from metrics import InMemoryMetrics, MetricsSink
+
+
+def llm_result(index, wall_time, eval_count=4, eval_duration=0.2):
+    result = ChunkResult(index, "No", 'llm', queue_wait=0.001, wall_time=wall_time)
+    result.record_response({'prompt_eval_count': 100, 'eval_count': eval_count,
+                            'prompt_eval_duration': 50_000_000,
+                            'eval_duration': int(eval_duration * 1e9)})
+    return result
+
+
+class TestInMemoryMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = InMemoryMetrics(buckets=(0.1, 1.0), window=4)
+        self.metrics.record_run("guard", [llm_result(0, 0.3), llm_result(1, 0.5),
+                                          ChunkResult(2, "No", 'cache')], 0.9)
+
+    def test_summary(self):
+        summary = self.metrics.summary()["guard"]
+        self.assertEqual(summary["documents"], 1)
+        self.assertEqual(summary["chunks"], {"cache": 1, "llm": 2})
+        self.assertEqual(summary["prompt_tokens"], 200)
+        self.assertEqual(summary["eval_tokens"], 8)
+        self.assertAlmostEqual(summary["eval_tokens_per_second"], 20.0)
+        self.assertEqual(summary["timings"]["chunk_eval_seconds"]["count"], 2)
+        self.assertEqual(summary["timings"]["chunk_seconds"]["p99"], 0.5)
+        self.assertEqual(summary["timings"]["document_seconds"]["mean"], 0.9)
+
+    def test_percentile_window(self):
+        for index in range(10):
+            self.metrics.record_chunk("guard", llm_result(index, 2.0))
+        timing = self.metrics.summary()["guard"]["timings"]["chunk_seconds"]
+        self.assertEqual(timing["count"], 13)
+        self.assertEqual(timing["p50"], 2.0)
+
+    def test_prometheus(self):
+        text = self.metrics.prometheus({"queue_depth": 3})
+        self.assertIn("# TYPE ai_agents_chunk_seconds histogram", text)
+        self.assertIn('ai_agents_chunks_total{agent="guard",tier="llm"} 2', text)
+        self.assertIn('ai_agents_chunk_seconds_bucket{agent="guard",le="0.1"} 1', text)
+        self.assertIn('ai_agents_chunk_seconds_bucket{agent="guard",le="1.0"} 3', text)
+        self.assertIn('ai_agents_chunk_seconds_bucket{agent="guard",le="+Inf"} 3', text)
+        self.assertIn('ai_agents_chunk_seconds_count{agent="guard"} 3', text)
+        self.assertIn("ai_agents_queue_depth 3", text)
+        self.assertTrue(text.endswith("\n"))
+
+    def test_prompt_reuse(self):
+        def result(estimated, evaluated, seconds):
+            result = ChunkResult(0, "No", 'llm')
+            result.record_response({'prompt_eval_count': evaluated,
+                                    'prompt_eval_duration': int(seconds * 1e9)})
+            result.prompt_tokens, result.preamble, result.preamble_tokens = \
+                estimated, 1, 120
+            return result
+
+        # The first request pays for the whole prompt: 100 real tokens for
+        # 160 estimated ones, so the 120-token preamble is really 75
+        self.metrics.record_chunk("guard", result(160, 100, 0.05))
+        # A cached preamble leaves only the chunk to evaluate
+        self.metrics.record_chunk("guard", result(160, 25, 0.01))
+        # A request that paid for its preamble again saved nothing
+        self.metrics.record_chunk("guard", result(150, 95, 0.05))
+
+        summary = self.metrics.summary()["guard"]
+        self.assertEqual(summary["prompt_tokens_reused"], 75)
+        self.assertAlmostEqual(summary["prompt_eval_seconds_saved"], 0.03)
+        self.assertIn('ai_agents_prompt_tokens_reused_total{agent="guard"} 75.0',
+                      self.metrics.prometheus())
+
+    def test_no_prompt_reuse_without_cache(self):
+        # The estimate overcounts every prompt; without a prompt cache, that
+        # must not read as reuse
+        for evaluated in (170, 160, 180):
+            result = ChunkResult(0, "No", 'llm')
+            result.record_response({'prompt_eval_count': evaluated})
+            result.prompt_tokens, result.preamble, result.preamble_tokens = 272, 1, 200
+            self.metrics.record_chunk("guard", result)
+        self.assertEqual(self.metrics.summary()["guard"]["prompt_tokens_reused"], 0)
+
+    def test_label_escaping(self):
+        self.metrics.record_document('say "hi"\n', 0.1, 0)
+        self.assertIn('agent="say \\"hi\\"\\n"', self.metrics.prometheus())
+
+    def test_base_sink_discards(self):
+        MetricsSink().record_run("guard", [llm_result(0, 0.1)], 0.1)
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            InMemoryMetrics(buckets=())
+        with self.assertRaises(ValueError):
+            InMemoryMetrics(window=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+"""
+    Unit tests for the NearDuplicateIndex class in the near_duplicate module.
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from contextlib import closing
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dispatch import dispatch_chunks
+from near_duplicate import NearDuplicateIndex, minhash, shingles, signatures, similarity
+
+ARTICLE = ("The city council approved a new budget for public libraries on "
+           "Tuesday, adding funds for longer opening hours, a mobile library "
+           "service and a programme teaching older residents to use computers.")
+REPOST = ("The city council approved a new budget for public libraries on "
+          "Tuesday -- adding funds for longer opening hours, a mobile library "
+          "service and a programme teaching older residents to use computers!")
+OTHER = ("Researchers found that migrating birds use the Earth's magnetic field "
+         "to navigate, with proteins in their eyes sensing its direction during "
+         "long flights across the ocean.")
+
+
+class CountingClient:
+
+    def __init__(self):
+        self.calls = 0
+
+    async def chat(self, model, messages, **kwargs):
+        self.calls += 1
+        return {'message': {'content': f"verdict {self.calls}"}}
+
+
+def build_messages(chunk):
+    return [{'role': 'user', 'content': chunk}]
+
+
+class TestNearDuplicateIndex(unittest.TestCase):
+
+    def test_shingles_ignore_case_and_punctuation(self):
+        self.assertEqual(shingles("Hello, World  again!"), shingles("hello world again"))
+        self.assertEqual(len(shingles("two words")), 1)
+        self.assertEqual(shingles("  ...  "), set())
+        self.assertIsNone(minhash("!!!"))
+
+    def test_similarity(self):
+        self.assertEqual(similarity(minhash(ARTICLE), minhash(REPOST)), 1.0)
+        self.assertLess(similarity(minhash(ARTICLE), minhash(OTHER)), 0.2)
+
+    def test_near_duplicate_reuses_verdict(self):
+        index = NearDuplicateIndex(threshold=0.8)
+        index.add("guard", ARTICLE, "No, no forbidden content found.")
+
+        self.assertEqual(index.get("guard", REPOST), "No, no forbidden content found.")
+        self.assertIsNone(index.get("guard", OTHER))
+        self.assertEqual(index.stats(), {"hits": 1, "misses": 1, "evictions": 0, "entries": 1})
+
+    def test_edited_text_below_threshold(self):
+        index = NearDuplicateIndex(threshold=0.95)
+        index.add("guard", ARTICLE, "clean")
+        edited = ARTICLE.replace("longer opening hours", "shorter opening hours and fewer staff")
+        self.assertIsNone(index.get("guard", edited))
+
+    def test_namespaces_are_separate(self):
+        index = NearDuplicateIndex()
+        index.scope("guard").add(ARTICLE, "clean")
+        self.assertIsNone(index.scope("tags").get(ARTICLE))
+        self.assertEqual(index.scope("guard").get(ARTICLE), "clean")
+
+    def test_least_recently_used_evicted(self):
+        index = NearDuplicateIndex(max_entries=2)
+        index.add("guard", ARTICLE, "a")
+        index.add("guard", OTHER, "b")
+        index.get("guard", ARTICLE)
+        index.add("guard", "An entirely different text about cooking pasta at home.", "c")
+
+        self.assertEqual(index.get("guard", ARTICLE), "a")
+        self.assertIsNone(index.get("guard", OTHER))
+        self.assertEqual(index.stats()["evictions"], 1)
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "near_duplicates.sqlite")
+            index = NearDuplicateIndex(path=path)
+            index.add("guard", ARTICLE, "clean")
+            index.close()
+
+            reopened = NearDuplicateIndex(path=path)
+            self.assertEqual(reopened.get("guard", REPOST), "clean")
+            reopened.close()
+
+            # Signatures made with other hash functions are not comparable
+            reseeded = NearDuplicateIndex(path=path, seed=1)
+            self.assertIsNone(reseeded.get("guard", REPOST))
+            reseeded.close()
+
+    def test_batches_in_process_pool(self):
+        texts = [ARTICLE, OTHER, "", REPOST]
+        self.assertEqual(signatures(texts, processes=2, pool_min=1), signatures(texts))
+
+        index = NearDuplicateIndex(processes=2, pool_min=1)
+        index.add_many("guard", [ARTICLE, OTHER], ["clean", "flagged"])
+        self.assertEqual(index.get_many("guard", [REPOST, OTHER, "Nothing alike here."]),
+                         ["clean", "flagged", None])
+        with self.assertRaises(ValueError):
+            index.add_many("guard", [ARTICLE], [])
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            NearDuplicateIndex(threshold=0)
+        with self.assertRaises(ValueError):
+            NearDuplicateIndex(num_perm=100, bands=16)
+        with self.assertRaises(ValueError):
+            NearDuplicateIndex(max_entries=0)
+
+    def test_dispatch_reuses_near_duplicate_verdicts(self):
+        client = CountingClient()
+        scope = NearDuplicateIndex().scope("guard")
+
+        results = asyncio.run(dispatch_chunks(
+            client, [ARTICLE, OTHER], build_messages, model='large', concurrency=1,
+            near_duplicates=scope))
+        again = asyncio.run(dispatch_chunks(
+            client, [REPOST], build_messages, model='large', near_duplicates=scope))
+
+        self.assertEqual([r.tier for r in results], ['llm', 'llm'])
+        self.assertEqual(again[0].tier, 'near_duplicate')
+        self.assertEqual(again[0].response, results[0].response)
+        self.assertEqual(client.calls, 2)
+
+
+    def test_dispatch_signs_each_chunk_once(self):
+        index = NearDuplicateIndex()
+        signed = []
+        sign = index.sign
+        index.sign = lambda text: signed.append(text) or sign(text)
+
+        asyncio.run(dispatch_chunks(CountingClient(), [ARTICLE, OTHER], build_messages,
+                                    near_duplicates=index.scope("guard")))
+        self.assertEqual(sorted(signed), sorted([ARTICLE, OTHER]))
+        self.assertEqual(index.get("guard", REPOST), "verdict 1")
+
+    def test_sqlite_writes_are_batched(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "near_duplicates.sqlite")
+            index = NearDuplicateIndex(path=path, flush_every=3)
+
+            def committed():
+                with closing(sqlite3.connect(path)) as db:
+                    return db.execute("SELECT COUNT(*) FROM near_duplicates").fetchone()[0]
+
+            index.add("guard", ARTICLE, "clean")
+            index.get("guard", REPOST)
+            # Nothing is committed below flush_every writes
+            self.assertEqual(committed(), 0)
+            index.add("guard", OTHER, "flagged")
+            self.assertEqual(committed(), 2)
+            index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
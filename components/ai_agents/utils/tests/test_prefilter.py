@@ -0,0 +1,85 @@
+"""
+    Unit tests for the AhoCorasick and LexicalPrefilter classes in the
+    prefilter module.
+"""
+
+import unittest
+import sys
+import os
+
+# Add the ai_agents directory to the sys.path so utils is importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from utils.prefilter import CLEAN, FLAGGED, NEEDS_LLM, AhoCorasick, LexicalPrefilter
+
+
+class TestAhoCorasick(unittest.TestCase):
+
+    def test_overlapping_patterns(self):
+        automaton = AhoCorasick(["he", "she", "hers", "his"])
+        matches = [m[2] for m in automaton.iter_matches("ushers")]
+        # Only whole words count, and "ushers" contains none of them
+        self.assertEqual(matches, [])
+        matches = sorted(m[2] for m in AhoCorasick(["she", "she sells"]).iter_matches(
+            "She sells shells"))
+        self.assertEqual(matches, ["she", "she sells"])
+
+    def test_offsets_and_case(self):
+        automaton = AhoCorasick(["buy cocaine"])
+        self.assertEqual(list(automaton.iter_matches("Where to BUY COCAINE?")),
+                         [(9, 20, "buy cocaine")])
+
+    def test_offsets_survive_case_folding(self):
+        # "İ" and "ß" fold to two characters each
+        text = "İİ: buy cocaine, Große Menge"
+        automaton = AhoCorasick(["buy cocaine", "grosse menge"])
+        matches = list(automaton.iter_matches(text))
+        self.assertEqual([text[start:end] for start, end, _ in matches],
+                         ["buy cocaine", "Große Menge"])
+
+    def test_suffix_patterns_found_through_fail_links(self):
+        automaton = AhoCorasick(["abcd", "bc"])
+        self.assertEqual([m[2] for m in automaton.iter_matches("a bc d")], ["bc"])
+
+    def test_empty_pattern(self):
+        with self.assertRaises(ValueError):
+            AhoCorasick([" "])
+
+
+class TestLexicalPrefilter(unittest.TestCase):
+
+    def setUp(self):
+        self.lexicons = {
+            "Drug-related content": ["buy cocaine"],
+            "Hate speech": ["white power"],
+        }
+
+    def test_flagged(self):
+        prefilter = LexicalPrefilter(self.lexicons)
+        decision, categories = prefilter.classify("White power rally, buy cocaine here")
+        self.assertEqual(decision, FLAGGED)
+        self.assertEqual(categories, ["Drug-related content", "Hate speech"])
+        self.assertEqual(prefilter.screen("buy cocaine"), "Yes: Drug-related content")
+
+    def test_unmatched_goes_to_llm_by_default(self):
+        prefilter = LexicalPrefilter(self.lexicons)
+        self.assertEqual(prefilter.classify("A recipe for bread")[0], NEEDS_LLM)
+        self.assertIsNone(prefilter.screen("A recipe for bread"))
+
+    def test_clean_on_no_match(self):
+        prefilter = LexicalPrefilter(self.lexicons, watchlist=["overdose"],
+                                     clean_on_no_match=True)
+        self.assertEqual(prefilter.classify("A recipe for bread")[0], CLEAN)
+        self.assertEqual(prefilter.screen("A recipe for bread"),
+                         "No, no forbidden content found.")
+        # Watchlist phrases still go to the model
+        self.assertEqual(prefilter.classify("Signs of an overdose")[0], NEEDS_LLM)
+
+    def test_default_lexicons(self):
+        prefilter = LexicalPrefilter()
+        self.assertEqual(prefilter.classify("tips on how to commit suicide")[1],
+                         ["Promotion of self-harm or suicide"])
+
+
+if __name__ == "__main__":
+    unittest.main()
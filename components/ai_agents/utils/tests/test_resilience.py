@@ -0,0 +1,201 @@
+"""
+    Unit tests for the retry policy and circuit breaker in the resilience
+    module, and for deadlines and partial results in dispatch_chunks.
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+import httpx
+import ollama
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dispatch import dispatch_chunks
+from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, is_transient
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ScriptedClient:
+    """
+    Answers each chunk from a list of outcomes: an exception to raise, a
+    number of seconds to hang, or a reply.
+    """
+
+    def __init__(self, script):
+        self.script = {chunk: list(outcomes) for chunk, outcomes in script.items()}
+        self.calls = []
+
+    async def chat(self, model, messages, **kwargs):
+        chunk = messages[0]['content']
+        self.calls.append(chunk)
+        outcomes = self.script.get(chunk)
+        outcome = outcomes.pop(0) if outcomes else f"ok {chunk}"
+        if isinstance(outcome, BaseException):
+            raise outcome
+        if isinstance(outcome, (int, float)):
+            await asyncio.sleep(outcome)
+            outcome = f"slow {chunk}"
+        return {'message': {'content': outcome}}
+
+
+def build_messages(chunk):
+    return [{'role': 'user', 'content': chunk}]
+
+
+def no_delay():
+    return RetryPolicy(attempts=3, base_delay=0, max_delay=0)
+
+
+class TestIsTransient(unittest.TestCase):
+
+    def test_classification(self):
+        self.assertTrue(is_transient(asyncio.TimeoutError()))
+        self.assertTrue(is_transient(ConnectionRefusedError()))
+        self.assertTrue(is_transient(httpx.ReadError("reset")))
+        self.assertTrue(is_transient(ollama.ResponseError("overloaded", 503)))
+        self.assertTrue(is_transient(ollama.ResponseError("slow down", 429)))
+        self.assertFalse(is_transient(ollama.ResponseError("model not found", 404)))
+        self.assertFalse(is_transient(ValueError("bad")))
+        self.assertFalse(is_transient(CircuitOpenError("open")))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_half_opens_and_closes(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_seconds=10, clock=clock)
+        for _ in range(2):
+            breaker.record_failure(breaker.before_call())
+        self.assertEqual(breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+        clock.now = 10
+        self.assertEqual(breaker.state, 'half_open')
+        trial = breaker.before_call()
+        self.assertTrue(trial)
+        # Only one trial at a time
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_success(trial)
+
+        self.assertEqual(breaker.state, 'closed')
+        self.assertEqual(breaker.stats(),
+                         {"state": "closed", "failures": 0, "opens": 1, "rejected": 2})
+
+    def test_failed_trial_reopens(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=5, clock=clock)
+        breaker.record_failure(breaker.before_call())
+        clock.now = 5
+        breaker.record_failure(breaker.before_call())
+        self.assertEqual(breaker.state, 'open')
+        self.assertEqual(breaker.opens, 2)
+
+    def test_only_transient_errors_count(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+
+        async def refused():
+            raise ollama.ResponseError("model not found", 404)
+
+        with self.assertRaises(ollama.ResponseError):
+            asyncio.run(breaker.call(refused))
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            CircuitBreaker(failure_threshold=0)
+        with self.assertRaises(ValueError):
+            CircuitBreaker(reset_seconds=-1)
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_delay_is_capped_full_jitter(self):
+        policy = RetryPolicy(base_delay=1, max_delay=4)
+        for retry in range(6):
+            self.assertLessEqual(policy.delay(retry), min(4, 2 ** retry))
+            self.assertGreaterEqual(policy.delay(retry), 0)
+
+    def test_retries_transient_errors(self):
+        client = ScriptedClient({"a": [ollama.ResponseError("busy", 503), "fine"]})
+        results = asyncio.run(dispatch_chunks(client, ["a"], build_messages,
+                                              retry=no_delay()))
+        self.assertEqual(results[0].response, "fine")
+        self.assertEqual(client.calls, ["a", "a"])
+
+    def test_does_not_retry_other_errors(self):
+        client = ScriptedClient({"a": [ollama.ResponseError("model not found", 404)]})
+        with self.assertRaises(ollama.ResponseError):
+            asyncio.run(dispatch_chunks(client, ["a"], build_messages, retry=no_delay()))
+        self.assertEqual(client.calls, ["a"])
+
+    def test_slow_attempt_is_cut_off_and_retried(self):
+        client = ScriptedClient({"a": [5, "fine"]})
+        policy = RetryPolicy(attempts=2, timeout=0.05, base_delay=0, max_delay=0)
+        results = asyncio.run(dispatch_chunks(client, ["a"], build_messages, retry=policy))
+        self.assertEqual(results[0].response, "fine")
+
+    def test_breaker_stops_retries(self):
+        client = ScriptedClient({"a": [ConnectionError("down")] * 5})
+        breaker = CircuitBreaker(failure_threshold=2)
+        with self.assertRaises(CircuitOpenError):
+            asyncio.run(dispatch_chunks(client, ["a"], build_messages,
+                                        retry=RetryPolicy(attempts=5, base_delay=0,
+                                                          max_delay=0),
+                                        breaker=breaker))
+        self.assertEqual(len(client.calls), 2)
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            RetryPolicy(attempts=0)
+        with self.assertRaises(ValueError):
+            RetryPolicy(timeout=0)
+        with self.assertRaises(ValueError):
+            RetryPolicy(base_delay=2, max_delay=1)
+
+
+class TestPartialResults(unittest.TestCase):
+
+    def test_failed_chunks_are_marked(self):
+        client = ScriptedClient({"b": [ollama.ResponseError("model not found", 404)]})
+        results = asyncio.run(dispatch_chunks(client, ["a", "b", "c"], build_messages,
+                                              partial=True))
+        self.assertEqual([r.tier for r in results], ['llm', 'failed', 'llm'])
+        self.assertIsNone(results[1].response)
+        self.assertIn("model not found", results[1].error)
+
+    def test_deadline_raises_without_partial(self):
+        client = ScriptedClient({"b": [5]})
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(dispatch_chunks(client, ["a", "b"], build_messages, deadline=0.05))
+
+    def test_deadline_marks_unfinished_chunks(self):
+        client = ScriptedClient({"b": [5]})
+        results = asyncio.run(dispatch_chunks(client, ["a", "b", "c", "d"], build_messages,
+                                              concurrency=1, deadline=0.05, partial=True))
+        self.assertEqual([r.index for r in results], [0, 1, 2, 3])
+        self.assertEqual(results[0].response, "ok a")
+        # b was cut off; c and d were never sent
+        self.assertEqual([r.tier for r in results[1:]], ['timeout'] * 3)
+        self.assertEqual(client.calls, ["a", "b"])
+
+    def test_invalid_deadline(self):
+        with self.assertRaises(ValueError):
+            asyncio.run(dispatch_chunks(ScriptedClient({}), ["a"], build_messages, deadline=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
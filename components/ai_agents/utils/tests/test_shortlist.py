@@ -0,0 +1,88 @@
+"""
+    Unit tests for the CareerShortlist class in the shortlist module.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import shortlist
+from shortlist import CareerShortlist
+
+CAREERS = ["Backend Developer", "Frontend Developer", "Database Administrator",
+           "Data Scientist", "Nurse", "Chef"]
+
+# Toy embedding space: backend, frontend, data, health, food
+VECTORS = {
+    "Backend Developer": [1, 0, 0.3, 0, 0],
+    "Frontend Developer": [0.2, 1, 0, 0, 0],
+    "Database Administrator": [0.6, 0, 1, 0, 0],
+    "Data Scientist": [0, 0, 1, 0.1, 0],
+    "Nurse": [0, 0, 0, 1, 0],
+    "Chef": [0, 0, 0, 0, 1],
+    "APIs and SQL databases": [1, 0, 1, 0, 0],
+}
+
+
+class FakeClient:
+
+    def __init__(self):
+        self.calls = []
+
+    async def embed(self, model, input):
+        self.calls.append(input)
+        texts = [input] if isinstance(input, str) else input
+        return {'embeddings': [VECTORS[text] for text in texts]}
+
+
+@unittest.skipIf(shortlist.np is None, "numpy is not installed")
+class TestCareerShortlist(unittest.TestCase):
+
+    def test_select_top_k_in_list_order(self):
+        client = FakeClient()
+        careers = CareerShortlist(CAREERS, top_k=2)
+        result = asyncio.run(careers.select(client, "APIs and SQL databases"))
+        self.assertEqual(result, ["Backend Developer", "Database Administrator"])
+
+    def test_titles_embedded_once(self):
+        client = FakeClient()
+        careers = CareerShortlist(CAREERS, top_k=2)
+
+        async def scenario():
+            await careers.select(client, "APIs and SQL databases")
+            await careers.select(client, "APIs and SQL databases")
+
+        asyncio.run(scenario())
+        self.assertEqual(client.calls.count(CAREERS), 1)
+        self.assertEqual(len(client.calls), 3)
+
+    def test_small_list_skips_embeddings(self):
+        client = FakeClient()
+        careers = CareerShortlist(CAREERS, top_k=10)
+        self.assertEqual(asyncio.run(careers.select(client, "anything")), CAREERS)
+        self.assertEqual(client.calls, [])
+
+    def test_matrix_cached_on_disk(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            asyncio.run(CareerShortlist(CAREERS, top_k=2, cache_dir=tmp).load(FakeClient()))
+            self.assertTrue(os.path.exists(CareerShortlist(CAREERS, cache_dir=tmp).cache_path))
+
+            client = FakeClient()
+            careers = CareerShortlist(CAREERS, top_k=2, cache_dir=tmp)
+            asyncio.run(careers.select(client, "APIs and SQL databases"))
+            self.assertEqual(client.calls, ["APIs and SQL databases"])
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            CareerShortlist([])
+        with self.assertRaises(ValueError):
+            CareerShortlist(CAREERS, top_k=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+"""
+    Unit tests for the Singleflight class in the singleflight module.
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+
+# Add the ai_agents directory to the sys.path so utils is importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from utils.dispatch import dispatch_chunks
+from utils.metrics import InMemoryMetrics
+from utils.singleflight import Singleflight, make_key
+
+
+class FakeClient:
+    """
+    Answers chat calls after a delay, counting the calls it receives.
+    """
+
+    def __init__(self, delay=0.02, error=None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def chat(self, model, messages, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {'message': {'content': messages[0]['content'].upper()},
+                'prompt_eval_count': 10, 'eval_count': 2}
+
+
+def build_messages(chunk):
+    return [{'role': 'user', 'content': chunk}]
+
+
+class TestSingleflight(unittest.TestCase):
+
+    def test_concurrent_callers_share_one_call(self):
+        client = FakeClient()
+        flights = Singleflight()
+
+        async def scenario():
+            call = lambda: client.chat('phi3', build_messages("wire copy"))
+            return await asyncio.gather(*(flights.do("key", call) for _ in range(5)))
+
+        outcomes = asyncio.run(scenario())
+        self.assertEqual(client.calls, 1)
+        self.assertEqual([shared for _, shared in outcomes], [False] + [True] * 4)
+        self.assertTrue(all(reply['message']['content'] == "WIRE COPY"
+                            for reply, _ in outcomes))
+        self.assertEqual(flights.stats(), {"calls": 1, "hits": 4, "in_flight": 0})
+
+    def test_finished_calls_are_not_reused(self):
+        client = FakeClient(delay=0)
+        flights = Singleflight()
+
+        async def scenario():
+            call = lambda: client.chat('phi3', build_messages("a"))
+            await flights.do("key", call)
+            await flights.do("key", call)
+
+        asyncio.run(scenario())
+        self.assertEqual(client.calls, 2)
+
+    def test_errors_reach_every_caller(self):
+        client = FakeClient(error=ConnectionError("down"))
+        flights = Singleflight()
+
+        async def scenario():
+            call = lambda: client.chat('phi3', build_messages("a"))
+            return await asyncio.gather(*(flights.do("key", call) for _ in range(3)),
+                                        return_exceptions=True)
+
+        outcomes = asyncio.run(scenario())
+        self.assertEqual(client.calls, 1)
+        self.assertTrue(all(isinstance(outcome, ConnectionError) for outcome in outcomes))
+
+    def test_call_survives_while_someone_waits(self):
+        client = FakeClient(delay=0.05)
+        flights = Singleflight()
+
+        async def scenario():
+            call = lambda: client.chat('phi3', build_messages("a"))
+            leader = asyncio.ensure_future(flights.do("key", call))
+            follower = asyncio.ensure_future(flights.do("key", call))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await follower
+
+        reply, shared = asyncio.run(scenario())
+        self.assertEqual(reply['message']['content'], "A")
+        self.assertTrue(shared)
+        self.assertEqual(client.calls, 1)
+
+    def test_call_cancelled_when_nobody_waits(self):
+        client = FakeClient(delay=0.05)
+        flights = Singleflight()
+
+        async def scenario():
+            call = lambda: client.chat('phi3', build_messages("a"))
+            caller = asyncio.ensure_future(flights.do("key", call))
+            await asyncio.sleep(0.01)
+            caller.cancel()
+            await asyncio.gather(caller, return_exceptions=True)
+            return flights.stats()["in_flight"]
+
+        self.assertEqual(asyncio.run(scenario()), 0)
+
+    def test_key_covers_settings(self):
+        messages = build_messages("a")
+        self.assertEqual(make_key('phi3', messages), make_key('phi3', messages))
+        self.assertNotEqual(make_key('phi3', messages), make_key('phi3', messages, format='json'))
+        self.assertNotEqual(make_key('phi3', messages, options={'num_predict': 8}),
+                            make_key('phi3', messages, options={'num_predict': 16}))
+
+    def test_dispatch_coalesces_across_documents(self):
+        client = FakeClient()
+        flights = Singleflight()
+        metrics = InMemoryMetrics()
+
+        async def scenario():
+            return await asyncio.gather(*(
+                dispatch_chunks(client, ["press release", f"item {n}"], build_messages,
+                                singleflight=flights)
+                for n in range(4)))
+
+        runs = asyncio.run(scenario())
+        self.assertEqual(client.calls, 5)
+        tiers = sorted(run[0].tier for run in runs)
+        self.assertEqual(tiers, ['coalesced'] * 3 + ['llm'])
+        for run in runs:
+            self.assertEqual(run[0].response, "PRESS RELEASE")
+            metrics.record_run('content_guard', run, 0.1)
+
+        coalesced = [run[0] for run in runs if run[0].tier == 'coalesced']
+        self.assertTrue(all(result.eval_count is None for result in coalesced))
+        self.assertEqual(metrics.summary()['content_guard']['chunks'],
+                         {'coalesced': 3, 'llm': 5})
+        self.assertIn('tier="coalesced"} 3', metrics.prometheus())
+
+
+if __name__ == '__main__':
+    unittest.main()
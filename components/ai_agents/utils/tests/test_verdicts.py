@@ -0,0 +1,101 @@
+"""
+    Unit tests for reading the agents' replies in the verdicts module.
+"""
+
+import os
+import sys
+import unittest
+
+# Add the parent directory to the sys.path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from verdicts import ChunkFailure, DocumentModeration, DocumentTags, ModerationVerdict, TagVerdict
+
+
+class TestModerationVerdict(unittest.TestCase):
+
+    def test_json_reply(self):
+        verdict = ModerationVerdict.from_reply(0, '{"forbidden": ["Hate speech", " "]}')
+        self.assertTrue(verdict.flagged)
+        self.assertEqual(verdict.categories, {"Hate speech"})
+
+    def test_text_replies(self):
+        flagged = ModerationVerdict.from_reply(0, "Yes: Pornographic material, Hate speech.")
+        self.assertEqual(flagged.categories, {"Pornographic material", "Hate speech"})
+        clean = ModerationVerdict.from_reply(1, "No, no forbidden content found.")
+        self.assertFalse(clean.flagged)
+        self.assertTrue(clean.parsed)
+
+    def test_unreadable_reply(self):
+        verdict = ModerationVerdict.from_reply(0, "I cannot answer that.")
+        self.assertFalse(verdict.flagged)
+        self.assertFalse(verdict.parsed)
+
+    def test_document(self):
+        document = DocumentModeration([
+            ModerationVerdict(0, False),
+            ModerationVerdict(1, True, ["Violent content"]),
+            ModerationVerdict(2, True, ["Hate speech", "Violent content"]),
+        ])
+        self.assertTrue(document.flagged)
+        self.assertEqual(document.to_dict()["categories"], ["Hate speech", "Violent content"])
+
+    def test_flagged_spans_merge(self):
+        document = DocumentModeration([
+            ModerationVerdict.from_reply(0, "Yes: Hate speech", span=(0, 40)),
+            ModerationVerdict.from_reply(1, "Yes: Hate speech", span=(35, 80)),
+            ModerationVerdict.from_reply(2, "No, no forbidden content found.", span=(81, 120)),
+            ModerationVerdict.from_reply(3, "Yes: Violent content", span=(121, 160)),
+            ModerationVerdict.from_reply(4, "Yes: Violent content"),
+        ])
+        self.assertEqual(document.flagged_spans(), [(0, 80), (121, 160)])
+        self.assertEqual(document.to_dict()["chunks"][1]["span"], [35, 80])
+        self.assertIsNone(document.to_dict()["chunks"][4]["span"])
+
+
+    def test_failed_chunks_do_not_flag(self):
+        document = DocumentModeration([
+            ModerationVerdict.from_reply(0, "No, no forbidden content found."),
+            ChunkFailure(1, 'timeout', "Deadline passed.", span=(40, 80)),
+        ])
+        self.assertFalse(document.flagged)
+        self.assertEqual(document.to_dict()["failed"], [1])
+        self.assertEqual(document.to_dict()["chunks"][1],
+                         {"index": 1, "failed": "timeout", "error": "Deadline passed.",
+                          "span": [40, 80]})
+        self.assertEqual(DocumentTags([ChunkFailure(0, 'failed')]).careers, ())
+
+class TestTagVerdict(unittest.TestCase):
+
+    def setUp(self):
+        self.career_list = ["Backend Developer", "Data Scientist"]
+
+    def test_json_reply_keeps_listed_titles(self):
+        verdict = TagVerdict.from_reply(0, '{"careers": ["data scientist", "Astronaut"]}',
+                                        self.career_list)
+        self.assertEqual(verdict.careers, ("Data Scientist",))
+
+    def test_text_replies(self):
+        named = TagVerdict.from_reply(0, "Backend Developer, Data Scientist", self.career_list)
+        self.assertEqual(named.careers, ("Backend Developer", "Data Scientist"))
+        none = TagVerdict.from_reply(1, "No relevant careers found.", self.career_list)
+        self.assertEqual((none.careers, none.parsed), ((), True))
+        self.assertFalse(TagVerdict.from_reply(2, "Hmm.", self.career_list).parsed)
+
+    def test_text_replies_match_whole_titles(self):
+        career_list = ["A", "B", "Developer", "Backend Developer"]
+        clean = TagVerdict.from_reply(0, "No, no forbidden content found.", career_list)
+        self.assertEqual(clean.careers, ())
+        named = TagVerdict.from_reply(1, "Backend Developer", career_list)
+        self.assertEqual(named.careers, ("Backend Developer",))
+        both = TagVerdict.from_reply(2, "Developer; Backend Developer; B", career_list)
+        self.assertEqual(both.careers, ("B", "Developer", "Backend Developer"))
+
+    def test_document(self):
+        document = DocumentTags([TagVerdict(0, ["Data Scientist"]),
+                                 TagVerdict(1, ["Backend Developer", "Data Scientist"])])
+        self.assertEqual(document.careers, ("Data Scientist", "Backend Developer"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,357 @@
+"""
+A module that interprets the agents' replies as verdicts.
+"""
+
+import json
+import re
+from typing import Iterable, List, Optional, Sequence, Set, Tuple
+
+CLEAN_REPLY = "No, no forbidden content found."
+NO_CAREERS_REPLY = "No relevant careers found."
+
+# Appended to the agents' tasks in structured mode
+MODERATION_FORMAT = """
+Respond only with a JSON object of the form {"forbidden": ["Hate speech"]},
+listing the forbidden content types found, or an empty list if none are.
+"""
+TAGS_FORMAT = """
+Respond only with a JSON object of the form {"careers": ["Data Scientist"]},
+listing the relevant career titles, or an empty list if none are.
+"""
+
+# Stop at a blank line, which some models emit in long runs in JSON mode
+STRUCTURED_STOP = ["\n\n"]
+
+
+def is_flagged(response: str) -> bool:
+    """
+    Tells whether a ContentGuard reply reports forbidden content.
+
+    Parameters:
+    response (str): A reply such as 'Yes: Hate speech' or
+        'No, no forbidden content found.'
+
+    Returns:
+    bool: True if the reply starts with 'Yes'.
+    """
+    return response.strip().lower().startswith("yes")
+
+
+def parse_combined_reply(response: str) -> Optional[Tuple[List[str], List[str]]]:
+    """
+    Reads a combined moderation and tagging reply.
+
+    Parameters:
+    response (str): A JSON object such as
+        '{"forbidden": ["Hate speech"], "careers": ["Data Scientist"]}'.
+
+    Returns:
+    Optional[Tuple[List[str], List[str]]]: The forbidden content types and
+        the relevant careers, or None if the reply is not such an object.
+    """
+    forbidden = _json_list(response, "forbidden")
+    careers = _json_list(response, "careers")
+    if forbidden is None or careers is None:
+        return None
+    return forbidden, careers
+
+
+def _json_list(response: str, name: str) -> Optional[List[str]]:
+    # The named list of strings in a JSON object reply, or None
+    try:
+        reply = json.loads(response)
+    except ValueError:
+        return None
+    values = reply.get(name) if isinstance(reply, dict) else None
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        return None
+    return [value.strip() for value in values if value.strip()]
+
+
+def _titles_in(text: str, career_list: Sequence[str]) -> Set[str]:
+    """
+    Finds the career titles named in lower-cased free text.
+
+    Titles only match as whole words, and the longest titles claim their
+    text first, so "Developer" is not found inside "Backend Developer".
+    """
+    matched: Set[str] = set()
+    claimed: List[Tuple[int, int]] = []
+    for career in sorted({career.lower() for career in career_list}, key=len, reverse=True):
+        pattern = re.compile(rf"(?<!\w){re.escape(career)}(?!\w)")
+        for match in pattern.finditer(text):
+            start, end = match.span()
+            if not any(start < other_end and other_start < end
+                       for other_start, other_end in claimed):
+                claimed.append((start, end))
+                matched.add(career)
+    return matched
+
+
+class ModerationVerdict:
+    """
+    Moderation verdict for one chunk.
+
+    Attributes:
+        index (int): The position of the chunk in the document.
+        flagged (bool): Whether the chunk contains forbidden content.
+        categories (frozenset): The forbidden content types found.
+        parsed (bool): Whether the reply could be read. Unreadable replies
+        are reported as not flagged.
+        span (tuple): The (start, end) offsets of the chunk in the source,
+        or None if they are not known.
+    """
+
+    __slots__ = ("index", "flagged", "categories", "parsed", "span")
+
+    def __init__(self, index: int, flagged: bool, categories: Iterable[str] = (),
+                 parsed: bool = True, span: Optional[Tuple[int, int]] = None):
+        self.index = index
+        self.flagged = flagged
+        self.categories = frozenset(categories)
+        self.parsed = parsed
+        self.span = span
+
+    @classmethod
+    def from_reply(cls, index: int, response: str,
+                   span: Optional[Tuple[int, int]] = None) -> "ModerationVerdict":
+        """
+        Reads a JSON reply, or a 'Yes: ...' / 'No, ...' text reply.
+        """
+        categories = _json_list(response, "forbidden")
+        if categories is not None:
+            return cls(index, bool(categories), categories, span=span)
+        text = response.strip()
+        if is_flagged(text):
+            _, _, found = text.partition(":")
+            return cls(index, True, (c.strip(" .") for c in found.split(",") if c.strip(" .")),
+                       span=span)
+        return cls(index, False, parsed=text.lower().startswith("no"), span=span)
+
+    def to_dict(self):
+        """
+        Returns the JSON-serialisable view of the verdict.
+        """
+        return {"index": self.index, "flagged": self.flagged,
+                "categories": sorted(self.categories), "parsed": self.parsed,
+                "span": list(self.span) if self.span else None}
+
+    def __repr__(self):
+        return (f"ModerationVerdict(index={self.index!r}, flagged={self.flagged!r}, "
+                f"categories={sorted(self.categories)!r})")
+
+
+class TagVerdict:
+    """
+    Career tags for one chunk.
+
+    Attributes:
+        index (int): The position of the chunk in the document.
+        careers (tuple): The matched titles from the career list, in list
+        order.
+        parsed (bool): Whether the reply could be read.
+        span (tuple): The (start, end) offsets of the chunk in the source,
+        or None if they are not known.
+    """
+
+    __slots__ = ("index", "careers", "parsed", "span")
+
+    def __init__(self, index: int, careers: Iterable[str] = (), parsed: bool = True,
+                 span: Optional[Tuple[int, int]] = None):
+        self.index = index
+        self.careers = tuple(careers)
+        self.parsed = parsed
+        self.span = span
+
+    @classmethod
+    def from_reply(cls, index: int, response: str, career_list: Sequence[str],
+                   span: Optional[Tuple[int, int]] = None) -> "TagVerdict":
+        """
+        Reads a JSON or free-text reply, keeping only titles from the
+        career list.
+        """
+        named = _json_list(response, "careers")
+        parsed = named is not None
+        if named is None:
+            # Free text: look for the titles themselves
+            text = response.lower()
+            matched = _titles_in(text, career_list)
+            parsed = bool(matched) or NO_CAREERS_REPLY.lower().rstrip(".") in text
+        else:
+            matched = {career.lower() for career in named}
+        return cls(index, (career for career in career_list if career.lower() in matched),
+                   parsed, span)
+
+    def to_dict(self):
+        """
+        Returns the JSON-serialisable view of the verdict.
+        """
+        return {"index": self.index, "careers": list(self.careers), "parsed": self.parsed,
+                "span": list(self.span) if self.span else None}
+
+    def __repr__(self):
+        return f"TagVerdict(index={self.index!r}, careers={self.careers!r})"
+
+
+class ChunkFailure:
+    """
+    Marks a chunk that got no verdict, in results that keep the chunks
+    that did.
+
+    It reads as an unflagged, untagged and unparsed verdict, so documents
+    can be summed up over the chunks that were analysed; check the
+    documents' failed list before trusting a clean verdict.
+
+    Attributes:
+        index (int): The position of the chunk in the document.
+        reason (str): 'failed' when the request raised or the circuit was
+        open, 'timeout' when it ran out of time.
+        error (str): A description of what went wrong.
+        span (tuple): The (start, end) offsets of the chunk in the source,
+        or None if they are not known.
+    """
+
+    __slots__ = ("index", "reason", "error", "span")
+
+    flagged = False
+    categories = frozenset()
+    careers = ()
+    parsed = False
+
+    def __init__(self, index: int, reason: str, error: Optional[str] = None,
+                 span: Optional[Tuple[int, int]] = None):
+        self.index = index
+        self.reason = reason
+        self.error = error
+        self.span = span
+
+    def to_dict(self):
+        """
+        Returns the JSON-serialisable view of the failure.
+        """
+        return {"index": self.index, "failed": self.reason, "error": self.error,
+                "span": list(self.span) if self.span else None}
+
+    def __repr__(self):
+        return f"ChunkFailure(index={self.index!r}, reason={self.reason!r})"
+
+
+class DocumentModeration:
+    """
+    Moderation verdicts of a document.
+
+    Attributes:
+        flagged (bool): Whether any chunk contained forbidden content.
+        categories (frozenset): The forbidden content types found in any chunk.
+        chunks (list): The ModerationVerdict of each analysed chunk, or its
+        ChunkFailure.
+        failed (list): The ChunkFailure of each chunk that got no verdict.
+    """
+
+    __slots__ = ("flagged", "categories", "chunks", "failed")
+
+    def __init__(self, chunks: List[ModerationVerdict]):
+        self.chunks = chunks
+        self.flagged = any(verdict.flagged for verdict in chunks)
+        self.categories = frozenset().union(*(verdict.categories for verdict in chunks))
+        self.failed = [verdict for verdict in chunks if isinstance(verdict, ChunkFailure)]
+
+    def flagged_spans(self) -> List[Tuple[int, int]]:
+        """
+        Returns the source offsets of the flagged chunks, with overlapping
+        or adjacent ones merged, for highlighting or redaction. Chunks
+        without offsets are left out.
+        """
+        merged: List[List[int]] = []
+        for start, end in sorted(verdict.span for verdict in self.chunks
+                                 if verdict.flagged and verdict.span):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return [tuple(span) for span in merged]
+
+    def to_dict(self):
+        """
+        Returns the JSON-serialisable view of the verdicts.
+        """
+        return {"flagged": self.flagged, "categories": sorted(self.categories),
+                "chunks": [verdict.to_dict() for verdict in self.chunks],
+                "failed": [failure.index for failure in self.failed]}
+
+    def __repr__(self):
+        return (f"DocumentModeration(flagged={self.flagged!r}, "
+                f"categories={sorted(self.categories)!r}, chunks={len(self.chunks)!r})")
+
+
+class DocumentTags:
+    """
+    Career tags of a document.
+
+    Attributes:
+        careers (tuple): The titles matched in any chunk, in order of
+        first appearance.
+        chunks (list): The TagVerdict of each chunk, or its ChunkFailure.
+        failed (list): The ChunkFailure of each chunk that got no tags.
+    """
+
+    __slots__ = ("careers", "chunks", "failed")
+
+    def __init__(self, chunks: List[TagVerdict]):
+        self.chunks = chunks
+        self.careers = tuple(dict.fromkeys(
+            career for verdict in chunks for career in verdict.careers))
+        self.failed = [verdict for verdict in chunks if isinstance(verdict, ChunkFailure)]
+
+    def to_dict(self):
+        """
+        Returns the JSON-serialisable view of the tags.
+        """
+        return {"careers": list(self.careers),
+                "chunks": [verdict.to_dict() for verdict in self.chunks],
+                "failed": [failure.index for failure in self.failed]}
+
+    def __repr__(self):
+        return f"DocumentTags(careers={self.careers!r}, chunks={len(self.chunks)!r})"
+
+
+class DocumentVerdict:
+    """
+    Document-level moderation verdict.
+
+    Attributes:
+        flagged (bool): Whether any chunk contained forbidden content.
+        chunk_index (int): The index of the earliest flagged chunk, or
+        None if nothing was flagged.
+        response (str): The reply for that chunk, or None.
+        chunks_analysed (int): The number of chunks that finished before
+        the verdict was reached.
+        span (tuple): The (start, end) offsets of the flagged chunk in the
+        source, or None.
+        chunks_failed (int): The number of chunks that got no verdict, in
+        partial results.
+    """
+
+    __slots__ = ("flagged", "chunk_index", "response", "chunks_analysed", "span",
+                 "chunks_failed")
+
+    def __init__(self, flagged: bool, chunk_index: Optional[int] = None,
+                 response: Optional[str] = None, chunks_analysed: int = 0,
+                 span: Optional[Tuple[int, int]] = None, chunks_failed: int = 0):
+        self.flagged = flagged
+        self.chunk_index = chunk_index
+        self.response = response
+        self.chunks_analysed = chunks_analysed
+        self.span = span
+        self.chunks_failed = chunks_failed
+
+    def to_dict(self):
+        """
+        Returns the JSON-serialisable view of the verdict.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return (f"DocumentVerdict(flagged={self.flagged!r}, "
+                f"chunk_index={self.chunk_index!r}, response={self.response!r}, "
+                f"chunks_analysed={self.chunks_analysed!r})")